@@ -0,0 +1,13 @@
+"""
+Benchmarks for the analyze, upload and training hot paths.
+
+    python -m benchmarks run --sizes 10,1000,100000 --out results.json
+    python -m benchmarks compare before.json after.json
+    python -m benchmarks imports --budget-ms 500
+
+Synthetic datasets are generated into a temporary directory and the bluvia
+environment variables are pointed at it before bluvia is imported, so a run
+never touches the real data or model. `imports` times `import bluvia.api`
+in fresh interpreters and fails if it is over budget or loads pandas,
+scikit-learn or another heavy dependency (see benchmarks.imports).
+"""
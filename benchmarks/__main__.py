@@ -0,0 +1,91 @@
+import os
+import sys
+import argparse
+import tempfile
+from pathlib import Path
+
+from .datagen import write_dataset
+from .harness import compare, write_results
+
+LOAD_SCENARIOS = ["analyze", "analyze_se", "analyze_batch", "industries", "upload"]
+
+
+def _sizes(text: str):
+    return [int(float(s)) for s in text.split(",") if s.strip()]
+
+
+def run(args) -> None:
+    root = Path(args.workdir or tempfile.mkdtemp(prefix="bluvia-bench-"))
+    load_dir = root / "load"
+    write_dataset(load_dir, args.load_size, args.seed)
+    # bluvia reads these at import time, so they are set before anything imports it
+    os.environ.update({
+        "BLUVIA_DATA_DIR": str(load_dir),
+        "BLUVIA_USER_DATA_PATH": str(load_dir / "user_data.csv"),
+        "BLUVIA_MODEL_PATH": str(root / "model.joblib"),
+        "BLUVIA_TILES_DIR": str(root / "tiles"),
+        "BLUVIA_RETRAIN_ON_UPLOAD": "0",
+        "BLUVIA_BUILD_TILES_ON_STARTUP": "0",
+        "BLUVIA_ANALYZE_CACHE": "1" if args.cache else "0",
+    })
+    os.environ.pop("BLUVIA_CACHE_PATH", None)
+    from .micro import run_micro, train_model
+
+    print(f"Working directory: {root}")
+    train_model(root / "model.joblib", seed=args.seed)
+
+    results = []
+    if not args.skip_micro:
+        results += run_micro(root, _sizes(args.sizes), args.max_train_rows, args.seed, args.repeat)
+    if not args.skip_load:
+        from .load import run_load
+
+        names = [s for s in args.scenarios.split(",") if s]
+        results += run_load(names, args.requests, args.concurrency, args.seed)
+    path = write_results(args.out, results, vars(args))
+    print(f"Results written to {path}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Bluvia performance benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="generate data, run the benchmarks and write JSON results")
+    p.add_argument("--sizes", default="10,1000,100000", help="comma separated row counts (10 to 1e6)")
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--workdir", help="where synthetic data goes (default: a new temp dir)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=200, help="calls per micro-benchmark")
+    p.add_argument("--max-train-rows", type=int, default=100000, help="largest size retrain_gb_model is timed at")
+    p.add_argument("--load-size", type=int, default=10000, help="rows in the dataset the app is loaded with")
+    p.add_argument("--requests", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--scenarios", default=",".join(LOAD_SCENARIOS))
+    p.add_argument("--cache", action="store_true", help="leave the /api/analyze response cache on")
+    p.add_argument("--skip-micro", action="store_true")
+    p.add_argument("--skip-load", action="store_true")
+
+    p = sub.add_parser("compare", help="compare two result files (after / before ratios)")
+    p.add_argument("before")
+    p.add_argument("after")
+
+    p = sub.add_parser("imports", help="check the import time of the API against a budget")
+    p.add_argument("--module", default="bluvia.api")
+    p.add_argument("--budget-ms", type=float, help="default: BLUVIA_IMPORT_BUDGET_MS or 500")
+    p.add_argument("--runs", type=int, default=3, help="fresh interpreters to take the fastest of")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+    elif args.command == "imports":
+        from .imports import IMPORT_BUDGET_MS, check_budget
+
+        budget = IMPORT_BUDGET_MS if args.budget_ms is None else args.budget_ms
+        return 0 if check_budget(args.module, budget, args.runs) else 1
+    else:
+        compare(args.before, args.after)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
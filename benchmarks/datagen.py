@@ -0,0 +1,74 @@
+import csv
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Union
+
+BASE_CSV = Path(__file__).resolve().parent.parent / "bluvia" / "Bluvia_csv" / "master_csv.csv"
+METALS = ["Fe", "Cr", "Mn", "Mo", "In", "Ta"]
+INDUSTRY_TYPES = [
+    "Metal Fabrication", "Auto Repair", "Wastewater Treatment", "E-waste Recycling", "Landfill / Dump",
+    "Raceways / Tracks", "Construction Site", "Battery Recycling", "Airport", "Chemical Plant",
+    "Mining Site", "Oil/Gas Facility", "Stormwater Outfall"]
+
+
+def _base() -> pd.DataFrame:
+    return pd.read_csv(BASE_CSV)
+
+
+def bounds(padding: float = 0.05):
+    """(south, west, north, east) of the shipped master_csv.csv plus padding."""
+    base = _base()
+    return (base["lat"].min() - padding, base["lon"].min() - padding,
+            base["lat"].max() + padding, base["lon"].max() + padding)
+
+
+def random_points(n: int, rng: np.random.RandomState):
+    south, west, north, east = bounds()
+    return rng.uniform(south, north, n), rng.uniform(west, east, n)
+
+
+def master_frame(n: int, rng: np.random.RandomState) -> pd.DataFrame:
+    """`n` rows in the master_csv.csv schema: real rows resampled, coordinates and values jittered."""
+    base = _base()
+    rows = base.iloc[rng.randint(0, len(base), n)].reset_index(drop=True)
+    rows["lat"] += rng.normal(0, 0.02, n)
+    rows["lon"] += rng.normal(0, 0.02, n)
+    for col in [c for c in rows.columns if c not in ("lat", "lon")]:
+        rows[col] = rows[col] * rng.lognormal(0, 0.25, n)
+    return rows
+
+
+def user_data_frame(n: int, rng: np.random.RandomState) -> pd.DataFrame:
+    """`n` uploaded samples with the user_data.csv columns (Lat, Lon, SEM_<metal>_ppm)."""
+    master = master_frame(n, rng)
+    frame = pd.DataFrame({"Lat": master["lat"], "Lon": master["lon"]})
+    for metal in METALS:
+        frame[f"SEM_{metal}_ppm"] = master[f"{metal.lower()}_ppm"]
+    return frame
+
+
+def industries_frame(n: int, rng: np.random.RandomState) -> pd.DataFrame:
+    lats, lons = random_points(n, rng)
+    return pd.DataFrame({"Industry_Type": rng.choice(INDUSTRY_TYPES, n), "Latitude": lats, "Longitude": lons})
+
+
+def write_dataset(directory: Union[str, Path], n: int, seed: int = 0) -> Dict[str, Path]:
+    """
+    Write master_csv.csv, user_data.csv and industry_locations.csv with `n`
+    rows each (plus the base soil_sem_data.csv) into `directory`.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    paths = {
+        "master": directory / "master_csv.csv",
+        "user_data": directory / "user_data.csv",
+        "industries": directory / "industry_locations.csv",
+        "soil": directory / "soil_sem_data.csv",
+    }
+    master_frame(n, rng).to_csv(paths["master"], index=False)
+    user_data_frame(n, rng).to_csv(paths["user_data"], index=False, quoting=csv.QUOTE_MINIMAL)
+    industries_frame(n, rng).to_csv(paths["industries"], index=False)
+    _base().to_csv(paths["soil"], index=False)
+    return paths
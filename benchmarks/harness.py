@@ -0,0 +1,109 @@
+import gc
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+
+def summarize(latencies_s: List[float], wall_s: float, calls: int, items: int = 1) -> Dict[str, Any]:
+    lat_ms = np.asarray(latencies_s) * 1000.0
+    return {
+        "calls": calls,
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "mean_ms": float(lat_ms.mean()),
+        "max_ms": float(lat_ms.max()),
+        "throughput_per_s": calls * items / wall_s if wall_s > 0 else None,
+    }
+
+
+def peak_memory(fn: Callable[[], Any], repeat: int = 1) -> int:
+    """Peak bytes allocated by Python and numpy while running `fn` `repeat` times."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name: str, fn: Callable[[], Any], size: int, repeat: int = 200, warmup: int = 5,
+            max_seconds: float = 10.0, items: int = 1, params: Optional[Dict[str, Any]] = None,
+            memory: bool = True, memory_repeat: int = 3) -> Dict[str, Any]:
+    """
+    Time `fn` call by call (stopping early after `max_seconds`), then run it
+    again under tracemalloc for the peak. `items` is the work per call, so
+    throughput is items/s (e.g. points for a batch prediction).
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+        if time.perf_counter() - start > max_seconds:
+            break
+    wall = time.perf_counter() - start
+    result = {"name": name, "size": size, "params": params or {}}
+    result.update(summarize(latencies, wall, len(latencies), items))
+    result["peak_mem_bytes"] = peak_memory(fn, repeat=min(memory_repeat, len(latencies))) if memory else None
+    print(f"{name:<32} n={size:<8} p50={result['p50_ms']:9.3f}ms p99={result['p99_ms']:9.3f}ms "
+          f"thr={result['throughput_per_s'] or 0:12.1f}/s")
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    import os
+    import sklearn
+    import pandas
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pandas.__version__,
+        "sklearn": sklearn.__version__,
+        "commit": commit,
+    }
+
+
+def write_results(path: Union[str, Path], results: List[Dict[str, Any]], args: Dict[str, Any]) -> Path:
+    path = Path(path)
+    payload = {"created_at": time.time(), "environment": environment(), "args": args, "results": results}
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+    return path
+
+
+def compare(before_path: Union[str, Path], after_path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """Match results by (name, size) and print p50/p99/peak-memory ratios (after / before)."""
+    with open(before_path) as f:
+        before = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = json.load(f)["results"]
+    rows = []
+    print(f"{'benchmark':<32} {'n':>8} {'p50 x':>8} {'p99 x':>8} {'mem x':>8}")
+    for r in after:
+        old = before.get((r["name"], r["size"]))
+        if old is None:
+            continue
+        ratio = {k: (r[k] / old[k]) if r.get(k) and old.get(k) else None
+                 for k in ("p50_ms", "p99_ms", "peak_mem_bytes")}
+        rows.append({"name": r["name"], "size": r["size"], **ratio})
+        print(f"{r['name']:<32} {r['size']:>8} " + " ".join(
+            f"{v:8.2f}" if v is not None else f"{'-':>8}" for v in ratio.values()))
+    return rows
@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Tuple
+
+# Modules importing the API must not pull in: they are loaded lazily or by
+# bluvia.api.warmup after the server has started
+HEAVY_MODULES = ("pandas", "sklearn", "scipy", "joblib", "geopy", "river")
+IMPORT_BUDGET_MS = float(os.environ.get("BLUVIA_IMPORT_BUDGET_MS", "500"))
+_MARKER = "-- bluvia import probe --"
+
+_PROBE = """
+import sys, json, time
+print("{marker}", file=sys.stderr, flush=True)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    """(depth, cumulative microseconds, module) per `-X importtime` line."""
+    entries = []
+    # only what the probe itself imports, not interpreter start-up
+    stderr = stderr.split(_MARKER, 1)[-1]
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|", 2)
+        module = name.strip()
+        # names are indented two spaces per nesting level, after one separator space
+        depth = (len(name.rstrip()) - len(module) - 1) // 2
+        entries.append((depth, int(cumulative_us), module))
+    return entries
+
+
+def measure_imports(module: str = "bluvia.api", runs: int = 3) -> Dict[str, Any]:
+    """
+    Import `module` in fresh interpreters, `runs` times. Reports the fastest
+    wall time, the heavy modules it loaded and its slowest direct imports.
+    """
+    with tempfile.TemporaryDirectory(prefix="bluvia-imports-") as tmp:
+        env = dict(os.environ, BLUVIA_DATA_DIR=tmp, BLUVIA_USER_DATA_PATH=os.path.join(tmp, "user_data.csv"),
+                   BLUVIA_MODEL_PATH=os.path.join(tmp, "model.joblib"), BLUVIA_TILES_DIR=os.path.join(tmp, "tiles"))
+        env.pop("BLUVIA_CACHE_PATH", None)
+        samples = []
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, marker=_MARKER)],
+                                  capture_output=True, text=True, env=env, check=True)
+            samples.append((json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr))
+    result, stderr = min(samples, key=lambda s: s[0]["seconds"])
+    loaded = set(result["modules"])
+    entries = _parse_importtime(stderr)
+    top = sorted((e for e in entries if e[0] <= 1 and e[2] != module), key=lambda e: -e[1])[:10]
+    return {
+        "module": module,
+        "ms": result["seconds"] * 1000,
+        "heavy": [m for m in HEAVY_MODULES if m in loaded],
+        "slowest": [{"module": name, "ms": us / 1000} for _, us, name in top],
+    }
+
+
+def check_budget(module: str = "bluvia.api", budget_ms: float = IMPORT_BUDGET_MS, runs: int = 3) -> bool:
+    """Print the import cost of `module`; False if it is over budget or loads a heavy module."""
+    result = measure_imports(module, runs)
+    print(f"import {module}: {result['ms']:.1f}ms (budget {budget_ms:.0f}ms)")
+    for entry in result["slowest"]:
+        print(f"  {entry['module']:<40} {entry['ms']:9.1f}ms")
+    ok = True
+    if result["ms"] > budget_ms:
+        print(f"FAIL: import time over budget by {result['ms'] - budget_ms:.1f}ms")
+        ok = False
+    if result["heavy"]:
+        print(f"FAIL: importing {module} loads {', '.join(result['heavy'])}; import them lazily")
+        ok = False
+    return ok
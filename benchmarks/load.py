@@ -0,0 +1,150 @@
+import json
+import time
+import asyncio
+import tracemalloc
+import numpy as np
+from typing import Any, Callable, Dict, List, Tuple
+
+from .datagen import random_points, user_data_frame
+from .harness import summarize
+
+
+class ASGIClient:
+    """
+    Minimal in-process HTTP/1.1 client that calls an ASGI app directly, so
+    the load test measures the app (routing, validation, handlers) without
+    sockets or a server in the way.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, url: str, body: bytes = b"",
+                      headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> Tuple[int, bytes]:
+        path, _, query = url.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"bench"), (b"content-length", str(len(body)).encode()), *headers],
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        done = asyncio.Event()
+        sent_body = False
+        status = 0
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    async def post_json(self, url: str, payload: Any) -> Tuple[int, bytes]:
+        return await self.request("POST", url, json.dumps(payload).encode(),
+                                  ((b"content-type", b"application/json"),))
+
+    async def post_file(self, url: str, name: str, content: bytes) -> Tuple[int, bytes]:
+        boundary = "bluviabenchboundary"
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+                f"Content-Type: text/csv\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+        return await self.request("POST", url, body,
+                                  ((b"content-type", f"multipart/form-data; boundary={boundary}".encode()),))
+
+
+def scenarios(seed: int = 0, batch_points: int = 1000, upload_rows: int = 100) -> Dict[str, Callable]:
+    """name -> coroutine factory taking (client, i)."""
+    rng = np.random.RandomState(seed)
+    lats, lons = random_points(10000, rng)
+    batch = [{"lat": float(a), "lng": float(b)} for a, b in zip(*random_points(batch_points, rng))]
+    upload = user_data_frame(upload_rows, rng).to_csv(index=False).encode()
+
+    def point(i):
+        return {"lat": float(lats[i % len(lats)]), "lng": float(lons[i % len(lons)])}
+
+    return {
+        "analyze": lambda c, i: c.post_json("/api/analyze", point(i)),
+        "analyze_se": lambda c, i: c.post_json("/api/analyze", {**point(i), "include_se": True}),
+        "analyze_batch": lambda c, i: c.post_json("/api/analyze/batch", {"points": batch}),
+        "industries": lambda c, i: c.request("GET", "/api/industries?lat={lat}&lng={lng}".format(**point(i))),
+        "upload": lambda c, i: c.post_file("/api/upload", "bench.csv", upload),
+    }
+
+
+async def _drive(client: ASGIClient, make, requests: int, concurrency: int):
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            status, _ = await make(client, i)
+            latencies.append(time.perf_counter() - t0)
+            errors += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+async def _run(app, names: List[str], requests: int, concurrency: int, seed: int,
+               memory_requests: int) -> List[Dict[str, Any]]:
+    from bluvia.api import warmup
+
+    client = ASGIClient(app)
+    await app.router.startup()
+    warmup.run()  # startup only starts it; measure with everything loaded
+    try:
+        results = []
+        available = scenarios(seed)
+        for name in names:
+            make = available[name]
+            await make(client, 0)  # warm-up
+            latencies, wall, errors = await _drive(client, make, requests, concurrency)
+            tracemalloc.start()
+            try:
+                await _drive(client, make, memory_requests, concurrency)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            result = {"name": f"load:{name}", "size": requests,
+                      "params": {"concurrency": concurrency, "errors": errors}}
+            result.update(summarize(latencies, wall, len(latencies)))
+            result["peak_mem_bytes"] = peak
+            print(f"{result['name']:<32} c={concurrency:<4} p50={result['p50_ms']:9.3f}ms "
+                  f"p99={result['p99_ms']:9.3f}ms thr={result['throughput_per_s']:10.1f}/s errors={errors}")
+            results.append(result)
+        return results
+    finally:
+        await app.router.shutdown()
+
+
+def run_load(names: List[str], requests: int = 500, concurrency: int = 16, seed: int = 0,
+             memory_requests: int = 50) -> List[Dict[str, Any]]:
+    """End-to-end load test of bluvia.api.app, one scenario after another."""
+    from bluvia.api import app
+
+    return asyncio.run(_run(app, names, requests, concurrency, seed, memory_requests))
@@ -0,0 +1,94 @@
+import itertools
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .datagen import master_frame, random_points, write_dataset
+from .harness import measure
+
+
+def train_model(model_path: Path, rows: int = 2000, seed: int = 0):
+    """Train the model the benchmarks predict with, on synthetic master rows."""
+    from bluvia.Bluvia_src.Bluvia_Upload import retrain_gb_model
+    from bluvia.schema import training_frames
+
+    X, Y = training_frames(master_frame(rows, np.random.RandomState(seed)))
+    return retrain_gb_model(X, Y, model_path, add_estimators=0)
+
+
+def _points(n: int, seed: int):
+    lats, lons = random_points(n, np.random.RandomState(seed))
+    return itertools.cycle(list(zip(lats.tolist(), lons.tolist())))
+
+
+def run_micro(root: Path, sizes: List[int], max_train_rows: int = 100000, seed: int = 0,
+              repeat: int = 200) -> List[Dict[str, Any]]:
+    from bluvia.model import (METALS, UserDataIndex, get_registry, predict_metals, predict_metals_batch,
+                              update_metals_with_user_data)
+    from bluvia.schema import load_csv
+    from bluvia.uncertainty import StandardErrorIndex
+    from bluvia.ingest import UploadParser
+    from bluvia.Bluvia_src import Bluvia_Analysis as ba
+    from bluvia.Bluvia_src.Bluvia_Upload import retrain_gb_model
+
+    results = []
+    points = _points(1000, seed)
+    model = get_registry().get()
+
+    results.append(measure("predict_metals", lambda: predict_metals(*next(points)), size=1, repeat=repeat))
+    batch_lats, batch_lons = random_points(1000, np.random.RandomState(seed))
+    results.append(measure("predict_metals_batch", lambda: predict_metals_batch(batch_lats, batch_lons),
+                           size=1000, repeat=repeat, items=1000))
+
+    for n in sizes:
+        paths = write_dataset(root / f"n{n}", n, seed)
+
+        results.append(measure("schema_load_csv", lambda: load_csv(paths["master"], cache=False),
+                               size=n, repeat=5, warmup=1, items=n))
+
+        results.append(measure("user_index_load", lambda: UserDataIndex(paths["user_data"]).load(),
+                               size=n, repeat=5, warmup=1, items=n))
+        index = UserDataIndex(paths["user_data"]).load()
+        predictions = dict(zip(METALS, [0.0] * len(METALS)))
+        results.append(measure("update_metals_with_user_data",
+                               lambda: update_metals_with_user_data(dict(predictions), index, *next(points)),
+                               size=n, repeat=repeat))
+
+        def build_industries():
+            ba._industry_index = None
+            return ba.get_industry_index()
+
+        ba.industry_df = pd.read_csv(paths["industries"])
+        results.append(measure("industry_index_build", build_industries, size=n, repeat=5, warmup=1, items=n))
+        results.append(measure("detect_nearby_industries", lambda: ba.detect_nearby_industries(*next(points)),
+                               size=n, repeat=repeat))
+
+        data = load_csv(paths["master"]).with_coordinates()
+        values = np.nan_to_num(data.values, nan=0.0)
+        results.append(measure("se_index_build", lambda: StandardErrorIndex(model, data.lat, data.lon, values),
+                               size=n, repeat=5, warmup=1, items=n))
+        x, y = ba.creating_New_training_data(paths["master"])
+        model_path = str(get_registry().path)
+        results.append(measure("find_SE", lambda: ba.find_SE(*next(points), model_path, x, y),
+                               size=n, repeat=repeat))
+
+        payload = paths["user_data"].read_bytes()
+
+        def parse_upload(chunk=1 << 20):
+            parser = UploadParser()
+            for start in range(0, len(payload), chunk):
+                parser.feed(payload[start:start + chunk])
+            parser.feed(b"", final=True)
+            return parser
+
+        results.append(measure("upload_parse", parse_upload, size=n, repeat=5, warmup=1, items=n))
+
+        if n <= max_train_rows:
+            X, Y = ba.creating_New_training_data(paths["master"])
+            scratch = root / f"n{n}" / "retrain.joblib"
+            results.append(measure("retrain_gb_model", lambda: retrain_gb_model(X, Y, scratch, add_estimators=0),
+                                   size=n, repeat=3, warmup=0, items=n, memory_repeat=1))
+        else:
+            print(f"retrain_gb_model skipped for n={n} (> --max-train-rows {max_train_rows})")
+    return results
@@ -4,14 +4,16 @@ User input: lat, lon
 call fuctions:
 
 detected_industries=detect_nearby_industries(lat, lon)
-    detected_industries is a list of all industries in a 3 km rd
+    detected_industries is a list of all industries in a 3 km rd, nearest first,
+    each as {"type", "distance_km", "lat", "lon"}
 
 
 prediction = ai_prediction(lat, lon, model_save_path)
 
 x, y_true = creating_New_training_data(master_csv_file)
 
-SE_per_target = find_SE(lat, lon, model_save_path, x, y_true):
+SE_per_target = find_SE(lat, lon, model_save_path, x, y_true)
+    x and y_true are optional; without them the master dataset is used
 
 risk_scores = calculate_risk_scores(prediction, lat, lon)
 
@@ -22,12 +24,14 @@ output:
     detected_industries
 '''
 
-import pandas as pd
 import os
-import joblib
-from geopy.distance import geodesic
 
-from .path_utils import get_data_path, get_model_path
+from ..path_utils import get_data_path, get_model_path
+from ..model import METALS, get_registry
+from ..uncertainty import StandardErrorIndex, get_se_index, training_arrays
+from ..geo import RadiusIndex
+from ..schema import training_frames
+from ..risk import risk_scores
 
 industry_location_file = get_data_path("industry_locations.csv")
 soil_sem_data = get_data_path("soil_sem_data.csv")
@@ -36,136 +40,89 @@ master_csv_file = get_data_path("master_csv.csv")
 
 
 
-if os.path.exists(industry_location_file):
-    industry_df = pd.read_csv(industry_location_file)
-else:
-    print(" Error: Missing industry locations file: "+str(industry_location_file))
+# Read on first use (see get_industry_df) so importing this module stays cheap
+industry_df = None
+
+def get_industry_df():
+    global industry_df
+    if industry_df is None:
+        import pandas as pd
+        if os.path.exists(industry_location_file):
+            industry_df = pd.read_csv(industry_location_file)
+        else:
+            print(" Error: Missing industry locations file: "+str(industry_location_file))
+            industry_df = pd.DataFrame(columns=["Industry_Type", "Latitude", "Longitude"])
+    return industry_df
 
 industry_types = [
     "Metal Fabrication","Auto Repair","Wastewater Treatment","E-waste Recycling","Landfill / Dump",
     "Raceways / Tracks", "Construction Site","Battery Recycling", "Airport","Chemical Plant",
     "Mining Site","Oil/Gas Facility","Stormwater Outfall"]
 
-def detect_nearby_industries(lat, lon):
-    user_location = (lat, lon)
-    detected_industries = []
-    for _, row in industry_df.iterrows():
-        industry_location = (row["Latitude"], row["Longitude"])
-        distance = geodesic(user_location, industry_location).km
-        if distance <= 3:
-            industry_type = row["Industry_Type"]
-            if industry_type in industry_types:
-                detected_industries.append(industry_type)
-    if len(detected_industries)==0:
-        print("Detected nearby Industries:")
-        print("None")
-    else:
-        return detected_industries
+_industry_index = None
+
+def get_industry_index():
+    # Built once from industry_df, keeping only the recognised industry types
+    global _industry_index
+    if _industry_index is None:
+        df = get_industry_df()
+        known = df[df["Industry_Type"].isin(industry_types)]
+        _industry_index = RadiusIndex(known["Latitude"].to_numpy(dtype=float),
+                                      known["Longitude"].to_numpy(dtype=float),
+                                      labels=known["Industry_Type"].to_numpy(dtype=object))
+    return _industry_index
+
+def detect_nearby_industries(lat, lon, radius_km=3):
+    index = get_industry_index()
+    idx, distances = index.within(lat, lon, radius_km)
+    return [
+        {
+            "type": index.labels[i],
+            "distance_km": round(float(d), 3),
+            "lat": float(index.lats[i]),
+            "lon": float(index.lons[i]),
+        }
+        for i, d in zip(idx.tolist(), distances.tolist())
+    ]
 
 
 def creating_New_training_data(new_csv_file):
-    data_file = pd.read_csv(new_csv_file)
-    data_file.columns = data_file.columns.str.strip().str.lower()
-    data_file = data_file.rename(columns={
-    'fe': 'Fe_ppm', 'cr': 'Cr_ppm', 'mn': 'Mn_ppm',
-    'mo': 'Mo_ppm', 'in': 'In_ppm', 'ta': 'Ta_ppm'})
-    if 'lat' not in data_file.columns or 'lon' not in data_file.columns:
-        if "latitude" not in data_file.columns or "longitude" not in data_file.columns:
-            raise ValueError("New CSV must contain 'lat' and 'lon' columns")
-    else:
-        if 'lat'  in data_file.columns and 'lon'  in data_file.columns:
-            target_columns = data_file.drop(columns=["lat", "lon"]).columns
-            X_New = data_file[["lat", "lon"]].copy()
-        elif "latitude" not in data_file.columns or "longitude" not in data_file.columns:
-            target_columns = data_file.drop(columns=["latitude", "longitude"]).columns
-            X_New = data_file[["latitude", "longitude"]].copy()
-    Y_New = data_file[target_columns].copy()
-    Y_New = Y_New.apply(pd.to_numeric, errors='coerce')
-    if Y_New.isnull().values.any():
-        Y_New = Y_New.fillna(0)
-    return X_New, Y_New
+    # CSV path or ColumnStore; the parsed dataset is cached by bluvia.schema,
+    # so repeated calls on an unchanged file do no CSV parsing
+    return training_frames(new_csv_file)
 
     
 def ai_prediction(lat, lon, model_save_path):
-    gb_model = joblib.load(model_save_path)
+    gb_model = get_registry(model_save_path).get()
+    import pandas as pd
     input_data = pd.DataFrame([[lat, lon]], columns=['lat', 'lon'])
     prediction_array = gb_model.predict(input_data)
     target_columns = ["Fe_ppm", "Cr_ppm", "Mn_ppm", "Mo_ppm", "In_ppm", "Ta_ppm"]
     prediction_dict = {col: round(value, 4) for col, value in zip(target_columns, prediction_array[0])}    
     return prediction_dict
 
-def find_SE(lat, lon, model_path, x, y_true):
-
-    gb_model = joblib.load(model_path)
-
-    if 'lat' not in x.columns or 'lon' not in x.columns:
-        if 'latitude' not in x.columns or 'longitude' not in x.columns:
-            raise ValueError("x must contain 'lat' and 'lon' columns")
-
-    if len(x) != len(y_true):
-        raise ValueError("x and y_true must have the same number of rows")
-
-
-    x["distance"] = x.apply(
-        lambda row: geodesic((lat, lon), (row["lat"], row["lon"])).km, axis=1
-    )
-    nearest_index = x["distance"].idxmin()
-    nearest_row = x.loc[nearest_index]
-    true_values = y_true.iloc[nearest_index]
-
-
-    input_data = pd.DataFrame([[nearest_row["lat"], nearest_row["lon"]]], 
-                               columns=['lat', 'lon'])
-
-  
-    prediction_array = gb_model.predict(input_data)
-    target_columns = ["Fe_ppm", "Cr_ppm", "Mn_ppm", "Mo_ppm", "In_ppm", "Ta_ppm"]
-    prediction = prediction_array[0]
-
-    error_dict = {}
-    for i, col in enumerate(target_columns):
-        abs_error = abs(prediction[i] - true_values[col])
-        error_dict[col] = round(abs_error, 2)
+def find_SE(lat, lon, model_path, x=None, y_true=None):
+    # Without x/y_true the shared index over the master dataset is used; it
+    # is rebuilt only when the model or the master data changes.
+    # Frames straight from creating_New_training_data(csv) share the cached
+    # index for that file.
+    if x is None or y_true is None:
+        se_index = get_se_index(model_path)
+    elif x.attrs.get("source") and y_true.attrs.get("source") == x.attrs["source"]:
+        se_index = get_se_index(model_path, x.attrs["source"])
+    else:
+        if len(x) != len(y_true):
+            raise ValueError("x and y_true must have the same number of rows")
+        lats, lons, values = training_arrays(x, y_true)
+        se_index = StandardErrorIndex(get_registry(model_path).get(), lats, lons, values)
 
-    return error_dict
+    residuals = se_index.query_many([lat], [lon])[0]
+    return {f"{metal}_ppm": round(float(v), 2) for metal, v in zip(METALS, residuals)}
 
 def calculate_risk_scores(ai_predictions, lat, lon):
-    site_data = pd.DataFrame({
-        "Site": ["Alvord Lake", "Desert West Lake", "Steele Park", "Gila Canal", "Papago Park", "Tres Rios"],
-        "Lat": [33.403, 33.470, 33.506, 33.390, 33.460, 33.381],
-        "Lon": [-112.118, -112.166, -112.065, -112.126, -111.944, -112.307]})
-
-    soil_baseline_data = pd.DataFrame({
-        "Site": site_data["Site"],
-        "Soil_Fe_ppm": [45000, 46000, 48000, 44000, 45500, 47000],
-        "Soil_Cr_ppm": [90, 85, 95, 80, 88, 87],
-        "Soil_Mn_ppm": [600, 590, 610, 580, 605, 595],
-        "Soil_Mo_ppm": [1.2, 1.5, 1.0, 1.3, 1.4, 1.6],
-        "Soil_In_ppm": [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]})
-
-    soil_baseline = pd.merge(site_data, soil_baseline_data, on="Site")
-    soil_baseline["distance"] = ((soil_baseline["Lat"] - lat)**2 +
-                                  (soil_baseline["Lon"] - lon)**2)**0.5
-    nearest_soil = soil_baseline.loc[soil_baseline["distance"].idxmin()]
-
-    soil_baseline_values = {
-        "Fe": nearest_soil["Soil_Fe_ppm"],
-        "Cr": nearest_soil["Soil_Cr_ppm"],
-        "Mn": nearest_soil["Soil_Mn_ppm"],
-        "Mo": nearest_soil["Soil_Mo_ppm"],
-        "In": nearest_soil["Soil_In_ppm"]
-    }
-
-    risk_scores = {}
-    for metal in ["Fe", "Cr", "Mn", "Mo", "In"]:
-        predicted = ai_predictions.get(f"SEM_{metal}_ppm", 0)
-        baseline = soil_baseline_values.get(metal, 0.05)
-        risk_score = (predicted / (baseline + 1)) * 25
-        risk_score = max(0, min(risk_score, 100))
-        risk_scores[metal] = round(risk_score, 1)
-
-    avg_risk = round(sum(risk_scores.values()) / len(risk_scores), 1)
-    risk_scores["Average"] = avg_risk
-
-
-    return risk_scores
+    # 0-100 per metal against the nearest soil baseline site (25 = at the
+    # baseline); sites and thresholds come from soil_baselines.csv and
+    # risk_thresholds.csv, see bluvia.risk
+    scores = risk_scores(ai_predictions, lat, lon)
+    scores["Average"] = round(sum(scores.values()) / len(scores), 1)
+    return scores
@@ -13,94 +13,120 @@ Output:
     success message
 
 '''
-import pandas as pd
-import joblib
 import os
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.multioutput import MultiOutputRegressor
-from .path_utils import get_data_path, get_model_path
+from ..path_utils import get_data_path, get_model_path, get_model_source
+from ..storage import get_master_store
+from ..model import METALS, save_model
+from ..learners import GBR_PARAMS, get_learner, train
+from ..training import can_grow, fit_multi_output, write_report
+from ..schema import COLUMN_ALIASES, from_store, load, normalize_column, training_frames
 
 
 
 soil_sem_data = get_data_path("soil_sem_data.csv")
 model_save_path = get_model_path()
 master_csv_file = get_data_path("master_csv.csv")
+WARM_START_TREES = int(os.environ.get("BLUVIA_WARM_START_TREES", "0"))
+
+COLUMN_RENAMES = COLUMN_ALIASES
 
 def clean_up_df(df):
-    df.columns = df.columns.str.strip().str.lower()
-    rename_map = {
-        'latitude': 'lat',
-        'longitude': 'lon',
-        'fe': 'fe_ppm', 'cr': 'cr_ppm', 'mn': 'mn_ppm',
-        'mo': 'mo_ppm', 'in': 'in_ppm', 'ta': 'ta_ppm',
-        'sem_fe_ppm': 'fe_ppm', 'sem_cr_ppm': 'cr_ppm', 'sem_mn_ppm': 'mn_ppm',
-        'sem_mo_ppm': 'mo_ppm', 'sem_in_ppm': 'in_ppm', 'sem_ta_ppm': 'ta_ppm'
-    }
-    df = df.rename(columns=rename_map)
+    df.columns = [normalize_column(col) for col in df.columns]
     return df
 
 def creating_New_training_data(new_csv_file):
-    df = pd.read_csv(new_csv_file)
-    df = clean_up_df(df)
-
-    if 'lat' not in df.columns or 'lon' not in df.columns:
-        raise ValueError("CSV must contain 'lat' and 'lon' columns.")
-
-    target_columns = [col for col in df.columns if col not in ['lat', 'lon']]
-    X_New = df[['lat', 'lon']].copy()
-    Y_New = df[target_columns].apply(pd.to_numeric, errors='coerce').fillna(0)
-
-    return X_New, Y_New
-
-def retrain_gb_model(X_New, Y_New, model_save_path):
-    if os.path.exists(model_save_path):
-        gb_model = joblib.load(model_save_path)
-    else:
-        base_model = GradientBoostingRegressor(
-            n_estimators=50,
-            learning_rate=0.05,
-            max_depth=2,
-            min_samples_split=3,
-            min_samples_leaf=2,
-            subsample=0.8,
-            random_state=42
-        )
-        gb_model = MultiOutputRegressor(base_model)
-
-    gb_model.fit(X_New, Y_New)
-    joblib.dump(gb_model, model_save_path)
+    # CSV path, DataFrame or ColumnStore; parsed once and cached by bluvia.schema
+    return training_frames(new_csv_file)
+
+def load_gb_model(model_save_path):
+    # The current artifact if it is a MultiOutputRegressor, else None
+    import joblib
+    from sklearn.multioutput import MultiOutputRegressor
+
+    source = get_model_source(model_save_path)
+    gb_model = joblib.load(source) if source.exists() else None
+    return gb_model if isinstance(gb_model, MultiOutputRegressor) else None
+
+def retrain_gb_model(X_New, Y_New, model_save_path, add_estimators=WARM_START_TREES, gb_model=None, rows_seen=None):
+    # Targets are fit in parallel. With gb_model (see load_gb_model) and
+    # add_estimators > 0 its trees are kept and only that many new boosting
+    # stages are added on X_New/Y_New, which should be the rows it has not
+    # learned yet (warm start); otherwise the model is refit on X_New/Y_New.
+    # rows_seen: master-store rows the result has learned, for the next warm start
+    from sklearn.ensemble import GradientBoostingRegressor
+
+    base_model = gb_model.estimator if gb_model is not None else GradientBoostingRegressor(**GBR_PARAMS)
+
+    gb_model, report = fit_multi_output(X_New, Y_New, base_model, previous=gb_model, add_estimators=add_estimators)
+    if rows_seen is not None:
+        gb_model.rows_seen = report["rows_seen"] = rows_seen
+    save_model(gb_model, model_save_path)
+    write_report(report, model_save_path)
     print("Model retrained and saved to:", model_save_path)
     return gb_model
 
-def creating_master_csv(new_csv_path):
-    df_new = pd.read_csv(new_csv_path)
-    df_new = clean_up_df(df_new)
-
-    required_columns = ['lat', 'lon', 'fe_ppm', 'cr_ppm', 'mn_ppm', 'mo_ppm', 'in_ppm', 'ta_ppm']
-    missing_cols = [col for col in required_columns if col not in df_new.columns]
-    if missing_cols:
-        raise ValueError(f"New CSV is missing required columns: {missing_cols}")
+def append_to_master(df_new):
+    # df_new: DataFrame, Dataset or CSV path
+    data = load(df_new).require("New CSV is missing required columns").with_coordinates()
 
-    df_new = df_new[required_columns]
+    # Appended as a new immutable segment; the existing data is never rewritten
+    master_store = get_master_store()
+    rows = master_store.append(data.columns())
+    print("Master dataset updated:", master_store.root)
+    return rows
 
-    if os.path.exists(master_csv_file):
-        df_master = pd.read_csv(master_csv_file)
-        df_master = clean_up_df(df_master)
-        df_combined = pd.concat([df_master, df_new], ignore_index=True)
-    else:
-        df_combined = df_new
-
-    df_combined.to_csv(master_csv_file, index=False)
-    print("Master CSV updated:", master_csv_file)
-    return master_csv_file
+def creating_master_csv(new_csv_path):
+    append_to_master(new_csv_path)
+    return get_master_store()
+
+def retrain_gb_from_master(model_path, add_estimators=WARM_START_TREES):
+    # A warm start learns only the master rows appended since the artifact's
+    # last fit. Without an artifact that knows its rows, or once growing would
+    # pass BLUVIA_MAX_TREES stages, the model is refit on the whole master set.
+    store = get_master_store()
+    gb_model = load_gb_model(model_path)
+    start = getattr(gb_model, "rows_seen", 0) if can_grow(gb_model, add_estimators, len(METALS)) else 0
+    if not start or start > len(store):
+        gb_model, start = None, 0
+    data = from_store(store, start)
+    if start and not len(data):
+        print("No new rows since the last fit; model unchanged")
+        return 0
+    X_new, Y_new = data.with_coordinates().frames()
+    retrain_gb_model(X_new, Y_new, model_path, add_estimators, gb_model, rows_seen=start + len(data))
+    return len(X_new)
+
+def retrain_from_master(model_path=None, learner=None):
+    # learner: 'gbr'/'hist' (full refit) or 'river' (learns only rows appended
+    # since the last run); defaults to BLUVIA_LEARNER
+    model_path = model_path or model_save_path
+    learner = get_learner(learner)
+    if not learner.online:
+        if learner.name == "gbr":
+            return retrain_gb_from_master(model_path)
+        X_new, Y_new = creating_New_training_data(get_master_store())
+        train(X_new, Y_new, model_path, learner)
+        return len(X_new)
+
+    import joblib
+    import numpy as np
+    source = get_model_source(model_path)
+    existing = joblib.load(source) if source.exists() else None
+    # read only the rows appended since the artifact last learned
+    start = existing.rows_seen if learner.can_update(existing) else 0
+    data = get_master_store().read_since(start)
+    X_new = np.column_stack([data['lat'], data['lon']])
+    Y_new = np.column_stack([data[c] for c in get_master_store().columns if c not in ('lat', 'lon')])
+    model = train(X_new, Y_new, model_path, learner, existing, offset=start)
+    print("Online model updated and saved to:", model_path)
+    return model.rows_seen
 
 def intigrate_new_data(data_csv):
     new_file = data_csv.replace("\\", "/")
     print("Integrating data from:", new_file)
 
-    master_csv_file_updated = creating_master_csv(new_file)
-    X_new, Y_new = creating_New_training_data(master_csv_file_updated)
-    retrain_gb_model(X_new, Y_new, GB_save_path)
+    creating_master_csv(new_file)
+    retrain_from_master(model_save_path)
 
     print("Data successfully integrated and model updated.")
 
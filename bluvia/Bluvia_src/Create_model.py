@@ -1,39 +1,23 @@
 # This program doesn't return anything it just trains a base ai ARFRegressor model using the data from soil_sem_data.csv
+# Run it with: python -m bluvia.Bluvia_src.Create_model (importing it no longer trains)
 
-import pandas as pd
-import joblib
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.multioutput import MultiOutputRegressor
 
-from .path_utils import get_data_path, get_model_path
+from ..path_utils import get_data_path, get_model_path
+from ..learners import get_learner, train
+from ..model import save_model
+from ..training import fit_multi_output, write_report
+from ..schema import training_frames
 
 soil_sem_data = get_data_path("soil_sem_data.csv")
 model_save_path = get_model_path()
 
 def creating_training_data(csv_file):
-    data_file = pd.read_csv(csv_file)
-    data_file.columns = data_file.columns.str.strip().str.lower()
-    data_file = data_file.rename(columns={
-    'fe': 'Fe_ppm', 'cr': 'Cr_ppm', 'mn': 'Mn_ppm',
-    'mo': 'Mo_ppm', 'in': 'In_ppm', 'ta': 'Ta_ppm'
-})
-    target_columns = ["Fe_ppm", "Cr_ppm", "Mn_ppm", "Mo_ppm", "In_ppm", "Ta_ppm"]
-    
-    if 'lat' not in data_file.columns or 'lon' not in data_file.columns:
-        if "latitude" not in data_file.columns or "longitude" not in data_file.columns:
-            raise ValueError("CSV must contain location columns ('lat'/'lon' or 'latitude'/'longitude')")
-        data_file = data_file.rename(columns={"latitude": "lat", "longitude": "lon"})
-    
-    X_train = data_file[["lat", "lon"]].copy()
-    Y_train = data_file[target_columns].copy()
-    
-    Y_train = Y_train.apply(pd.to_numeric, errors='coerce')
-    if Y_train.isnull().values.any():
-        Y_train = Y_train.fillna(0)
-    
-    return X_train, Y_train
+    # X: lat/lon, Y: Fe_ppm ... Ta_ppm with missing values as 0 (see bluvia.schema)
+    return training_frames(csv_file)
 
 def train_gb_model(X_train, Y_train, save_path):
+    from sklearn.ensemble import GradientBoostingRegressor
+
     gb_model = GradientBoostingRegressor(
         n_estimators=50,       # Reduced to prevent overfitting
         learning_rate=0.05,     # Lower learning rate for better generalization
@@ -47,18 +31,26 @@ def train_gb_model(X_train, Y_train, save_path):
         n_iter_no_change=5,     # Stop if no improvement after 5 iterations
     )
     
-    model = MultiOutputRegressor(gb_model)
-    
-
-    model.fit(X_train, Y_train)
-    
+    # One booster per metal, fit in parallel across cores
+    model, report = fit_multi_output(X_train, Y_train, gb_model)
 
-    joblib.dump(model, save_path)
+    save_model(model, save_path)
+    write_report(report, save_path)
     print(f"Gradient Boosting model saved to {save_path}")
     return model
 
 
-x_train, y_train = creating_training_data(soil_sem_data)
+def train_model(X_train, Y_train, save_path, learner=None):
+    # learner: 'gbr' (see train_gb_model), 'hist' for histogram boosting or
+    # 'river' for the online learner; defaults to BLUVIA_LEARNER
+    learner = get_learner(learner)
+    if learner.name == "gbr":
+        return train_gb_model(X_train, Y_train, save_path)
+    model = train(X_train, Y_train, save_path, learner)
+    print(f"{learner.name} model saved to {save_path}")
+    return model
 
 
-gb_model = train_gb_model(x_train, y_train, GB_save_path)
+if __name__ == "__main__":
+    x_train, y_train = creating_training_data(soil_sem_data)
+    gb_model = train_model(x_train, y_train, model_save_path)
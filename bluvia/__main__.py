@@ -0,0 +1,35 @@
+import sys
+
+USAGE = """usage: python -m bluvia <command> [options]
+
+commands:
+  score     score a CSV or Parquet file of coordinates (see bluvia.score)
+  evaluate  compare candidate learners' accuracy and serving cost (see bluvia.evaluation)
+  serve     run the API with gunicorn (see bluvia.serve)
+"""
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        print(USAGE)
+        return 0 if argv else 2
+    command, rest = argv[0], argv[1:]
+    if command == "score":
+        from .score import main as score_main
+
+        return score_main(rest)
+    if command == "evaluate":
+        from .evaluation import main as evaluate_main
+
+        return evaluate_main(rest)
+    if command == "serve":
+        from .serve import main as serve_main
+
+        return serve_main(rest)
+    print(f"Unknown command: {command}\n\n{USAGE}", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
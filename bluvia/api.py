@@ -1,15 +1,46 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware  # <-- Add this import
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
-from .model import predict_metals, update_metals_with_user_data
+from typing import Dict, List, Optional
+from .model import METALS, predict_metals_batch, get_registry, UserDataIndex
+from .Bluvia_src import Bluvia_Analysis
+from .jobs import retrain_queue
+from .tiles import tile_service, build_for_model
+from .ingest import RowBatch, METAL_COLUMNS, ingest_upload
+from .storage import get_master_store
+from .cache import analyze_key, make_cache
+from .metrics import (MetricsMiddleware, span, render as render_metrics, CACHE_REQUESTS, ROWS_SCANNED,
+                      MODEL_INFO, MODEL_LOAD_SECONDS)
+from .uncertainty import get_se_index
+from .risk import get_risk_model, risk_levels
+from .warmup import WarmUp, import_modules
+from .batching import MicroBatcher
+from .userlog import UserDataLog
+from .stats import StatsPyramid, BoxRegion, PolygonRegion, DEFAULT_PERCENTILES
+import numpy as np
 import uuid
-import csv
-from io import StringIO
 import os
 
 USER_DATA_PATH = os.environ.get("BLUVIA_USER_DATA_PATH", "user_data.csv")
+RETRAIN_ON_UPLOAD = os.environ.get("BLUVIA_RETRAIN_ON_UPLOAD", "1") == "1"
+# Read point predictions from the tile grid (BLUVIA_TILE_LOOKUP) instead of the
+# model. Off by default: a grid value can differ from the model's within half a
+# grid step of a tree split, while the compiled model is exact and about as fast
+ANALYZE_FROM_TILES = os.environ.get("BLUVIA_ANALYZE_FROM_TILES", "0") == "1"
+BUILD_TILES_ON_STARTUP = os.environ.get("BLUVIA_BUILD_TILES_ON_STARTUP", "1") == "1"
+BATCH_MAX_POINTS = int(os.environ.get("BLUVIA_BATCH_MAX_POINTS", "250000"))
+ANALYZE_CACHE = os.environ.get("BLUVIA_ANALYZE_CACHE", "1") == "1"
+ANALYZE_BATCHING = os.environ.get("BLUVIA_ANALYZE_BATCHING", "1") == "1"
+STATS_MAX_POLYGON_POINTS = int(os.environ.get("BLUVIA_STATS_MAX_POLYGON_POINTS", "1000"))
+
+user_index = UserDataIndex(USER_DATA_PATH)
+user_log = UserDataLog(USER_DATA_PATH)
+# Uploads with every metal also land in the master store; the pyramid
+# then counts them from there only
+stats_pyramid = StatsPyramid(user_data_path=USER_DATA_PATH, skip_complete_user_rows=RETRAIN_ON_UPLOAD)
+analyze_cache = make_cache()
 
 app = FastAPI(title="GeoMetals API")
 
@@ -22,17 +53,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 # -----------------------------------------
+app.add_middleware(MetricsMiddleware)
 
 class MetalResult(BaseModel):
     name: str
     concentration: float
     unit: str
     risk: str
+    se: Optional[float] = None
 
 class AnalysisResponse(BaseModel):
     metals: List[MetalResult]
     location: dict
 
+class Point(BaseModel):
+    lat: float
+    lng: float
+
+class BoundingBox(BaseModel):
+    south: float
+    west: float
+    north: float
+    east: float
+
+class BatchAnalysisRequest(BaseModel):
+    points: Optional[List[Point]] = None
+    bbox: Optional[BoundingBox] = None
+    resolution: Optional[float] = None  # grid step in degrees, used with bbox
+
+class BatchAnalysisResponse(BaseModel):
+    count: int
+    unit: str
+    metals: List[str]
+    lat: List[float]
+    lng: List[float]
+    concentrations: Dict[str, List[float]]
+    risk: Dict[str, List[str]]
+
+class StatsRequest(BaseModel):
+    bbox: Optional[BoundingBox] = None
+    polygon: Optional[List[Point]] = None
+    percentiles: Optional[List[float]] = None
+
+class MetalStats(BaseModel):
+    count: int
+    mean: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    percentiles: Dict[str, Optional[float]]
+    above_moderate: int
+    above_high: int
+
+class StatsResponse(BaseModel):
+    samples: int
+    unit: str
+    metals: Dict[str, MetalStats]
+    cells: int
+    scanned: int
+
 class UploadMetadata(BaseModel):
     description: Optional[str]
     source: Optional[str]
@@ -51,27 +129,169 @@ class InfoSection(BaseModel):
 class InfoContent(BaseModel):
     sections: List[InfoSection]
 
-def get_risk_level(metal: str, value: float) -> str:
-    if value < 50:
-        return "low"
-    elif value < 100:
-        return "moderate"
-    return "high"
-
-def append_user_data(rows, fieldnames):
-    file_exists = os.path.isfile(USER_DATA_PATH)
-    with open(USER_DATA_PATH, "a", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerows(rows)
-
-def load_user_data():
-    if not os.path.isfile(USER_DATA_PATH):
-        return []
-    with open(USER_DATA_PATH, "r", newline="") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+class IndustryResult(BaseModel):
+    type: str
+    distance_km: float
+    lat: float
+    lng: float
+
+class IndustriesResponse(BaseModel):
+    industries: List[IndustryResult]
+    location: dict
+    radius_km: float
+
+class JobStatus(BaseModel):
+    id: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    duration_s: Optional[float] = None
+    new_rows: int
+    rows: Optional[int] = None
+    uploads: int
+    error: Optional[str] = None
+
+class CacheStats(BaseModel):
+    enabled: bool
+    backend: str
+    entries: int
+    max_entries: int
+    ttl_s: float
+    hits: int
+    misses: int
+    hit_rate: Optional[float] = None
+    evictions: int
+    expirations: int
+    path: Optional[str] = None
+
+class ModelInfo(BaseModel):
+    loaded: bool
+    path: str
+    version: Optional[str] = None
+    format: Optional[str] = None
+    loaded_at: Optional[float] = None
+    load_seconds: Optional[float] = None
+    mtime: Optional[float] = None
+
+class WarmUpStep(BaseModel):
+    name: str
+    state: str
+    required: bool
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+class HealthResponse(BaseModel):
+    status: str
+    ready: bool
+    elapsed_s: Optional[float] = None
+    steps: List[WarmUpStep]
+
+# Loaded here rather than at import time, so the process starts listening
+# quickly; everything below is also loaded on first use if a step fails.
+# bluvia.serve runs these in the server master before forking workers.
+warmup = WarmUp()
+warmup.add("libraries", import_modules("pandas", "sklearn.ensemble", "sklearn.neighbors"), required=False)
+warmup.add("model", lambda: get_registry().load())
+warmup.add("risk", get_risk_model)
+warmup.add("user_data", user_index.ensure_loaded, required=False)
+warmup.add("industries", Bluvia_Analysis.get_industry_index, required=False)
+warmup.add("se_index", lambda: get_se_index(), required=False)
+warmup.add("stats", stats_pyramid.refresh, required=False)
+if BUILD_TILES_ON_STARTUP:
+    warmup.add("tiles", build_for_model, required=False)
+if ANALYZE_FROM_TILES:
+    warmup.add("tile_grid", tile_service.grid, required=False)
+
+@app.on_event("startup")
+def load_model():
+    warmup.start()
+
+@app.on_event("shutdown")
+def stop_jobs():
+    retrain_queue.shutdown()
+    user_log.close()
+
+def predict_points(lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    # Points inside a tile grid built for the current model are read from it;
+    # the rest (or everything, with tiles disabled) go through the model.
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    ROWS_SCANNED.inc(len(lats), source="predict")
+    if not ANALYZE_FROM_TILES:
+        with span("model_predict"):
+            return predict_metals_batch(lats, lngs)
+    registry = get_registry()
+    registry.get()
+    with span("tiles"):
+        values, inside = tile_service.lookup(lats, lngs, registry.version)
+    if not inside.all():
+        with span("model_predict"):
+            values[~inside] = predict_metals_batch(lats[~inside], lngs[~inside])
+    return values
+
+def batch_coordinates(request: BatchAnalysisRequest):
+    if request.points is not None:
+        lats = np.fromiter((p.lat for p in request.points), dtype=float, count=len(request.points))
+        lngs = np.fromiter((p.lng for p in request.points), dtype=float, count=len(request.points))
+        return lats, lngs
+    if request.bbox is None or not request.resolution or request.resolution <= 0:
+        raise HTTPException(status_code=400, detail="Provide points, or bbox with a positive resolution")
+    box = request.bbox
+    if box.north < box.south or box.east < box.west:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    rows = int(np.floor((box.north - box.south) / request.resolution + 1e-9)) + 1
+    cols = int(np.floor((box.east - box.west) / request.resolution + 1e-9)) + 1
+    if rows * cols > BATCH_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Grid has {rows * cols} points, limit is {BATCH_MAX_POINTS}")
+    grid_lat, grid_lng = np.meshgrid(box.south + np.arange(rows) * request.resolution,
+                                     box.west + np.arange(cols) * request.resolution, indexing="ij")
+    return grid_lat.ravel(), grid_lng.ravel()
+
+def append_user_data(batch: RowBatch):
+    # Runs in the thread pool. The log commits it (grouped with concurrent
+    # uploads, under a file lock shared with the other workers) and the
+    # index then reads back everything new, this batch included.
+    user_log.append(batch)
+    user_index.refresh()
+
+def store_upload_batch(batch: RowBatch) -> int:
+    # Uploads carrying every training column also go into the master dataset
+    # (for a debounced retrain); others only feed the user-data override.
+    append_user_data(batch)
+    rows = 0
+    if RETRAIN_ON_UPLOAD and not batch.missing_columns:
+        data = {"lat": batch.lats, "lon": batch.lons}
+        data.update({col: batch.values[:, i] for i, col in enumerate(METAL_COLUMNS)})
+        rows = get_master_store().append(data)
+    if stats_pyramid.loaded:
+        # picks up this batch from whichever source it went to
+        stats_pyramid.refresh()
+    return rows
+
+def analyze_points(points: List[tuple]) -> List[List[dict]]:
+    # (lat, lng, include_se) per point -> its MetalResult fields; all model,
+    # index and risk work for the points is done in one vectorized pass
+    lats = np.array([p[0] for p in points], dtype=float)
+    lngs = np.array([p[1] for p in points], dtype=float)
+    values = predict_points(lats, lngs)
+    with span("user_data"):
+        values = user_index.ensure_loaded().override_many(values, lats, lngs)
+    se = np.full(values.shape, np.nan)
+    wants_se = np.array([bool(p[2]) for p in points])
+    if wants_se.any():
+        with span("se"):
+            se[wants_se] = get_se_index().query_many(lats[wants_se], lngs[wants_se])
+    with span("risk"):
+        risks = risk_levels(values, lats, lngs)
+    return [
+        [{"name": metal, "concentration": value, "unit": "ppm", "risk": risk, "se": None if np.isnan(s) else s}
+         for metal, value, risk, s in zip(METALS, row_values, row_risks, row_se)]
+        for row_values, row_risks, row_se in zip(values.tolist(), risks.tolist(), se.tolist())
+    ]
+
+# Concurrent /api/analyze requests are scored together (see bluvia.batching)
+analyze_batcher = MicroBatcher(analyze_points, name="analyze")
 
 @app.post("/api/analyze", response_model=AnalysisResponse)
 async def analyze_contamination(request: dict):
@@ -81,26 +301,171 @@ async def analyze_contamination(request: dict):
         if lat is None or lng is None:
             raise HTTPException(status_code=400, detail="Latitude and longitude required")
 
-        predictions = predict_metals(lat, lng)
-        user_data = load_user_data()
-        predictions = update_metals_with_user_data(predictions, user_data, lat, lng)
-
-        metal_results = []
-        for metal, val in predictions.items():
-            metal_results.append(MetalResult(
-                name=metal,
-                concentration=val,
-                unit="ppm",
-                risk=get_risk_level(metal, val)
-            ))
-
-        return AnalysisResponse(
-            metals=metal_results,
-            location={"lat": lat, "lng": lng}
-        )
+        lat = float(lat)
+        lng = float(lng)
+        include_se = bool(request.get("include_se"))
+        registry = get_registry()
+        if registry.version is None:
+            # first request: load off the event loop (later checks happen in predict_points)
+            with span("model_load"):
+                await run_in_threadpool(registry.get)
+        key = None
+        if ANALYZE_CACHE:
+            # The answer depends only on the (quantized) point, the model, the
+            # risk data, the user samples near the point and, for SE, the master data.
+            with span("cache"):
+                se_version = get_master_store().version if include_se else None
+                key = analyze_key(lat, lng, registry.version, user_index.ensure_loaded().local_version(lat, lng),
+                                  se_version, risk_version=get_risk_model().version)
+                cached = analyze_cache.get(key)
+            CACHE_REQUESTS.inc(cache="analyze", result="miss" if cached is None else "hit")
+            if cached is not None:
+                with span("serialize"):
+                    return AnalysisResponse(metals=[MetalResult(**m) for m in cached],
+                                            location={"lat": lat, "lng": lng})
+
+        point = (lat, lng, include_se)
+        if ANALYZE_BATCHING:
+            with span("batch"):
+                results = await analyze_batcher.submit(point)
+        else:
+            results = (await run_in_threadpool(analyze_points, [point]))[0]
+
+        with span("serialize"):
+            metal_results = [MetalResult(**m) for m in results]
+            if key is not None:
+                analyze_cache.put(key, results)
+
+            return AnalysisResponse(
+                metals=metal_results,
+                location={"lat": lat, "lng": lng}
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/analyze/batch", response_model=BatchAnalysisResponse)
+async def analyze_batch(request: BatchAnalysisRequest):
+    lats, lngs = batch_coordinates(request)
+    if len(lats) > BATCH_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Too many points, limit is {BATCH_MAX_POINTS}")
+    try:
+        values = predict_points(lats, lngs) if len(lats) else np.empty((0, len(METALS)))
+        values = user_index.ensure_loaded().override_many(values, lats, lngs)
+        risks = risk_levels(values, lats, lngs)
+        # Returned as a plain JSONResponse: per-element pydantic validation of
+        # large columnar payloads costs more than the prediction itself.
+        return JSONResponse(content={
+            "count": len(lats),
+            "unit": "ppm",
+            "metals": METALS,
+            "lat": lats.tolist(),
+            "lng": lngs.tolist(),
+            "concentrations": {metal: values[:, i].tolist() for i, metal in enumerate(METALS)},
+            "risk": {metal: risks[:, i].tolist() for i, metal in enumerate(METALS)},
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def stats_region(request: StatsRequest):
+    if (request.bbox is None) == (request.polygon is None):
+        raise HTTPException(status_code=400, detail="Provide either bbox or polygon")
+    try:
+        if request.bbox is not None:
+            box = request.bbox
+            return BoxRegion(box.south, box.west, box.north, box.east)
+        if len(request.polygon) > STATS_MAX_POLYGON_POINTS:
+            raise HTTPException(status_code=400, detail=f"Polygon has too many points, limit is {STATS_MAX_POLYGON_POINTS}")
+        return PolygonRegion([p.lat for p in request.polygon], [p.lng for p in request.polygon])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def region_stats(region, percentiles):
+    # Runs in the thread pool; refreshes first if another worker may have taken uploads
+    return stats_pyramid.ensure_fresh().query(region, percentiles)
+
+@app.post("/api/stats", response_model=StatsResponse)
+async def stats(request: StatsRequest):
+    region = stats_region(request)
+    percentiles = DEFAULT_PERCENTILES if request.percentiles is None else request.percentiles
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be in [0, 100]")
+    with span("stats"):
+        result = await run_in_threadpool(region_stats, region, percentiles)
+    ROWS_SCANNED.inc(result["scanned"], source="stats")
+    result["unit"] = "ppm"
+    return result
+
+@app.get("/api/industries", response_model=IndustriesResponse)
+async def nearby_industries(lat: float, lng: float, radius_km: float = 3.0):
+    if radius_km <= 0 or radius_km > 100:
+        raise HTTPException(status_code=400, detail="radius_km must be in (0, 100]")
+    found = Bluvia_Analysis.detect_nearby_industries(lat, lng, radius_km)
+    return IndustriesResponse(
+        industries=[IndustryResult(type=f["type"], distance_km=f["distance_km"], lat=f["lat"], lng=f["lon"])
+                    for f in found],
+        location={"lat": lat, "lng": lng},
+        radius_km=radius_km,
+    )
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+async def job_status(job_id: str):
+    job = retrain_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return JobStatus(**job)
+
+@app.get("/api/tiles/{z}/{x}/{y}")
+async def prediction_tile(z: int, x: int, y: int, metal: Optional[str] = None, size: int = 256):
+    # Raw little-endian float32, band-major (metal, row, col); NaN outside the grid
+    if not 0 <= z <= 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    if not 16 <= size <= 512:
+        raise HTTPException(status_code=400, detail="size must be between 16 and 512")
+    if metal is not None and metal not in METALS:
+        raise HTTPException(status_code=400, detail=f"metal must be one of {METALS}")
+    tile = tile_service.render(z, x, y, size)
+    if tile is None:
+        raise HTTPException(status_code=503, detail="Tile grid not built yet")
+    metals = [metal] if metal else METALS
+    if metal:
+        tile = tile[METALS.index(metal)][None]
+    return Response(
+        content=tile.astype("<f4").tobytes(),
+        media_type="application/octet-stream",
+        headers={
+            "X-Tile-Shape": ",".join(str(d) for d in tile.shape),
+            "X-Tile-Metals": ",".join(metals),
+            "X-Model-Version": tile_service.grid().model_version,
+        },
+    )
+
+@app.get("/healthz", response_model=HealthResponse)
+async def healthz():
+    # 503 until warm-up has finished, for load balancer readiness probes
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/api/cache/stats", response_model=CacheStats)
+async def cache_stats():
+    return CacheStats(enabled=ANALYZE_CACHE, **analyze_cache.stats())
+
+@app.get("/metrics")
+async def metrics():
+    info = get_registry().info()
+    if info["loaded"]:
+        MODEL_INFO.replace(1, version=info["version"])
+        MODEL_LOAD_SECONDS.set(info["load_seconds"])
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/model", response_model=ModelInfo)
+async def model_info():
+    registry = get_registry()
+    try:
+        registry.refresh_if_changed()
+    except Exception:
+        pass
+    return ModelInfo(**registry.info())
+
 @app.post("/api/upload", response_model=UploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
@@ -115,14 +480,20 @@ async def upload_file(
             except Exception:
                 pass
 
-        content = await file.read()
-        s = StringIO(content.decode("utf-8"))
-        reader = csv.DictReader(s)
-        rows = list(reader)
-        if not rows:
-            return UploadResponse(success=False, fileId="", error="Empty file")
+        with span("ingest"):
+            results = await ingest_upload(file, store_upload_batch)
+        ROWS_SCANNED.inc(results["rows"] + results["rejected"], source="upload")
+        if not results["rows"]:
+            error = "No valid rows" if results["rejected"] else "Empty file"
+            return UploadResponse(success=False, fileId="", error=error, results=results)
 
-        append_user_data(rows, reader.fieldnames)
-        return UploadResponse(success=True, fileId=str(uuid.uuid4()), error=None, results={"rows": len(rows)})
+        if RETRAIN_ON_UPLOAD:
+            if results["missingColumns"]:
+                results["retrain"] = None
+                results["retrainSkipped"] = f"New CSV is missing required columns: {results['missingColumns']}"
+            else:
+                with span("retrain_enqueue"):
+                    results["retrain"] = retrain_queue.enqueue(results["masterRows"])
+        return UploadResponse(success=True, fileId=str(uuid.uuid4()), error=None, results=results)
     except Exception as e:
         return UploadResponse(success=False, fileId="", error=str(e))
@@ -0,0 +1,78 @@
+import os
+import asyncio
+import contextvars
+from typing import Any, Callable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import BATCH_QUEUE_DEPTH, BATCH_SIZE
+
+BATCH_WINDOW_S = float(os.environ.get("BLUVIA_BATCH_WINDOW_MS", "2")) / 1000.0
+BATCH_MAX_SIZE = int(os.environ.get("BLUVIA_BATCH_MAX_SIZE", "64"))
+
+
+class MicroBatcher:
+    """
+    Groups concurrent calls into one call of `fn` in the thread pool.
+
+    `fn` takes a list of items and returns one result per item, in order.
+    When no batch is running an item is dispatched right away, so a lone
+    request waits for nothing. While one is, items queue up and go out
+    together once `window_s` has passed since the first of them or
+    `max_size` are waiting, whichever comes first. Each caller then gets its
+    own result, or the batch's exception.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], window_s: float = BATCH_WINDOW_S,
+                 max_size: int = BATCH_MAX_SIZE, name: str = "default"):
+        self.fn = fn
+        self.window_s = window_s
+        self.max_size = max(1, max_size)
+        self.name = name
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # e.g. a new event loop per test client; nothing pending carries over
+            self._loop, self._pending, self._timer, self._running = loop, [], None, 0
+        future = loop.create_future()
+        self._pending.append((item, future))
+        BATCH_QUEUE_DEPTH.inc(batcher=self.name)
+        if not self._running or len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            BATCH_QUEUE_DEPTH.inc(-len(batch), batcher=self.name)
+            BATCH_SIZE.observe(len(batch), batcher=self.name)
+            self._running += 1
+            # in a fresh context: the batch's spans belong to no single request
+            contextvars.Context().run(self._loop.create_task, self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await run_in_threadpool(self.fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._running -= 1
+            # items that queued behind this batch go now rather than at the timer
+            if self._pending and not self._running:
+                self._flush()
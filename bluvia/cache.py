@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+ANALYZE_CACHE_SIZE = int(os.environ.get("BLUVIA_CACHE_SIZE", "10000"))
+ANALYZE_CACHE_TTL_S = float(os.environ.get("BLUVIA_CACHE_TTL_S", "300"))
+# Decimal places kept from lat/lng; 4 is about 11 m
+ANALYZE_CACHE_PRECISION = int(os.environ.get("BLUVIA_CACHE_PRECISION", "4"))
+ANALYZE_CACHE_PATH = os.environ.get("BLUVIA_CACHE_PATH")
+TRIM_EVERY = 32
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with a per-entry TTL. Entries are evicted least
+    recently used first once `max_entries` is exceeded.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_entries: int = ANALYZE_CACHE_SIZE, ttl_s: float = ANALYZE_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SqliteCache(MemoryCache):
+    """
+    Cache in a SQLite file (WAL mode) so every worker process on the host
+    shares it. Values are stored as JSON, keys by their repr. Hit/miss
+    counters are per process; `entries` is the shared total.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: Union[str, Path], max_entries: int = ANALYZE_CACHE_SIZE,
+                 ttl_s: float = ANALYZE_CACHE_TTL_S):
+        super().__init__(max_entries, ttl_s)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._puts = 0
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS cache "
+                       "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and process: a connection inherited
+        # across fork (e.g. from a preloading server master) must not be used
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.time()
+        db = self._connect()
+        row = db.execute("SELECT value, expires FROM cache WHERE key = ?", (repr(key),)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            if row[1] <= now:
+                self.expirations += 1
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row[1] <= now:
+            db.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (repr(key), now))
+            return None
+        db.execute("UPDATE cache SET used = ? WHERE key = ?", (now, repr(key)))
+        return json.loads(row[0])
+
+    def put(self, key: Hashable, value: Any) -> None:
+        now = time.time()
+        db = self._connect()
+        db.execute("INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                   (repr(key), json.dumps(value), now + self.ttl_s, now))
+        self._puts += 1
+        if self._puts % TRIM_EVERY:
+            return
+        # Trimmed every TRIM_EVERY puts rather than counting rows on each one
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            db.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)", (excess,))
+            with self._lock:
+                self.evictions += excess
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "path": str(self.path)}
+
+
+def quantize(lat: float, lng: float, precision: int = ANALYZE_CACHE_PRECISION) -> Tuple[int, int]:
+    scale = 10 ** precision
+    return (round(float(lat) * scale), round(float(lng) * scale))
+
+
+def analyze_key(lat: float, lng: float, model_version: Optional[str], user_data_version: int,
+                extra: Hashable = None, precision: int = ANALYZE_CACHE_PRECISION,
+                risk_version: Optional[str] = None) -> Tuple:
+    """
+    Cache key for an /api/analyze answer: quantized coordinates plus every
+    version the answer depends on, so a new model, new risk data or new
+    nearby user data simply stops matching the old entries (which then age out).
+    """
+    return quantize(lat, lng, precision) + (model_version, risk_version, user_data_version, extra)
+
+
+def make_cache(path: Optional[str] = ANALYZE_CACHE_PATH) -> MemoryCache:
+    """SQLite-backed cache when `path` (BLUVIA_CACHE_PATH) is set, else in-process."""
+    return SqliteCache(path) if path else MemoryCache()
@@ -0,0 +1,368 @@
+import os
+import json
+import itertools
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from .model import METALS
+
+# Inference from a flattened copy of a boosted-tree model: every tree of
+# every target is stored as rows of one contiguous node array, written next
+# to the pickled artifact as
+#   <model>.compiled.json            meta: model version, roots, bases, ...
+#   <model>.<version>.nodes.npy      the node array
+#   <model>.<version>.table.npy      cell table (see CompiledModel), optional
+#   <model>.<version>.edges.npy      its cell edges
+# The arrays are memory-mapped on load, so loading takes milliseconds and
+# every process maps the same pages.
+#
+# Siblings are stored next to each other: a split node's left child is at
+# `child` and its right child at `child + 1`. Leaves have child = themselves
+# and an infinite threshold, so further steps keep a point on its leaf.
+# `nan_right` sends a missing value to the right child (HistGradientBoosting
+# learns that direction per split; otherwise NaN goes left).
+NODE_DTYPE = np.dtype([("feature", "<i4"), ("child", "<i4"), ("threshold", "<f8"), ("value", "<f8"),
+                       ("nan_right", "u1")])
+FORMAT = 3
+ARRAYS = ("nodes", "table", "edges")
+# Largest cell table built, in cells (each holds one float64 per target)
+TABLE_MAX_CELLS = int(os.environ.get("BLUVIA_COMPILED_TABLE_CELLS", str(1 << 18)))
+# (trees x points) node indices handled at once while walking trees; small
+# enough for the working arrays to stay in cache
+CHUNK_ELEMENTS = 1 << 16
+
+
+def compiled_path(model_path: Union[str, Path]) -> Path:
+    model_path = Path(model_path)
+    return model_path.with_name(f"{model_path.name}.compiled.json")
+
+
+class CompiledModel:
+    """
+    Vectorized evaluator over the flattened trees: all trees are walked in
+    lock step for `depth` steps, so each point ends on its leaf in every
+    tree; leaf values (with the learning rate applied) are then summed per
+    target onto its base value.
+
+    With few input features (lat/lon) the model is also tabulated: the
+    thresholds used for each feature cut the input space into cells on which
+    every tree, and so the prediction, is constant. Predicting is then one
+    binary search per feature and a row lookup in `table`, with the same
+    comparisons the trees make, so the result is identical to walking them.
+    Rows with a missing feature are always walked.
+    """
+
+    def __init__(self, nodes: np.ndarray, roots: np.ndarray, tree_targets: np.ndarray, base: np.ndarray,
+                 depth: int, float32_inputs: bool, table: Optional[np.ndarray] = None,
+                 edges: Optional[List[np.ndarray]] = None, meta: Optional[Dict[str, Any]] = None):
+        self.nodes = nodes
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.tree_targets = np.asarray(tree_targets, dtype=np.int64)
+        self.base = np.asarray(base, dtype=np.float64)
+        self.depth = int(depth)
+        self.float32_inputs = bool(float32_inputs)
+        self.table = table
+        self.edges = edges
+        self.meta = meta or {}
+        # trees are grouped by target, in target order
+        self._target_starts = np.searchsorted(self.tree_targets, np.arange(len(self.base)))
+        self._feature = nodes["feature"]
+        self._child = nodes["child"]
+        self._threshold = nodes["threshold"]
+        self._value = nodes["value"]
+        self._nan_right = nodes["nan_right"].astype(bool)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def predict(self, X) -> np.ndarray:
+        """(n, targets) predictions for an (n, features) array or DataFrame."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if self.float32_inputs:
+            # sklearn's trees compare float32 inputs against their thresholds
+            X = X.astype(np.float32).astype(np.float64)
+        if self.table is None:
+            return self._walk(X)
+        cell = np.zeros(len(X), dtype=np.int64)
+        for f, edges in enumerate(self.edges):
+            cell = cell * (len(edges) + 1) + np.searchsorted(edges, X[:, f], side="left")
+        out = self.table[cell]
+        missing = np.isnan(X).any(axis=1)
+        if missing.any():
+            out[missing] = self._walk(X[missing])
+        return out
+
+    def _walk(self, X: np.ndarray) -> np.ndarray:
+        n = len(X)
+        out = np.empty((n, len(self.base)))
+        columns = np.ascontiguousarray(X.T)
+        chunk = max(1, CHUNK_ELEMENTS // max(self.n_trees, 1))
+        for start in range(0, n, chunk):
+            xs = columns[:, start:start + chunk]
+            m = xs.shape[1]
+            node = np.repeat(self.roots[:, None], m, axis=1)
+            missing = bool(np.isnan(xs).any())
+            for _ in range(self.depth):
+                feature = self._feature[node]
+                # few features (lat/lon): select rows instead of a 2-D gather
+                x = xs[0]
+                for f in range(1, len(xs)):
+                    x = np.where(feature == f, xs[f], x)
+                right = x > self._threshold[node]
+                if missing:
+                    right |= np.isnan(x) & self._nan_right[node]
+                node = self._child[node] + right
+            sums = np.add.reduceat(self._value[node], self._target_starts, axis=0)
+            out[start:start + m] = (sums + self.base[:, None]).T
+        return out
+
+    def tabulate(self, n_features: int, max_cells: Optional[int] = None) -> bool:
+        """
+        Build the cell table, unless it would exceed `max_cells` (default
+        TABLE_MAX_CELLS). Returns True if built.
+
+        Each leaf covers a box of cells; its value is added to the box's
+        corners in a difference array per target, and a cumulative sum along
+        every feature axis then spreads it over the box.
+        """
+        split = np.isfinite(self._threshold)
+        edges = [np.unique(self._threshold[split & (self._feature == f)]) for f in range(n_features)]
+        shape = tuple(len(e) + 1 for e in edges)
+        if np.prod(shape, dtype=np.float64) > (TABLE_MAX_CELLS if max_cells is None else max_cells):
+            return False
+        diff = np.zeros((len(self.base),) + tuple(k + 1 for k in shape))
+        for root, target in zip(self.roots.tolist(), self.tree_targets.tolist()):
+            # (node, lower bin, upper bin (exclusive)) per feature
+            stack = [(root, [0] * n_features, list(shape))]
+            while stack:
+                node, lo, hi = stack.pop()
+                child = int(self._child[node])
+                if child == node:
+                    value = float(self._value[node])
+                    for corner in itertools.product((0, 1), repeat=n_features):
+                        index = tuple(hi[f] if c else lo[f] for f, c in enumerate(corner))
+                        diff[(target,) + index] += -value if sum(corner) % 2 else value
+                    continue
+                f = int(self._feature[node])
+                # x <= threshold, i.e. bins up to the threshold's own, go left
+                k = int(np.searchsorted(edges[f], self._threshold[node])) + 1
+                left_hi = list(hi)
+                left_hi[f] = min(hi[f], k)
+                right_lo = list(lo)
+                right_lo[f] = max(lo[f], k)
+                if lo[f] < left_hi[f]:
+                    stack.append((child, lo, left_hi))
+                if right_lo[f] < hi[f]:
+                    stack.append((child + 1, right_lo, hi))
+        for axis in range(1, n_features + 1):
+            np.cumsum(diff, axis=axis, out=diff)
+        table = diff[(slice(None),) + tuple(slice(0, k) for k in shape)]
+        self.table = np.ascontiguousarray(table.reshape(len(self.base), -1).T) + self.base
+        self.edges = edges
+        return True
+
+
+def _gbr_trees(estimator) -> Tuple[float, Iterator[Tuple[np.ndarray, ...]]]:
+    init = estimator.init_
+    if isinstance(init, str) and init == "zero":
+        base = 0.0
+    elif hasattr(init, "constant_"):
+        base = float(np.ravel(init.constant_)[0])
+    else:
+        raise ValueError(f"Unsupported init estimator {type(init).__name__}")
+
+    def trees():
+        for tree in estimator.estimators_[:, 0]:
+            t = tree.tree_
+            yield (t.feature, t.children_left, t.children_right, t.threshold,
+                   t.value[:, 0, 0] * estimator.learning_rate, t.max_depth, None)
+
+    return base, trees()
+
+
+def _hist_trees(estimator) -> Tuple[float, Iterator[Tuple[np.ndarray, ...]]]:
+    if estimator.loss != "squared_error" or getattr(estimator, "is_categorical_", None) is not None:
+        raise ValueError("Only squared-error HistGradientBoostingRegressors without categorical features")
+
+    def trees():
+        for (predictor,) in estimator._predictors:
+            nodes = predictor.nodes
+            leaf = nodes["is_leaf"].astype(bool)
+            left = np.where(leaf, -1, nodes["left"])
+            right = np.where(leaf, -1, nodes["right"])
+            yield (nodes["feature_idx"], left, right, nodes["num_threshold"], nodes["value"],
+                   int(nodes["depth"].max()), ~nodes["missing_go_to_left"].astype(bool))
+
+    return float(np.ravel(estimator._baseline_prediction)[0]), trees()
+
+
+def _tree_source(estimator):
+    kind = type(estimator).__name__
+    if kind == "GradientBoostingRegressor":
+        return _gbr_trees(estimator), True
+    if kind == "HistGradientBoostingRegressor":
+        return _hist_trees(estimator), False
+    raise ValueError(f"Cannot compile {kind}")
+
+
+def _flatten_tree(feature, left, right, threshold, value, offset: int, nan_right=None) -> np.ndarray:
+    """One tree as NODE_DTYPE rows, renumbered breadth first so siblings are adjacent."""
+    left = np.asarray(left)
+    right = np.asarray(right)
+    order = [0]
+    position = {0: 0}
+    i = 0
+    while i < len(order):
+        node = order[i]
+        if left[node] >= 0:
+            position[left[node]] = len(order)
+            position[right[node]] = len(order) + 1
+            order += [left[node], right[node]]
+        i += 1
+    order = np.array(order)
+    leaf = left[order] < 0
+    nodes = np.zeros(len(order), dtype=NODE_DTYPE)
+    own = np.arange(offset, offset + len(order))
+    first_child = np.array([position[left[node]] if left[node] >= 0 else 0 for node in order]) + offset
+    nodes["feature"] = np.where(leaf, 0, np.asarray(feature)[order])
+    nodes["child"] = np.where(leaf, own, first_child)
+    nodes["threshold"] = np.where(leaf, np.inf, np.asarray(threshold)[order])
+    nodes["value"] = np.where(leaf, np.asarray(value)[order], 0.0)
+    if nan_right is not None:
+        nodes["nan_right"] = ~leaf & np.asarray(nan_right)[order]
+    return nodes
+
+
+def compile_model(model: Any) -> CompiledModel:
+    """
+    Flatten a fitted MultiOutputRegressor of GradientBoostingRegressors (or
+    HistGradientBoostingRegressors). Raises ValueError for anything else.
+    """
+    estimators = getattr(model, "estimators_", None)
+    if type(model).__name__ != "MultiOutputRegressor" or estimators is None:
+        raise ValueError(f"Cannot compile {type(model).__name__}")
+    chunks: List[np.ndarray] = []
+    roots: List[int] = []
+    tree_targets: List[int] = []
+    bases: List[float] = []
+    depth = 0
+    offset = 0
+    float32_kinds = set()
+    for target, estimator in enumerate(estimators):
+        (base, trees), float32_inputs = _tree_source(estimator)
+        float32_kinds.add(float32_inputs)
+        bases.append(base)
+        for feature, left, right, threshold, value, tree_depth, nan_right in trees:
+            nodes = _flatten_tree(feature, left, right, threshold, value, offset, nan_right)
+            size = len(nodes)
+            chunks.append(nodes)
+            roots.append(offset)
+            tree_targets.append(target)
+            depth = max(depth, int(tree_depth))
+            offset += size
+    if len(float32_kinds) > 1:
+        raise ValueError("Cannot compile a mix of GradientBoosting and HistGradientBoosting estimators")
+    nodes = np.concatenate(chunks) if chunks else np.zeros(0, dtype=NODE_DTYPE)
+    compiled = CompiledModel(nodes, np.array(roots), np.array(tree_targets), np.array(bases), depth,
+                             float32_kinds == {True})
+    compiled.tabulate(int(getattr(estimators[0], "n_features_in_", 2)))
+    return compiled
+
+
+def export(model: Any, model_path: Union[str, Path], version: str) -> Optional[Path]:
+    """
+    Write the compiled form of `model` for the artifact at `model_path`
+    whose digest is `version`. Returns the meta path, or None if the model
+    cannot be compiled (e.g. an online river model).
+    """
+    try:
+        compiled = compile_model(model)
+    except ValueError:
+        return None
+    model_path = Path(model_path)
+    arrays = {"nodes": compiled.nodes}
+    if compiled.table is not None:
+        arrays["table"] = compiled.table
+        arrays["edges"] = np.concatenate(compiled.edges)
+    files = {}
+    for kind, array in arrays.items():
+        name = files[kind] = f"{model_path.name}.{version}.{kind}.npy"
+        tmp = model_path.with_name(f".{name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, model_path.with_name(name))
+
+    meta = {
+        "format": FORMAT,
+        "model_version": version,
+        "files": files,
+        "targets": [f"{m}_ppm" for m in METALS][:len(compiled.base)],
+        "base": compiled.base.tolist(),
+        "roots": compiled.roots.tolist(),
+        "tree_targets": compiled.tree_targets.tolist(),
+        "depth": compiled.depth,
+        "float32_inputs": compiled.float32_inputs,
+        "edge_counts": [len(e) for e in compiled.edges] if compiled.edges is not None else None,
+    }
+    meta_path = compiled_path(model_path)
+    tmp = meta_path.with_name(f".{meta_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, meta_path)
+    _prune(model_path, keep=version)
+    return meta_path
+
+
+def _prune(model_path: Path, keep: str, retain: int = 2) -> None:
+    # Keep the arrays of the newest versions; a process may still map the previous one
+    versions: Dict[str, List[Path]] = {}
+    for kind in ARRAYS:
+        for path in model_path.parent.glob(f"{model_path.name}.*.{kind}.npy"):
+            versions.setdefault(path.name[len(model_path.name) + 1:].split(".")[0], []).append(path)
+    versions.pop(keep, None)
+    old = sorted(versions.values(), key=lambda paths: max(p.stat().st_mtime for p in paths), reverse=True)
+    for paths in old[retain - 1:]:
+        for path in paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def load_compiled(model_path: Union[str, Path], version: str) -> Optional[CompiledModel]:
+    """The compiled model for the artifact with digest `version`, if one was exported."""
+    meta_path = compiled_path(model_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT or meta.get("model_version") != version:
+            return None
+        arrays = {kind: np.load(meta_path.with_name(name), mmap_mode="r") for kind, name in meta["files"].items()}
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    edges = None
+    if "table" in arrays:
+        edges = np.split(arrays["edges"], np.cumsum(meta["edge_counts"])[:-1])
+    return CompiledModel(arrays["nodes"], np.array(meta["roots"]), np.array(meta["tree_targets"]),
+                         np.array(meta["base"]), meta["depth"], meta["float32_inputs"],
+                         arrays.get("table"), edges, meta)
+
+if __name__ == "__main__":
+    # Export an existing artifact: python -m bluvia.compiled [model_path]
+    import sys
+    import joblib
+
+    from .model import _file_digest
+    from .path_utils import get_model_path
+
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else get_model_path()
+    written = export(joblib.load(path), path, _file_digest(path))
+    print(f"Compiled model written to {written}" if written else f"{path} cannot be compiled")
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import math
+import time
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .geo import KM_PER_DEG_LAT
+from .model import METALS
+
+# Model selection: `python -m bluvia evaluate` cross-validates candidate
+# learners on the master data with spatially blocked folds, then measures
+# what each costs to train and serve, and reports which candidates are on
+# the accuracy / latency Pareto frontier.
+EVAL_FOLDS = int(os.environ.get("BLUVIA_EVAL_FOLDS", "5"))
+EVAL_BLOCK_KM = float(os.environ.get("BLUVIA_EVAL_BLOCK_KM", "5"))
+EVAL_JOBS = int(os.environ.get("BLUVIA_EVAL_JOBS", "-1"))
+EVAL_BATCH_POINTS = int(os.environ.get("BLUVIA_EVAL_BATCH_POINTS", "10000"))
+EVAL_SINGLE_CALLS = int(os.environ.get("BLUVIA_EVAL_SINGLE_CALLS", "200"))
+DEFAULT_CANDIDATES = ("gbr", "hist", "idw", "knn", "river")
+# Lower is better for each; a candidate is on the frontier unless another
+# is at least as good on all of them and better on one
+FRONTIER_OBJECTIVES = ("rel_mae", "single_ms", "batch_us_per_point")
+
+
+def parse_candidate(spec: str) -> Tuple[str, Dict[str, Any]]:
+    """'gbr:n_estimators=200,max_depth=3' -> ('gbr', {'n_estimators': 200, 'max_depth': 3})."""
+    name, _, rest = spec.partition(":")
+    params: Dict[str, Any] = {}
+    for item in filter(None, rest.split(",")):
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Bad parameter {item!r} in candidate {spec!r}; expected key=value")
+        try:
+            params[key.strip()] = json.loads(value)
+        except ValueError:
+            params[key.strip()] = value
+    return name.strip().lower(), params
+
+
+def make_learner(spec: str, n_jobs: Optional[int] = 1):
+    """The learner a candidate spec describes. Batch boosters fit without their hold-out split."""
+    from .learners import get_learner
+
+    name, params = parse_candidate(spec)
+    if name in ("gbr", "hist"):
+        params = {"n_jobs": n_jobs, "validation_fraction": 0.0, **params}
+    return get_learner(name, **params)
+
+
+def spatial_blocks(lats: np.ndarray, lons: np.ndarray, block_km: float) -> np.ndarray:
+    """Id of the block_km x block_km grid cell holding each point."""
+    dlat = block_km / KM_PER_DEG_LAT
+    dlon = dlat / max(math.cos(math.radians(float(np.mean(lats)))), 1e-6)
+    iy = np.floor(np.asarray(lats) / dlat).astype(np.int64)
+    ix = np.floor(np.asarray(lons) / dlon).astype(np.int64)
+    _, blocks = np.unique(np.column_stack([iy, ix]), axis=0, return_inverse=True)
+    return blocks.ravel()
+
+
+def blocked_folds(lats: np.ndarray, lons: np.ndarray, folds: int = EVAL_FOLDS,
+                  block_km: float = EVAL_BLOCK_KM) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    (train, test) index pairs in which every block of the grid lands wholly
+    in one test fold, so a model is never scored on points next to the ones
+    it was trained on. Plain random folds would reward models that just
+    memorize neighbouring samples.
+    """
+    from sklearn.model_selection import GroupKFold
+
+    blocks = spatial_blocks(lats, lons, block_km)
+    n_blocks = len(np.unique(blocks))
+    if n_blocks < 2:
+        raise ValueError(f"All points fall in one {block_km} km block; use a smaller block size")
+    splitter = GroupKFold(n_splits=min(folds, n_blocks))
+    return list(splitter.split(np.zeros(len(blocks)), groups=blocks))
+
+
+def _fit_fold(spec: str, X: np.ndarray, Y: np.ndarray, train_idx: np.ndarray,
+              test_idx: np.ndarray) -> Dict[str, Any]:
+    """Cross-validation task (runs in a worker process): fit on train_idx, predict test_idx."""
+    from .model import predict_with
+
+    try:
+        start = time.perf_counter()
+        model = make_learner(spec).fit(X[train_idx], Y[train_idx])
+        fit_seconds = time.perf_counter() - start
+        pred = predict_with(model, X[test_idx, 0], X[test_idx, 1])
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    return {"pred": pred, "fit_seconds": fit_seconds}
+
+
+def error_metrics(Y: np.ndarray, pred: np.ndarray, baseline: np.ndarray) -> Dict[str, Any]:
+    """
+    Per-metal MAE, RMSE and R^2 of out-of-fold predictions. `rel_mae` is
+    the mean over metals of MAE relative to `baseline` (predicting each
+    training fold's mean): below 1 beats it. Each metal is scored only on
+    rows where it was measured (Y not NaN) and the baseline is defined.
+    """
+    per_metal: Dict[str, Any] = {}
+    relative = []
+    for i, metal in enumerate(METALS):
+        scored = ~(np.isnan(Y[:, i]) | np.isnan(baseline[:, i]))
+        if not scored.any():
+            per_metal[metal] = {"rows": 0, "mae": None, "rmse": None, "r2": None, "baseline_mae": None}
+            continue
+        y = Y[scored, i]
+        err = pred[scored, i] - y
+        mae = float(np.mean(np.abs(err)))
+        base_mae = float(np.mean(np.abs(baseline[scored, i] - y)))
+        ss_tot = float(np.sum((y - y.mean()) ** 2))
+        per_metal[metal] = {
+            "rows": int(scored.sum()),
+            "mae": mae,
+            "rmse": float(np.sqrt(np.mean(err ** 2))),
+            "r2": 1.0 - float(np.sum(err ** 2)) / ss_tot if ss_tot > 0 else None,
+            "baseline_mae": base_mae,
+        }
+        if base_mae > 0:
+            relative.append(mae / base_mae)
+    return {"rel_mae": float(np.mean(relative)) if relative else None, "metals": per_metal}
+
+
+_PROBE = """
+import sys, json
+from bluvia.evaluation import _probe
+print(json.dumps(_probe(**json.loads(sys.argv[1]))))
+"""
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        # peak, not current, RSS (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _probe(path: str, bbox: List[float], batch_points: int, single_calls: int) -> Dict[str, Any]:
+    """
+    Serving cost of the artifact at `path`, in a fresh process: load it the
+    way the API does (ModelRegistry, so compiled forms are used), then time
+    single-point and batch predictions at random points inside `bbox`.
+    """
+    from .model import ModelRegistry, predict_with
+
+    before = _rss_bytes()
+    registry = ModelRegistry(path)
+    start = time.perf_counter()
+    model = registry.get()
+    load_seconds = time.perf_counter() - start
+
+    south, west, north, east = bbox
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(south, north, max(batch_points, single_calls))
+    lons = rng.uniform(west, east, len(lats))
+    for i in range(5):
+        predict_with(model, lats[i:i + 1], lons[i:i + 1])
+    single = []
+    for i in range(single_calls):
+        start = time.perf_counter()
+        predict_with(model, lats[i:i + 1], lons[i:i + 1])
+        single.append(time.perf_counter() - start)
+    batch = []
+    for _ in range(3):
+        start = time.perf_counter()
+        predict_with(model, lats[:batch_points], lons[:batch_points])
+        batch.append(time.perf_counter() - start)
+    return {
+        "format": registry.info().get("format"),
+        "load_seconds": load_seconds,
+        "single_ms": float(np.median(single)) * 1000,
+        "batch_us_per_point": min(batch) / batch_points * 1e6,
+        "rss_bytes": _rss_bytes() - before,
+    }
+
+
+def artifact_bytes(path: Path) -> int:
+    """The artifact and its compiled files."""
+    return sum(p.stat().st_size for p in path.parent.glob(path.name + "*") if p.is_file())
+
+
+def measure_cost(spec: str, X: np.ndarray, Y: np.ndarray, path: Path, bbox: List[float],
+                 batch_points: int = EVAL_BATCH_POINTS, single_calls: int = EVAL_SINGLE_CALLS) -> Dict[str, Any]:
+    """Train `spec` on all rows (timed), save it to `path` as the API would and probe its serving cost."""
+    from .model import save_model
+
+    learner = make_learner(spec, n_jobs=None)
+    start = time.perf_counter()
+    model = learner.fit(X, Y)
+    train_seconds = time.perf_counter() - start
+    save_model(model, path)
+
+    package_root = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")])))
+    args = {"path": str(path), "bbox": bbox, "batch_points": batch_points, "single_calls": single_calls}
+    proc = subprocess.run([sys.executable, "-c", _PROBE, json.dumps(args)], capture_output=True, text=True,
+                          env=env)
+    if proc.returncode:
+        raise RuntimeError(f"Probe failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''}")
+    return {"train_seconds": train_seconds, "artifact_bytes": artifact_bytes(path),
+            **json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+def pareto_front(results: List[Dict[str, Any]], objectives: Sequence[str] = FRONTIER_OBJECTIVES) -> List[str]:
+    """Candidates no other candidate beats on every objective, most accurate first."""
+    scored = [r for r in results if all(r.get(o) is not None for o in objectives)]
+    front = []
+    for r in scored:
+        dominated = any(all(o[k] <= r[k] for k in objectives) and any(o[k] < r[k] for k in objectives)
+                        for o in scored if o is not r)
+        if not dominated:
+            front.append(r)
+    return [r["candidate"] for r in sorted(front, key=lambda r: r[objectives[0]])]
+
+
+def evaluate(source: Any = None, candidates: Sequence[str] = DEFAULT_CANDIDATES, folds: int = EVAL_FOLDS,
+             block_km: float = EVAL_BLOCK_KM, n_jobs: int = EVAL_JOBS, max_rows: Optional[int] = None,
+             batch_points: int = EVAL_BATCH_POINTS, single_calls: int = EVAL_SINGLE_CALLS,
+             seed: int = 0) -> Dict[str, Any]:
+    """
+    Evaluate `candidates` (learner names with optional parameters, see
+    parse_candidate) on `source` (the master store by default, or anything
+    bluvia.schema.load accepts), optionally on a random `max_rows` sample.
+
+    The cross-validation fits of every candidate and fold run in parallel
+    (n_jobs processes). The full fits and serving probes then run one at a
+    time, so their timings don't compete with each other. A candidate that
+    fails (e.g. river not installed) is reported with its error.
+    """
+    from joblib import Parallel, delayed
+    from .schema import load
+
+    if source is None:
+        from .storage import get_master_store
+
+        source = get_master_store()
+    data = load(source).with_coordinates()
+    X = np.column_stack([data.lat, data.lon])
+    Y = np.array(data.values, dtype=np.float64)
+    total_rows = len(X)
+    if max_rows and len(X) > max_rows:
+        keep = np.sort(np.random.default_rng(seed).choice(len(X), max_rows, replace=False))
+        X, Y = X[keep], Y[keep]
+    if len(X) < 2:
+        raise ValueError("Need at least 2 rows with coordinates to evaluate")
+    # Learners train as in production (missing values as 0, see
+    # Dataset.frames); scores only count measured values
+    Y_fit = np.nan_to_num(Y, nan=0.0)
+
+    splits = blocked_folds(X[:, 0], X[:, 1], folds, block_km)
+    baseline = np.empty_like(Y)
+    for train_idx, test_idx in splits:
+        measured = ~np.isnan(Y[train_idx])
+        counts = measured.sum(axis=0)
+        sums = np.where(measured, Y[train_idx], 0.0).sum(axis=0)
+        baseline[test_idx] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    start = time.perf_counter()
+    tasks = [(spec, fold) for spec in candidates for fold in range(len(splits))]
+    outcomes = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(_fit_fold)(spec, X, Y_fit, *splits[fold]) for spec, fold in tasks)
+    cv_seconds = time.perf_counter() - start
+
+    bbox = [float(X[:, 0].min()), float(X[:, 1].min()), float(X[:, 0].max()), float(X[:, 1].max())]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bluvia-eval-") as tmp:
+        for i, spec in enumerate(candidates):
+            name, params = parse_candidate(spec)
+            result: Dict[str, Any] = {"candidate": spec, "learner": name, "params": params}
+            runs = [out for (s, _), out in zip(tasks, outcomes) if s == spec]
+            errors = [out["error"] for out in runs if "error" in out]
+            if errors:
+                result.update(status="failed", error=errors[0])
+                results.append(result)
+                continue
+            pred = np.empty_like(Y_fit)
+            for (train_idx, test_idx), out in zip(splits, runs):
+                pred[test_idx] = out["pred"]
+            metrics = error_metrics(Y, pred, baseline)
+            result.update(status="ok", rel_mae=metrics["rel_mae"], metals=metrics["metals"],
+                          fold_fit_seconds=float(np.mean([out["fit_seconds"] for out in runs])))
+            try:
+                path = Path(tmp) / f"candidate-{i}.joblib"
+                result.update(measure_cost(spec, X, Y_fit, path, bbox, batch_points, single_calls))
+            except Exception as e:
+                result.update(status="failed", error=f"{type(e).__name__}: {e}")
+            results.append(result)
+
+    return {
+        "created_at": time.time(),
+        "rows": int(len(X)),
+        "total_rows": int(total_rows),
+        "folds": len(splits),
+        "block_km": block_km,
+        "blocks": int(len(np.unique(spatial_blocks(X[:, 0], X[:, 1], block_km)))),
+        "cv_seconds": cv_seconds,
+        "objectives": list(FRONTIER_OBJECTIVES),
+        "candidates": results,
+        "frontier": pareto_front(results),
+    }
+
+
+def print_summary(report: Dict[str, Any]) -> None:
+    print(f"{report['rows']} rows, {report['folds']} folds over {report['blocks']} blocks of {report['block_km']} km")
+    width = max([len("candidate")] + [len(r["candidate"]) for r in report["candidates"]])
+    print(f"{'candidate':<{width}} {'rel_mae':>8} {'train_s':>8} {'single_ms':>9} {'batch_us':>9} "
+          f"{'size_kb':>9} {'rss_mb':>7}")
+    for r in report["candidates"]:
+        if r["status"] != "ok":
+            print(f"{r['candidate']:<{width}} {r['status']}: {r['error']}")
+            continue
+        mark = " *" if r["candidate"] in report["frontier"] else ""
+        print(f"{r['candidate']:<{width}} {r['rel_mae']:8.3f} {r['train_seconds']:8.2f} {r['single_ms']:9.3f} "
+              f"{r['batch_us_per_point']:9.2f} {r['artifact_bytes'] / 1024:9.1f} "
+              f"{r['rss_bytes'] / 2 ** 20:7.1f}{mark}")
+    print("* on the frontier (" + ", ".join(report["objectives"]) + ")")
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m bluvia evaluate",
+                                     description="Cross-validate candidate learners and measure their serving cost")
+    parser.add_argument("--data", help="training CSV (default: the master store)")
+    parser.add_argument("--candidates", nargs="+", default=list(DEFAULT_CANDIDATES),
+                        help="learners, optionally with parameters: gbr hist:max_depth=4 idw:k=12,power=1")
+    parser.add_argument("--folds", type=int, default=EVAL_FOLDS)
+    parser.add_argument("--block-km", type=float, default=EVAL_BLOCK_KM, help="side of the spatial CV blocks")
+    parser.add_argument("--jobs", type=int, default=EVAL_JOBS, help="parallel cross-validation fits")
+    parser.add_argument("--rows", default="",
+                        help="comma separated sample sizes to evaluate at, to see how the frontier moves as "
+                             "data grows (default: all rows)")
+    parser.add_argument("--batch-points", type=int, default=EVAL_BATCH_POINTS)
+    parser.add_argument("--out", default="evaluation.json")
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(s)) for s in args.rows.split(",") if s.strip()] or [None]
+    reports = []
+    try:
+        for size in sizes:
+            report = evaluate(args.data, args.candidates, args.folds, args.block_km, args.jobs, size,
+                              args.batch_points)
+            print_summary(report)
+            reports.append(report)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    with open(args.out, "w") as f:
+        json.dump(reports[0] if len(reports) == 1 else {"runs": reports}, f, indent=2)
+    print(f"Report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distance in km from one point to arrays of points."""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - math.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def km_to_deg(radius_km: float, lat: float) -> Tuple[float, float]:
+    """Half-widths in degrees (lat, lon) of a box enclosing a radius around `lat`."""
+    dlat = radius_km / KM_PER_DEG_LAT
+    coslat = max(math.cos(math.radians(min(abs(lat) + dlat, 90.0))), 1e-6)
+    return dlat, min(dlat / coslat, 180.0)
+
+
+class GridBuckets:
+    """
+    Fixed-size lat/lon grid that maps each cell to the row indices it holds.
+
+    Rows can be added incrementally; a box query only touches the cells that
+    overlap the box, so the cost depends on local density, not total rows.
+    """
+
+    def __init__(self, cell_deg: float):
+        self.cell_deg = float(cell_deg)
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        self._occupied: Optional[np.ndarray] = None
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def add(self, lats: np.ndarray, lons: np.ndarray, start: int = 0) -> None:
+        iy = np.floor(np.asarray(lats) / self.cell_deg).astype(np.int64)
+        ix = np.floor(np.asarray(lons) / self.cell_deg).astype(np.int64)
+        cells = self._cells
+        self._occupied = None
+        for offset, key in enumerate(zip(iy.tolist(), ix.tolist())):
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [start + offset]
+            else:
+                bucket.append(start + offset)
+
+    def cell_count(self, lat: float, lon: float) -> int:
+        return len(self._cells.get(self._cell(lat, lon), ()))
+
+    def neighbourhood_count(self, lat: float, lon: float) -> int:
+        """Rows in the point's cell and its 8 neighbours."""
+        cy, cx = self._cell(lat, lon)
+        cells = self._cells
+        return sum(len(cells.get((cy + dy, cx + dx), ())) for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+
+    def candidates(self, lat: float, lon: float, radius_deg: float,
+                   lon_radius_deg: Optional[float] = None) -> np.ndarray:
+        """Indices of rows in every cell overlapping the box lat/lon +- radius_deg."""
+        if lon_radius_deg is None:
+            lon_radius_deg = radius_deg
+        y0, x0 = self._cell(lat - radius_deg, lon - lon_radius_deg)
+        y1, x1 = self._cell(lat + radius_deg, lon + lon_radius_deg)
+        found = []
+        cells = self._cells
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                bucket = cells.get((y, x))
+                if bucket:
+                    found.extend(bucket)
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+    @staticmethod
+    def _encode(iy: np.ndarray, ix: np.ndarray) -> np.ndarray:
+        return (iy.astype(np.int64) << 32) + (ix.astype(np.int64) & 0xFFFFFFFF)
+
+    def near_occupied(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Boolean mask of points whose cell or any of its 8 neighbours holds rows."""
+        occupied = self._occupied
+        if occupied is None:
+            keys = np.array(list(self._cells.keys()), dtype=np.int64).reshape(-1, 2)
+            occupied = np.unique(self._encode(keys[:, 0], keys[:, 1]))
+            self._occupied = occupied
+        iy = np.floor(np.asarray(lats) / self.cell_deg).astype(np.int64)
+        ix = np.floor(np.asarray(lons) / self.cell_deg).astype(np.int64)
+        mask = np.zeros(iy.shape, dtype=bool)
+        if not len(occupied):
+            return mask
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                mask |= np.isin(self._encode(iy + dy, ix + dx), occupied)
+        return mask
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self._cells.values())
+
+
+class RadiusIndex:
+    """
+    Static point set answering "everything within r km" queries.
+
+    A coarse grid pre-filters candidates to the box around the query, and
+    only those get the exact (vectorized haversine) distance.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, labels: Optional[np.ndarray] = None,
+                 cell_deg: float = 0.05):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=object) if labels is not None else None
+        self._grid = GridBuckets(cell_deg)
+        self._grid.add(self.lats, self.lons)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def within(self, lat: float, lon: float, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and distances (km) of points within radius_km, nearest first."""
+        dlat, dlon = km_to_deg(radius_km, lat)
+        idx = self._grid.candidates(lat, lon, dlat, dlon)
+        if not len(idx):
+            return idx, np.empty(0)
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        keep = dist <= radius_km
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        return idx[order], dist[order]
+
+
+def _unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """(n, 3) points on the unit sphere. Chord length orders points like great-circle distance."""
+    lat, lon = np.radians(lats), np.radians(lons)
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_km(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+class NearestIndex:
+    """
+    Nearest-neighbour lookup over a static point set: a Euclidean KD-tree
+    over the points as 3D unit vectors, which finds the same neighbours as a
+    haversine BallTree at a fraction of the cost per query. Sets of up to
+    BRUTE_FORCE_POINTS points are searched exhaustively with NumPy instead,
+    which beats the tree's per-query overhead.
+    """
+
+    BRUTE_FORCE_POINTS = 64
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self._tree = None
+        if len(self.lats) > self.BRUTE_FORCE_POINTS:
+            from sklearn.neighbors import KDTree
+
+            self._tree = KDTree(_unit_vectors(self.lats, self.lons))
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def _distances_km(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """(queries, points) haversine distances, for the brute-force path."""
+        lat1 = np.radians(lats)[:, None]
+        lat2 = np.radians(self.lats)[None, :]
+        dlon = np.radians(self.lons)[None, :] - np.radians(lons)[:, None]
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Index of and distance (km) to the nearest point, for each query point."""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        if self._tree is None:
+            dist = self._distances_km(lats, lons)
+            idx = np.argmin(dist, axis=1)
+            return idx, dist[np.arange(len(lats)), idx]
+        chord, idx = self._tree.query(_unit_vectors(lats, lons), k=1)
+        return idx[:, 0], _chord_to_km(chord[:, 0])
+
+    def k_nearest(self, lats: np.ndarray, lons: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(n, k) indices of and distances (km) to the k nearest points, nearest first."""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        k = max(1, min(k, len(self.lats)))
+        if self._tree is None:
+            dist = self._distances_km(lats, lons)
+            idx = np.argsort(dist, axis=1, kind="stable")[:, :k]
+            return idx, np.take_along_axis(dist, idx, axis=1)
+        chord, idx = self._tree.query(_unit_vectors(lats, lons), k=k)
+        return idx, _chord_to_km(chord)
+
+    def count_within(self, lats: np.ndarray, lons: np.ndarray, radius_km: float) -> np.ndarray:
+        """Number of points within radius_km of each query point."""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        if not len(self.lats):
+            return np.zeros(len(lats), dtype=np.int64)
+        if self._tree is None:
+            return (self._distances_km(lats, lons) <= radius_km).sum(axis=1)
+        chord = 2 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+        return self._tree.query_radius(_unit_vectors(lats, lons), r=chord, count_only=True).astype(np.int64)
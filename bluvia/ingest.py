@@ -0,0 +1,215 @@
+import os
+import csv
+import math
+import codecs
+import asyncio
+import numpy as np
+from io import StringIO
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .model import METALS
+from .schema import METAL_COLUMNS, normalize_column
+
+UPLOAD_CHUNK_BYTES = int(os.environ.get("BLUVIA_UPLOAD_CHUNK_BYTES", str(1 << 20)))
+UPLOAD_BATCH_ROWS = int(os.environ.get("BLUVIA_UPLOAD_BATCH_ROWS", "5000"))
+
+# Column names written to user_data.csv (what UserDataIndex reads back)
+USER_DATA_FIELDS = ["Lat", "Lon"] + [f"SEM_{m}_ppm" for m in METALS]
+
+
+class RowBatch(NamedTuple):
+    """Validated upload rows: coordinates and (n, len(METALS)) values, NaN where missing."""
+    lats: np.ndarray
+    lons: np.ndarray
+    values: np.ndarray
+    missing_columns: List[str]
+
+    @property
+    def size(self) -> int:
+        return len(self.lats)
+
+
+def _split_records(text: str) -> Tuple[str, str]:
+    """
+    Split decoded text into (complete records, trailing partial record).
+    A newline only ends a record when it is outside a quoted field, i.e.
+    preceded by an even number of quote characters.
+    """
+    end = len(text)
+    while True:
+        cut = text.rfind("\n", 0, end)
+        if cut < 0:
+            return "", text
+        if text.count('"', 0, cut) % 2 == 0:
+            return text[:cut + 1], text[cut + 1:]
+        end = cut
+
+
+class UploadParser:
+    """
+    Incremental CSV parser for uploads. `feed` takes raw bytes in arbitrary
+    chunks and returns the rows completed so far, validated and converted to
+    float arrays; a partial trailing record is held until the next chunk.
+    Header names are mapped onto the canonical schema (bluvia.schema).
+    Rejected rows are counted per reason in `errors`.
+    """
+
+    def __init__(self, encoding: str = "utf-8-sig"):
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._pending = ""
+        self._lat_idx = -1
+        self._lon_idx = -1
+        self._metal_idx: Optional[List[int]] = None
+        self.missing_columns: List[str] = []
+        self.rows = 0
+        self.errors: Dict[str, int] = {}
+
+    @property
+    def rejected(self) -> int:
+        return sum(self.errors.values())
+
+    def _reject(self, reason: str) -> None:
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def _read_header(self, record: List[str]) -> None:
+        names = [normalize_column(name) for name in record]
+        position = {}
+        for i, name in enumerate(names):
+            position.setdefault(name, i)
+        if "lat" not in position or "lon" not in position:
+            raise ValueError("CSV must contain 'lat' and 'lon' columns.")
+        self._lat_idx = position["lat"]
+        self._lon_idx = position["lon"]
+        self._metal_idx = [position.get(col, -1) for col in METAL_COLUMNS]
+        self.missing_columns = [col for col in METAL_COLUMNS if col not in position]
+
+    def _parse(self, text: str) -> RowBatch:
+        lats, lons, values = [], [], []
+        for record in csv.reader(StringIO(text)):
+            if self._metal_idx is None:
+                if any(field.strip() for field in record):
+                    self._read_header(record)
+                continue
+            if not any(field.strip() for field in record):
+                continue
+            width = len(record)
+            lat = record[self._lat_idx].strip() if self._lat_idx < width else ""
+            lon = record[self._lon_idx].strip() if self._lon_idx < width else ""
+            if not lat or not lon:
+                self._reject("missing_coordinates")
+                continue
+            try:
+                lat, lon = float(lat), float(lon)
+            except ValueError:
+                self._reject("invalid_coordinates")
+                continue
+            if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+                # NaN fails both comparisons as well
+                self._reject("coordinates_out_of_range")
+                continue
+            row = []
+            for idx in self._metal_idx:
+                field = record[idx].strip() if 0 <= idx < width else ""
+                if not field:
+                    row.append(math.nan)
+                    continue
+                try:
+                    value = float(field)
+                except ValueError:
+                    break
+                if not math.isfinite(value) or value < 0:
+                    break
+                row.append(value)
+            if len(row) != len(METALS):
+                self._reject("invalid_metal_value")
+                continue
+            lats.append(lat)
+            lons.append(lon)
+            values.append(row)
+        self.rows += len(lats)
+        return RowBatch(np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64),
+                        np.array(values, dtype=np.float64).reshape(-1, len(METALS)), self.missing_columns)
+
+    def feed(self, data: bytes, final: bool = False) -> RowBatch:
+        text = self._pending + self._decoder.decode(data, final=final)
+        if final:
+            complete, self._pending = text, ""
+        else:
+            complete, self._pending = _split_records(text)
+        return self._parse(complete)
+
+
+def concat_batches(batches: List[RowBatch]) -> RowBatch:
+    if len(batches) == 1:
+        return batches[0]
+    return RowBatch(np.concatenate([b.lats for b in batches]), np.concatenate([b.lons for b in batches]),
+                    np.concatenate([b.values for b in batches]), batches[0].missing_columns)
+
+
+def batch_rows(batch: RowBatch, fieldnames: List[str]) -> Iterator[List[str]]:
+    """
+    CSV rows for `batch` laid out as `fieldnames`, the header of the file
+    being appended to: any of its spellings of the coordinate and metal
+    columns ('Latitude', 'Fe', 'SEM_Fe_ppm', ...) get the values, other
+    columns are left blank.
+    """
+    columns = {"lat": batch.lats, "lon": batch.lons}
+    for i, col in enumerate(METAL_COLUMNS):
+        columns[col] = batch.values[:, i]
+    layout = [columns.get(normalize_column(name)) for name in fieldnames]
+    for r in range(batch.size):
+        yield ["" if col is None or math.isnan(col[r]) else repr(float(col[r])) for col in layout]
+
+
+async def ingest_upload(file, write_batch: Callable[[RowBatch], int],
+                        chunk_bytes: int = UPLOAD_CHUNK_BYTES,
+                        max_batch_rows: int = UPLOAD_BATCH_ROWS) -> Dict:
+    """
+    Stream an UploadFile through UploadParser and hand validated batches of
+    about `max_batch_rows` rows to `write_batch`. Parsing and writing both
+    run in the thread pool. At most one batch is being written while the
+    next is parsed, and reading waits for that write to finish, so memory
+    stays bounded by one chunk plus two batches whatever the file size.
+
+    `write_batch` returns how many rows it added to the master dataset.
+    """
+    parser = UploadParser()
+    buffered: List[RowBatch] = []
+    buffered_rows = 0
+    pending: Optional[asyncio.Future] = None
+    master_rows = 0
+
+    async def submit(batches: List[RowBatch]) -> None:
+        nonlocal pending, master_rows
+        if pending is not None:
+            master_rows += await pending
+        pending = asyncio.ensure_future(run_in_threadpool(write_batch, concat_batches(batches)))
+
+    try:
+        while True:
+            chunk = await file.read(chunk_bytes)
+            batch = await run_in_threadpool(parser.feed, chunk, not chunk)
+            if batch.size:
+                buffered.append(batch)
+                buffered_rows += batch.size
+            if buffered and (buffered_rows >= max_batch_rows or not chunk):
+                await submit(buffered)
+                buffered, buffered_rows = [], 0
+            if not chunk:
+                break
+        if pending is not None:
+            master_rows += await pending
+            pending = None
+    finally:
+        if pending is not None:
+            await asyncio.wait([pending])
+
+    return {
+        "rows": parser.rows,
+        "rejected": parser.rejected,
+        "errors": dict(parser.errors),
+        "masterRows": master_rows,
+        "missingColumns": parser.missing_columns,
+    }
@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: jobs are only coordinated within a process
+    fcntl = None
+
+from .path_utils import get_data_path, get_model_path
+
+RETRAIN_DEBOUNCE_S = float(os.environ.get("BLUVIA_RETRAIN_DEBOUNCE_S", "30"))
+RETRAIN_MAX_DELAY_S = float(os.environ.get("BLUVIA_RETRAIN_MAX_DELAY_S", "300"))
+JOB_HISTORY = 200
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def jobs_dir() -> Path:
+    return Path(os.environ.get("BLUVIA_JOBS_DIR") or get_data_path("jobs"))
+
+
+@contextmanager
+def _flocked(path: Path):
+    """Exclusive lock on `path` across processes (and threads: each call opens its own description)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run_retrain(model_path: str, lock_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Process-pool entry point: retrain on the master store, save atomically,
+    then regenerate the prediction tile grid for the new model. Holding
+    `lock_path` serializes retrains started by different server processes.
+    """
+    from .Bluvia_src.Bluvia_Upload import retrain_from_master
+    from .tiles import build_for_model
+
+    with _flocked(Path(lock_path)) if lock_path else nullcontext():
+        started = time.time()
+        rows = retrain_from_master(model_path)
+        finished = time.time()
+        try:
+            build_for_model(model_path)
+            tiles_error = None
+        except Exception as e:
+            tiles_error = f"Model saved but tile rebuild failed: {e}"
+    return {"started_at": started, "finished_at": finished, "rows": rows, "tiles_error": tiles_error}
+
+
+class RetrainQueue:
+    """
+    Debounced retrain scheduler, shared by every server process.
+
+    Uploads call `enqueue`. Requests arriving while a job is still pending
+    are coalesced into it, and the job is only dispatched once no new upload
+    has arrived for `debounce_s` (or `max_delay_s` after its first upload).
+    Training runs in a separate process so it never blocks the API; the new
+    artifact is written atomically and picked up by the model registry.
+
+    Job records are JSON files in `directory` (one per job, plus a pointer
+    to the pending one) changed only under a flock, so any worker can
+    report any job and uploads landing on different workers join the same
+    pending job. Each worker arms a timer for the job's due time; the first
+    to fire after it dispatches, and a lock file makes retrains from
+    different processes run one at a time.
+    """
+
+    def __init__(self, model_path: Union[str, Path, None] = None, debounce_s: float = RETRAIN_DEBOUNCE_S,
+                 max_delay_s: float = RETRAIN_MAX_DELAY_S, runner=run_retrain,
+                 directory: Union[str, Path, None] = None):
+        self.model_path = str(model_path or get_model_path())
+        self.debounce_s = debounce_s
+        self.max_delay_s = max_delay_s
+        self.runner = runner
+        self._directory = Path(directory) if directory else None
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def directory(self) -> Path:
+        return self._directory or jobs_dir()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, _flocked(self.directory / ".lock"):
+            yield
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _read(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.directory / name) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, name: str, payload: Dict[str, Any]) -> None:
+        from .storage import _write_json_atomic
+
+        _write_json_atomic(self.directory / name, payload)
+
+    def _pending_locked(self) -> Optional[Dict[str, Any]]:
+        pointer = self._read("pending.json") or {}
+        job = self._read(f"{pointer['id']}.json") if pointer.get("id") else None
+        return job if job is not None and job["status"] == "pending" else None
+
+    def _prune_locked(self) -> None:
+        jobs = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        jobs = [p for p in jobs if JOB_ID.match(p.stem)]
+        for path in jobs[:max(0, len(jobs) - JOB_HISTORY)]:
+            path.unlink(missing_ok=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a threaded server process is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _arm(self, due_at: float) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(max(0.0, due_at - time.time()), self._dispatch)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def enqueue(self, rows: int = 0) -> str:
+        """Request a retrain covering `rows` new rows. Returns the (possibly shared) job id."""
+        with self._locked():
+            now = time.time()
+            job = self._pending_locked()
+            if job is None:
+                job = {
+                    "id": uuid.uuid4().hex,
+                    "status": "pending",
+                    "created_at": now,
+                    "started_at": None,
+                    "finished_at": None,
+                    "duration_s": None,
+                    "new_rows": 0,
+                    "rows": None,
+                    "uploads": 0,
+                    "error": None,
+                }
+            job["new_rows"] += rows
+            job["uploads"] += 1
+            job["due_at"] = min(now + self.debounce_s, job["created_at"] + self.max_delay_s)
+            self._write(f"{job['id']}.json", job)
+            self._write("pending.json", {"id": job["id"]})
+            self._prune_locked()
+        self._arm(job["due_at"])
+        return job["id"]
+
+    def _dispatch(self, force: bool = False) -> None:
+        with self._locked():
+            job = self._pending_locked()
+            if job is None:
+                return
+            if not force and job["due_at"] > time.time():
+                # pushed back by a later upload, possibly on another worker
+                due_at = job["due_at"]
+                job = None
+            else:
+                job["status"] = "running"
+                self._write(f"{job['id']}.json", job)
+                self._write("pending.json", {})
+        if job is None:
+            self._arm(due_at)
+            return
+        try:
+            future = self._get_executor().submit(self.runner, self.model_path, str(self.directory / "run.lock"))
+        except Exception as e:
+            self._finish(job["id"], error=e)
+            return
+        future.add_done_callback(lambda f: self._finish(job["id"], future=f))
+
+    def _finish(self, job_id: str, future=None, error: Optional[BaseException] = None) -> None:
+        if future is not None:
+            error = future.exception()
+        with self._locked():
+            job = self._read(f"{job_id}.json")
+            if job is None:
+                return
+            if error is not None:
+                job.update(status="failed", error=str(error), finished_at=time.time())
+            else:
+                result = future.result()
+                job.update(status="succeeded", started_at=result["started_at"],
+                           finished_at=result["finished_at"], rows=result["rows"],
+                           duration_s=result["finished_at"] - result["started_at"],
+                           error=result.get("tiles_error"))
+            self._write(f"{job_id}.json", job)
+
+    def flush(self) -> Optional[str]:
+        """Dispatch the pending job now instead of waiting for the debounce."""
+        with self._locked():
+            job = self._pending_locked()
+        if job is None:
+            return None
+        self._dispatch(force=True)
+        return job["id"]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not JOB_ID.match(job_id):
+            return None
+        return self._read(f"{job_id}.json")
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+retrain_queue = RetrainQueue()
@@ -0,0 +1,244 @@
+import os
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+from .model import METALS, save_model
+
+LEARNER = os.environ.get("BLUVIA_LEARNER", "gbr")
+ONLINE_CHECKPOINT_ROWS = int(os.environ.get("BLUVIA_ONLINE_CHECKPOINT_ROWS", "10000"))
+
+GBR_PARAMS = dict(
+    n_estimators=50,
+    learning_rate=0.05,
+    max_depth=2,
+    min_samples_split=3,
+    min_samples_leaf=2,
+    subsample=0.8,
+    random_state=42,
+)
+
+
+def _as_arrays(X, Y=None):
+    X = np.asarray(X, dtype=np.float64)
+    if Y is None:
+        return X
+    return X, np.asarray(Y, dtype=np.float64).reshape(len(X), -1)
+
+
+class Learner:
+    """
+    Training strategy for the prediction model.
+
+    `fit` trains a new artifact from scratch. Online learners also provide
+    `create` and `update`, which folds new rows into an existing artifact.
+    Artifacts expose a scikit-learn style `predict(X) -> (n, len(METALS))`
+    so the model registry and API serve every learner the same way.
+    """
+
+    name = "base"
+    online = False
+
+    def fit(self, X, Y) -> Any:
+        raise NotImplementedError
+
+    def create(self) -> Any:
+        raise NotImplementedError(f"{self.name} learner does not support incremental updates")
+
+    def update(self, model: Any, X_new, Y_new, checkpoint: Optional[Callable[[Any], None]] = None) -> Any:
+        raise NotImplementedError(f"{self.name} learner does not support incremental updates")
+
+    def can_update(self, model: Any) -> bool:
+        return False
+
+
+class GBRLearner(Learner):
+    """
+    Batch MultiOutputRegressor of per-metal boosters, refit on the full
+    history with the targets trained in parallel. `hist=True` swaps in
+    HistGradientBoostingRegressor for large datasets.
+    """
+
+    def __init__(self, hist: bool = False, n_jobs: Optional[int] = None,
+                 validation_fraction: Optional[float] = None, **params):
+        self.hist = hist
+        self.name = "hist" if hist else "gbr"
+        self.params = {**GBR_PARAMS, **params}
+        # None: the bluvia.training defaults (BLUVIA_TRAIN_JOBS, BLUVIA_TRAIN_VALIDATION)
+        self.n_jobs = n_jobs
+        self.validation_fraction = validation_fraction
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    def fit(self, X, Y) -> Any:
+        from .training import fit_multi_output, make_estimator
+
+        options = {k: v for k, v in (("n_jobs", self.n_jobs), ("validation_fraction", self.validation_fraction))
+                   if v is not None}
+        model, self.last_report = fit_multi_output(X, Y, make_estimator(self.params, hist=self.hist), **options)
+        return model
+
+
+class SpatialInterpolator:
+    """
+    Predicts from the training samples themselves: the mean of the `k`
+    nearest samples, weighted by 1 / distance**power (power 0: the plain
+    k-NN mean). A query on top of a sample returns that sample's values.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray, k: int = 8, power: float = 2.0):
+        from .geo import NearestIndex
+
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(lats), -1)
+        self.k = k
+        self.power = power
+        self._index = NearestIndex(lats, lons)
+
+    def predict(self, X) -> np.ndarray:
+        X = _as_arrays(X)
+        idx, dist = self._index.k_nearest(X[:, 0], X[:, 1], self.k)
+        if self.power:
+            # 1 mm is "on top of" a sample
+            weights = 1.0 / np.maximum(dist, 1e-6) ** self.power
+        else:
+            weights = np.ones_like(dist)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return np.einsum("nk,nkm->nm", weights, self.values[idx])
+
+
+class InterpolationLearner(Learner):
+    """Inverse-distance weighted (idw) or plain k-NN (knn) interpolation of the samples; "fitting" indexes them."""
+
+    def __init__(self, k: int = 8, power: float = 2.0, name: str = "idw"):
+        self.k = k
+        self.power = power
+        self.name = name
+
+    def fit(self, X, Y) -> SpatialInterpolator:
+        X, Y = _as_arrays(X, Y)
+        valid = ~np.isnan(X).any(axis=1)
+        return SpatialInterpolator(X[valid, 0], X[valid, 1], np.nan_to_num(Y[valid], nan=0.0), self.k, self.power)
+
+
+class RiverRegressor:
+    """
+    One river regressor per metal behind a scikit-learn style predict().
+    `rows_seen` counts the master-store rows already learned, so updates
+    only ever touch rows appended after the last checkpoint.
+    """
+
+    feature_names = ("lat", "lon")
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.models = {metal: factory() for metal in METALS}
+        self.rows_seen = 0
+
+    def learn_many(self, X, Y) -> "RiverRegressor":
+        X, Y = _as_arrays(X, Y)
+        self.rows_seen += len(X)
+        valid = ~np.isnan(X).any(axis=1)
+        X, Y = X[valid], np.nan_to_num(Y[valid], nan=0.0)
+        for x_row, y_row in zip(X.tolist(), Y.tolist()):
+            x = dict(zip(self.feature_names, x_row))
+            for metal, y in zip(METALS, y_row):
+                self.models[metal].learn_one(x, y)
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        X = _as_arrays(X)
+        out = np.empty((len(X), len(METALS)))
+        for i, x_row in enumerate(X.tolist()):
+            x = dict(zip(self.feature_names, x_row))
+            for j, metal in enumerate(METALS):
+                out[i, j] = self.models[metal].predict_one(x) or 0.0
+        return out
+
+
+def _default_river_model():
+    try:
+        from river import forest
+    except ImportError as e:
+        raise ImportError("The 'river' learner requires the river package (see requirements.txt)") from e
+    return forest.ARFRegressor(seed=42)
+
+
+class RiverLearner(Learner):
+    """
+    Online learner: an adaptive random forest (river) per metal, trained
+    with learn_one on new rows only, so ingestion cost is O(new rows).
+    """
+
+    name = "river"
+    online = True
+
+    def __init__(self, factory: Callable[[], Any] = _default_river_model,
+                 checkpoint_rows: int = ONLINE_CHECKPOINT_ROWS):
+        self.factory = factory
+        self.checkpoint_rows = checkpoint_rows
+
+    def can_update(self, model: Any) -> bool:
+        return isinstance(model, RiverRegressor)
+
+    def create(self) -> RiverRegressor:
+        return RiverRegressor(self.factory)
+
+    def fit(self, X, Y) -> RiverRegressor:
+        return self.update(self.create(), X, Y)
+
+    def update(self, model: RiverRegressor, X_new, Y_new,
+               checkpoint: Optional[Callable[[Any], None]] = None) -> RiverRegressor:
+        X_new, Y_new = _as_arrays(X_new, Y_new)
+        step = max(1, self.checkpoint_rows)
+        for start in range(0, len(X_new), step):
+            model.learn_many(X_new[start:start + step], Y_new[start:start + step])
+            if checkpoint is not None and start + step < len(X_new):
+                checkpoint(model)
+        return model
+
+
+# Factories take the learner's parameters as keyword arguments
+LEARNERS: Dict[str, Callable[..., Learner]] = {
+    "gbr": GBRLearner,
+    "hist": lambda **params: GBRLearner(hist=True, **params),
+    "idw": lambda **params: InterpolationLearner(**{"power": 2.0, **params}, name="idw"),
+    "knn": lambda **params: InterpolationLearner(**{"power": 0.0, **params}, name="knn"),
+    "river": RiverLearner,
+}
+
+
+def get_learner(name: Union[str, Learner, None] = None, **params) -> Learner:
+    """Learner by name (default: BLUVIA_LEARNER, else 'gbr'), built with `params`."""
+    if isinstance(name, Learner):
+        return name
+    name = (name or LEARNER).lower()
+    if name not in LEARNERS:
+        raise ValueError(f"Unknown learner {name!r}; choose from {sorted(LEARNERS)}")
+    return LEARNERS[name](**params)
+
+
+def train(X, Y, model_path: Union[str, Path], learner: Optional[Learner] = None, existing: Any = None,
+          offset: int = 0) -> Any:
+    """
+    Train and save a model.
+
+    Batch learners are fit on all of X/Y. Online learners continue from
+    `existing` when it is compatible (else a fresh artifact) and only learn
+    the rows after its `rows_seen`, so X/Y must be the append-only history
+    in storage order, from row `offset` on (which must not be past
+    `rows_seen`); the artifact is checkpointed periodically.
+    """
+    learner = learner or get_learner()
+    if learner.online:
+        model = existing if learner.can_update(existing) else learner.create()
+        X, Y = _as_arrays(X, Y)
+        start = model.rows_seen - offset
+        if start < 0:
+            raise ValueError(f"Rows from {offset} on don't cover the model's history ({model.rows_seen} rows seen)")
+        model = learner.update(model, X[start:], Y[start:], checkpoint=lambda m: save_model(m, model_path))
+    else:
+        model = learner.fit(X, Y)
+    save_model(model, model_path)
+    if getattr(learner, "last_report", None):
+        from .training import write_report
+
+        write_report({**learner.last_report, "learner": learner.name}, model_path)
+    return model
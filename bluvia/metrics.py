@@ -0,0 +1,435 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PROFILE_DIR = os.environ.get("BLUVIA_PROFILE_DIR")
+# Fraction of requests profiled when PROFILE_DIR is set; a request can also
+# ask for it with the X-Bluvia-Profile: 1 header
+PROFILE_RATE = float(os.environ.get("BLUVIA_PROFILE_RATE", "0"))
+PROFILE_INTERVAL_S = float(os.environ.get("BLUVIA_PROFILE_INTERVAL_MS", "1")) / 1000.0
+
+# With several server processes (bluvia.serve sets this), each one writes a
+# snapshot of its metrics here every METRICS_FLUSH_S and /metrics sums them
+METRICS_DIR = os.environ.get("BLUVIA_METRICS_DIR")
+METRICS_FLUSH_S = float(os.environ.get("BLUVIA_METRICS_FLUSH_S", "1.0"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, values, extra: str = "") -> str:
+    parts = [f'{name}="{str(v)}"'.replace("\n", " ") for name, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    """
+    Base for the Prometheus-style metrics below: one value per label set.
+    Values are kept per process; with METRICS_DIR, `render` shows them
+    summed over the server's processes, except for metrics created with
+    multiprocess="local", which show the answering process's own values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), multiprocess: str = "sum"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.multiprocess = multiprocess
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        REGISTRY.append(self)
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def combine(a: Any, b: Any) -> Any:
+        return b if a is None else a + b
+
+    def reset(self) -> None:
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self, values: Optional[Dict[Tuple[str, ...], Any]] = None) -> List[str]:
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], Any]] = None) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] +
+                         self.samples(values))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def replace(self, value: float, **labels) -> None:
+        """Set this label set and drop all others (e.g. an info metric whose version changed)."""
+        with self._lock:
+            self._values = {_label_key(self.labelnames, labels): value}
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # per-bucket counts, then +Inf count and sum
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._values.items()]
+
+    @staticmethod
+    def combine(a: Any, b: Any) -> Any:
+        return list(b) if a is None else [x + y for x, y in zip(a, b)]
+
+    def samples(self, values: Optional[Dict[Tuple[str, ...], Any]] = None) -> List[str]:
+        if values is None:
+            with self._lock:
+                values = {key: list(series) for key, series in self._values.items()}
+        lines = []
+        for key, series in values.items():
+            bounds = [str(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, series):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {series[-2]}")
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+REQUEST_SECONDS = Histogram("bluvia_request_duration_seconds", "HTTP request latency.",
+                            ("method", "endpoint", "status"))
+IN_FLIGHT = Gauge("bluvia_requests_in_flight", "HTTP requests being handled.")
+SPAN_SECONDS = Histogram("bluvia_span_duration_seconds", "Time spent in named request stages.", ("span",))
+ROWS_SCANNED = Counter("bluvia_rows_scanned_total", "Rows read or inspected, by source.", ("source",))
+CACHE_REQUESTS = Counter("bluvia_cache_requests_total", "Response cache lookups.", ("cache", "result"))
+MODEL_INFO = Gauge("bluvia_model_info", "Loaded model version (value is always 1).", ("version",),
+                   multiprocess="local")
+MODEL_LOAD_SECONDS = Gauge("bluvia_model_load_seconds", "Time the current model took to load.",
+                           multiprocess="local")
+PROFILES_WRITTEN = Counter("bluvia_profiles_written_total", "Sampling profiles written to BLUVIA_PROFILE_DIR.")
+BATCH_SIZE = Histogram("bluvia_batch_size", "Requests per micro-batch.", ("batcher",),
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+BATCH_QUEUE_DEPTH = Gauge("bluvia_batch_queue_depth", "Requests waiting for a micro-batch.", ("batcher",))
+LOG_COMMIT_SECONDS = Histogram("bluvia_log_commit_seconds", "Time to write and fsync one group commit.", ("log",))
+LOG_GROUP_BATCHES = Histogram("bluvia_log_group_batches", "Batches written per group commit.", ("log",),
+                              buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    if not METRICS_DIR:
+        return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+    merged = _merged()
+    return "\n".join(metric.render(None if metric.multiprocess == "local" else merged.get(metric.name, {}))
+                     for metric in REGISTRY) + "\n"
+
+
+_flusher_pid: Optional[int] = None
+
+
+def write_snapshot() -> None:
+    """Publish this process's values to METRICS_DIR (see render)."""
+    directory = Path(METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    data = {metric.name: metric.snapshot() for metric in REGISTRY if metric.multiprocess != "local"}
+    path = directory / f"{os.getpid()}.json"
+    tmp = directory / f".{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_S)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+def ensure_flusher() -> None:
+    """Start this process's snapshot thread (once per process; a forked child needs its own)."""
+    global _flusher_pid
+    if METRICS_DIR and _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name="bluvia-metrics", daemon=True).start()
+
+
+def _forget_inherited() -> None:
+    # A forked worker starts from a copy of its parent's values, which the
+    # parent's own snapshot already counts
+    global _flusher_pid
+    _flusher_pid = None
+    for metric in REGISTRY:
+        if metric.multiprocess != "local":
+            metric.reset()
+
+
+if METRICS_DIR and hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_inherited)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_snapshot(path: Path) -> Optional[Dict[str, List[list]]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _fold(target: Dict[str, Dict[tuple, Any]], data: Dict[str, List[list]], gauges: bool = True) -> None:
+    by_name = {metric.name: metric for metric in REGISTRY}
+    for name, entries in data.items():
+        metric = by_name.get(name)
+        if metric is None or (metric.kind == "gauge" and not gauges):
+            continue
+        values = target.setdefault(name, {})
+        for key, value in entries:
+            key = tuple(key)
+            values[key] = metric.combine(values.get(key), value)
+
+
+def _merged() -> Dict[str, Dict[tuple, Any]]:
+    """
+    Every process's values summed. Counters and histograms of processes
+    that exited are folded into archive.json so totals never go down;
+    their gauges are dropped.
+    """
+    directory = Path(METRICS_DIR)
+    write_snapshot()
+    merged: Dict[str, Dict[tuple, Any]] = {}
+    with open(directory / ".lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        archive: Dict[str, Dict[tuple, Any]] = {}
+        _fold(archive, _load_snapshot(directory / "archive.json") or {})
+        archived = False
+        for path in directory.glob("[0-9]*.json"):
+            data = _load_snapshot(path)
+            if data is None:
+                continue
+            if int(path.stem) != os.getpid() and not _alive(int(path.stem)):
+                _fold(archive, data, gauges=False)
+                path.unlink()
+                archived = True
+            else:
+                _fold(merged, data)
+        if archived:
+            tmp = directory / ".archive.tmp"
+            with open(tmp, "w") as f:
+                json.dump({name: [[list(k), v] for k, v in values.items()] for name, values in archive.items()}, f)
+            os.replace(tmp, directory / "archive.json")
+    for name, values in archive.items():
+        target = merged.setdefault(name, {})
+        metric = next(m for m in REGISTRY if m.name == name)
+        for key, value in values.items():
+            target[key] = metric.combine(target.get(key), value)
+    return merged
+
+
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("bluvia_spans", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage: recorded in SPAN_SECONDS and in the current request's Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler: a background thread snapshots every other
+    thread's Python stack each `interval` seconds and tallies them as folded
+    stacks ("thread;outer;...;inner count"), the input format of
+    flamegraph.pl and speedscope. Samples cover every thread, so concurrent
+    requests show up in each other's profiles.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_S):
+        self.interval = interval
+        self.stacks: _Tally = _Tally()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._sample, name="bluvia-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> _Tally:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+    def write(self, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+# Only one request is profiled at a time; others run unprofiled meanwhile
+_profile_slot = threading.Lock()
+
+
+def _wants_profile(scope) -> bool:
+    if not PROFILE_DIR:
+        return False
+    for name, value in scope.get("headers", ()):
+        if name == b"x-bluvia-profile":
+            return value == b"1"
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request (labelled by endpoint function
+    name, so cardinality stays bounded) and adding a Server-Timing header
+    with the request's spans. With BLUVIA_PROFILE_DIR set, selected requests
+    are also run under SamplingProfiler and their folded stacks written there.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        ensure_flusher()
+        spans: List[Tuple[str, float]] = []
+        token = _request_spans.set(spans)
+        status = 500
+        profiler = None
+        if _wants_profile(scope) and _profile_slot.acquire(blocking=False):
+            profiler = SamplingProfiler().start()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if spans:
+                    timing = ", ".join(f"{name};dur={elapsed * 1000:.3f}" for name, elapsed in spans)
+                    message = {**message, "headers": list(message.get("headers", [])) +
+                               [(b"server-timing", timing.encode())]}
+            await send(message)
+
+        start = time.perf_counter()
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.inc(-1)
+            _request_spans.reset(token)
+            endpoint = scope.get("endpoint")
+            endpoint = getattr(endpoint, "__name__", "unmatched")
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], endpoint=endpoint, status=status)
+            if profiler is not None:
+                try:
+                    profiler.stop()
+                    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(elapsed * 1000)}ms-{os.getpid()}.folded"
+                    profiler.write(Path(PROFILE_DIR) / name)
+                    PROFILES_WRITTEN.inc()
+                finally:
+                    _profile_slot.release()
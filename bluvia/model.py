@@ -1,22 +1,386 @@
 import os
 import sys
-import pandas as pd
-import joblib
-from typing import Dict, Any, List
+import time
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from bluvia.path_utils import get_model_path
+from bluvia.path_utils import get_model_path, get_model_source
+from bluvia.geo import GridBuckets
+from bluvia.metrics import ROWS_SCANNED
+
+METALS = ["Fe", "Cr", "Mn", "Mo", "In", "Ta"]
+
+MODEL_CHECK_INTERVAL = float(os.environ.get("BLUVIA_MODEL_CHECK_INTERVAL", "1.0"))
+# Serve boosted-tree models from their compiled, memory-mapped form (bluvia.compiled)
+USE_COMPILED = os.environ.get("BLUVIA_COMPILED_MODEL", "1") == "1"
+USER_DATA_RADIUS = 0.01
+# How often UserDataIndex.ensure_loaded checks the user-data file for rows
+# appended by other processes
+USER_DATA_CHECK_INTERVAL = float(os.environ.get("BLUVIA_USER_DATA_CHECK_INTERVAL", "0.5"))
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+class ModelRegistry:
+    """
+    Holds the loaded model for one artifact path (read from the bundled
+    artifact until a model is saved there, see get_model_source).
+
+    The model is deserialized once and reused. The file is stat'ed at most
+    every `check_interval` seconds; when its mtime or size changed it is
+    re-hashed and, if the content differs, reloaded and swapped in atomically.
+    A compiled export matching the artifact's digest is preferred over
+    unpickling it (see bluvia.compiled).
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None, check_interval: float = MODEL_CHECK_INTERVAL):
+        self.path = Path(path) if path else get_model_path()
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state: Optional[Dict[str, Any]] = None
+        self._stat_key = None
+        self._last_check = 0.0
+
+    def _stat(self):
+        st = os.stat(get_model_source(self.path))
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self) -> Any:
+        """Load the artifact now, replacing any loaded version."""
+        with self._lock:
+            return self._load_locked()
+
+    def _load_locked(self) -> Any:
+        source = get_model_source(self.path)
+        if not source.exists():
+            raise FileNotFoundError(f"Model file not found at {self.path}")
+        stat_key = self._stat()
+        version = _file_digest(source)
+        if self._state is not None and self._state["version"] == version:
+            self._stat_key = stat_key
+            return self._state["model"]
+        start = time.perf_counter()
+        model = None
+        if USE_COMPILED:
+            from .compiled import load_compiled
+
+            model = load_compiled(source, version)
+        fmt = "compiled"
+        if model is None:
+            import joblib
+
+            model = joblib.load(source)
+            fmt = "pickle"
+        self._state = {
+            "model": model,
+            "format": fmt,
+            "version": version,
+            "path": str(source),
+            "loaded_at": time.time(),
+            "load_seconds": time.perf_counter() - start,
+            "mtime": stat_key[0] / 1e9,
+        }
+        self._stat_key = stat_key
+        return model
+
+    def refresh_if_changed(self) -> bool:
+        """Reload the model if the artifact changed on disk. Returns True on swap."""
+        try:
+            stat_key = self._stat()
+        except FileNotFoundError:
+            return False
+        if stat_key == self._stat_key:
+            return False
+        with self._lock:
+            previous = self._state["version"] if self._state else None
+            self._load_locked()
+            return self._state["version"] != previous
+
+    def get(self) -> Any:
+        """Return the current model, loading or hot-reloading it as needed."""
+        if self._state is None:
+            return self.load()
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.refresh_if_changed()
+        return self._state["model"]
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._state["version"] if self._state else None
+
+    def info(self) -> Dict[str, Any]:
+        state = self._state
+        if state is None:
+            return {"loaded": False, "path": str(self.path)}
+        return {
+            "loaded": True,
+            "path": state["path"],
+            "version": state["version"],
+            "format": state["format"],
+            "loaded_at": state["loaded_at"],
+            "load_seconds": state["load_seconds"],
+            "mtime": state["mtime"],
+        }
+
+
+def save_model(model: Any, path: Union[str, Path]) -> Path:
+    """
+    Write a model artifact atomically: dump to a temp file in the same
+    directory, fsync, then rename over the target so registries never see a
+    partially written file. Boosted-tree models are also exported in
+    compiled form first, so a registry picking up the new file can load that.
+    """
+    import joblib
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            joblib.dump(model, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if USE_COMPILED:
+            from .compiled import export
+
+            export(model, path, _file_digest(tmp))
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return path
+
+
+_registries: Dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path: Union[str, Path, None] = None) -> ModelRegistry:
+    """Return the shared registry for a model path (default: get_model_path())."""
+    resolved = str(Path(path).absolute()) if path else str(get_model_path())
+    registry = _registries.get(resolved)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(resolved, ModelRegistry(resolved))
+    return registry
+
+
+def predict_with(model: Any, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Run `model` on (lat, lon) points. Returns (n, len(METALS))."""
+    X = np.column_stack([np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)])
+    if hasattr(model, "feature_names_in_"):
+        import pandas as pd
+
+        X = pd.DataFrame(X, columns=model.feature_names_in_)
+    return np.asarray(model.predict(X), dtype=np.float64).reshape(len(X), len(METALS))
+
+
+def predict_metals_batch(lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Predict all metals for many points with one model call. Returns (n, len(METALS))."""
+    return predict_with(get_registry().get(), lats, lngs)
+
 
 def predict_metals(lat: float, lng: float) -> Dict[str, float]:
-    model_path = "./bluvia/GB_model.joblib"
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Model file not found at {model_path}")
-    river_model = joblib.load(model_path)
-    input_df = pd.DataFrame([{'Lat': lat, 'Lon': lng}])
-    prediction = river_model.predict_one(input_df)
-    return prediction
-
-def update_metals_with_user_data(predictions: Dict[str, float], user_data: List[dict], lat: float, lng: float) -> Dict[str, float]:
+    prediction = predict_metals_batch([lat], [lng])[0]
+    return {metal: float(value) for metal, value in zip(METALS, prediction)}
+
+
+class UserDataIndex:
+    """
+    In-memory spatial index over the user-uploaded samples.
+
+    Coordinates and per-metal values are kept in columnar float arrays
+    (NaN for missing values) and bucketed on a grid whose cell size equals
+    the neighbourhood radius, so a query only inspects the 3x3 cells around
+    the point.
+
+    The file is an append-only log (bluvia.userlog): `refresh` indexes just
+    the rows committed since the last read, by this or any other process.
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None, radius: float = USER_DATA_RADIUS):
+        self.path = Path(path) if path else None
+        self.radius = radius
+        self.version = 0
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._size = 0
+        self._lat = np.empty(0, dtype=np.float64)
+        self._lon = np.empty(0, dtype=np.float64)
+        self._values = np.empty((0, len(METALS)), dtype=np.float64)
+        self._grid = GridBuckets(radius)
+        self._tail = None
+        if self.path is not None:
+            from .userlog import LogTail
+
+            self._tail = LogTail(self.path)
+        self._last_check = 0.0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def load(self) -> "UserDataIndex":
+        """(Re)build the index from the CSV at `path`."""
+        with self._lock:
+            self._reset_locked()
+            if self._tail is not None:
+                self._tail.reset()
+        self.refresh()
+        self.loaded = True
+        return self
+
+    def ensure_loaded(self) -> "UserDataIndex":
+        if not self.loaded:
+            self.load()
+        elif self.path is not None and time.monotonic() - self._last_check >= USER_DATA_CHECK_INTERVAL:
+            self.refresh()
+        return self
+
+    def _reset_locked(self) -> None:
+        self._size = 0
+        self._grid = GridBuckets(self.radius)
+        self.version += 1
+
+    def refresh(self) -> int:
+        """Index the rows appended to the file since the last read. Returns rows added."""
+        if self._tail is None:
+            return 0
+        from .userlog import parse_rows
+
+        with self._lock:
+            self._last_check = time.monotonic()
+            had_read = self._tail.identity is not None
+            try:
+                restarted, data = self._tail.read()
+            except FileNotFoundError:
+                if had_read:
+                    self._reset_locked()
+                    self._tail.reset()
+                return 0
+            if restarted and had_read:
+                # the file was replaced: what was indexed is gone
+                self._reset_locked()
+            if not data:
+                return 0
+            return self._append_locked(*parse_rows(data))
+
+    @staticmethod
+    def _parse(rows: List[dict]):
+        from .schema import from_records
+
+        try:
+            data = from_records(rows).with_coordinates()
+        except ValueError:
+            return np.empty(0), np.empty(0), np.empty((0, len(METALS)))
+        return data.lat, data.lon, data.values
+
+    def _reserve(self, extra: int) -> None:
+        needed = self._size + extra
+        if needed <= len(self._lat):
+            return
+        capacity = max(needed, 2 * len(self._lat), 64)
+        for name in ("_lat", "_lon"):
+            grown = np.empty(capacity, dtype=np.float64)
+            grown[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, grown)
+        grown = np.empty((capacity, len(METALS)), dtype=np.float64)
+        grown[:self._size] = self._values[:self._size]
+        self._values = grown
+
+    def _append_locked(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray) -> int:
+        n = len(lats)
+        if n:
+            self._reserve(n)
+            start = self._size
+            self._lat[start:start + n] = lats
+            self._lon[start:start + n] = lons
+            self._values[start:start + n] = values
+            self._grid.add(lats, lons, start)
+            self._size += n
+            self.version += 1
+        return n
+
+    def append(self, rows: List[dict]) -> int:
+        """Add uploaded rows (dicts with Lat, Lon, SEM_<metal>_ppm or any schema alias). Returns rows indexed."""
+        with self._lock:
+            return self._append_locked(*self._parse(rows))
+
+    def append_arrays(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray) -> int:
+        """Add already-parsed samples: coordinates and (n, len(METALS)) values, NaN where missing."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(METALS))
+        with self._lock:
+            return self._append_locked(lats, lons, values)
+
+    def local_version(self, lat: float, lng: float) -> int:
+        """
+        Samples that can affect query(lat, lng). Rows are only ever appended,
+        so this changes exactly when an upload lands nearby.
+        """
+        return self._grid.neighbourhood_count(lat, lng)
+
+    def query(self, lat: float, lng: float) -> Optional[np.ndarray]:
+        """Per-metal mean of samples within +-radius degrees (NaN where none), or None."""
+        idx = self._grid.candidates(lat, lng, self.radius)
+        ROWS_SCANNED.inc(len(idx), source="user_data")
+        if not len(idx):
+            return None
+        close = idx[(np.abs(self._lat[idx] - lat) < self.radius) &
+                    (np.abs(self._lon[idx] - lng) < self.radius)]
+        if not len(close):
+            return None
+        values = self._values[close]
+        counts = np.sum(~np.isnan(values), axis=0)
+        sums = np.nansum(values, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    def query_many(self, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+        """Vectorized query(): (n, len(METALS)) means, NaN where no sample is close."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        out = np.full((len(lats), len(METALS)), np.nan)
+        if not self._size:
+            return out
+        for i in np.flatnonzero(self._grid.near_occupied(lats, lngs)):
+            means = self.query(lats[i], lngs[i])
+            if means is not None:
+                out[i] = means
+        return out
+
+    def override_many(self, values: np.ndarray, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+        """Replace predicted values (n, len(METALS)) in place with nearby sample means."""
+        means = self.query_many(lats, lngs)
+        mask = ~np.isnan(means)
+        values[mask] = means[mask]
+        return values
+
+    def override(self, predictions: Dict[str, float], lat: float, lng: float) -> Dict[str, float]:
+        means = self.query(lat, lng)
+        if means is None:
+            return predictions
+        for metal, value in zip(METALS, means.tolist()):
+            if metal in predictions and not np.isnan(value):
+                predictions[metal] = value
+        return predictions
+
+
+def update_metals_with_user_data(predictions: Dict[str, float], user_data: Union[UserDataIndex, List[dict]], lat: float, lng: float) -> Dict[str, float]:
+    if isinstance(user_data, UserDataIndex):
+        return user_data.override(predictions, lat, lng)
     if not user_data:
         return predictions
     close_points = [
@@ -33,7 +397,7 @@ def update_metals_with_user_data(predictions: Dict[str, float], user_data: List[
                 val = row.get(user_col)
                 try:
                     valf = float(val)
-                    if not pd.isna(valf):
+                    if not np.isnan(valf):
                         values.append(valf)
                 except Exception:
                     continue
@@ -53,12 +53,29 @@ class PathUtils:
             return Path(model_path)
         return (Path(__file__).parent.parent / "models" / model_name).absolute()
 
+    @staticmethod
+    def get_model_source(path: Union[str, Path, None] = None) -> Path:
+        """
+        Path to load a model from: `path` (default: get_model_path()), or
+        the artifact shipped inside the package while nothing has been saved
+        to the default location yet. The bundled file is only ever read;
+        models are saved to `path`.
+        """
+        path = Path(path) if path else PathUtils.get_model_path()
+        if path.exists() or os.environ.get("BLUVIA_MODEL_PATH"):
+            return path
+        bundled = (Path(__file__).parent / path.name).absolute()
+        if path.absolute() == PathUtils.get_model_path(path.name) and bundled.exists():
+            return bundled
+        return path
+
     @staticmethod
     def validate_path_exists(path: Union[str, Path]) -> bool:
         """Validate that a path exists"""
         path = Path(path) if isinstance(path, str) else path
         return path.exists()
 get_model_path = PathUtils.get_model_path
+get_model_source = PathUtils.get_model_source
 get_data_path = PathUtils.get_data_path
 get_base_dir = PathUtils.get_base_dir
 validate_path_exists = PathUtils.validate_path_exists
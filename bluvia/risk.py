@@ -0,0 +1,174 @@
+import time
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from .geo import NearestIndex
+from .model import METALS
+from .path_utils import get_data_path
+
+BASELINES_FILE = "soil_baselines.csv"
+THRESHOLDS_FILE = "risk_thresholds.csv"
+LEVELS = np.array(["low", "moderate", "high"])
+# Score of a value at the baseline; 4x the baseline scores 100 (the cap)
+BASELINE_SCORE = 25.0
+# Seconds between checks of the data files for changes (see get_risk_model)
+RISK_CHECK_INTERVAL = 1.0
+
+
+def data_file(name: str) -> Path:
+    """`name` from the data directory, else the copy shipped in bluvia/Bluvia_csv."""
+    path = get_data_path(name)
+    return path if path.exists() else Path(__file__).parent / "Bluvia_csv" / name
+
+
+def _sources(baselines_path: Union[str, Path, None] = None,
+             thresholds_path: Union[str, Path, None] = None) -> Tuple[Path, Path]:
+    return Path(baselines_path or data_file(BASELINES_FILE)), Path(thresholds_path or data_file(THRESHOLDS_FILE))
+
+
+def _stat_key(paths: Tuple[Path, ...]) -> Tuple:
+    return tuple((str(path), path.stat().st_mtime_ns, path.stat().st_size) for path in paths)
+
+
+class RiskModel:
+    """
+    Per-metal contamination risk relative to local soil baselines.
+
+    The baseline for a point is the nearest baseline site's value for that
+    metal, or the metal's default where the site has none. A value is
+    "moderate" from `moderate_factor` x baseline and "high" from
+    `high_factor` x baseline. Everything works on (n, len(METALS)) arrays.
+
+    Models loaded with from_files carry `version`, a digest of both files,
+    for keys of cached answers that depend on the risk levels.
+    """
+
+    def __init__(self, site_lats: np.ndarray, site_lons: np.ndarray, site_baselines: np.ndarray,
+                 default_baseline: np.ndarray, moderate_factor: np.ndarray, high_factor: np.ndarray):
+        self.default_baseline = np.asarray(default_baseline, dtype=np.float64)
+        site_baselines = np.asarray(site_baselines, dtype=np.float64).reshape(-1, len(METALS))
+        missing = ~(site_baselines > 0)
+        self.site_baselines = np.where(missing, self.default_baseline, site_baselines)
+        self.moderate_factor = np.asarray(moderate_factor, dtype=np.float64)
+        self.high_factor = np.asarray(high_factor, dtype=np.float64)
+        self._sites = NearestIndex(site_lats, site_lons) if len(site_baselines) else None
+        self.version: Optional[str] = None
+        self.stat_key: Optional[Tuple] = None
+
+    @classmethod
+    def from_files(cls, baselines_path: Union[str, Path, None] = None,
+                   thresholds_path: Union[str, Path, None] = None) -> "RiskModel":
+        import pandas as pd
+
+        baselines_path, thresholds_path = _sources(baselines_path, thresholds_path)
+        stat_key = _stat_key((baselines_path, thresholds_path))
+        digest = hashlib.sha256()
+        for path in (baselines_path, thresholds_path):
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+        thresholds = pd.read_csv(thresholds_path)
+        thresholds["Metal"] = thresholds["Metal"].str.strip()
+        thresholds = thresholds.set_index("Metal")
+        missing = [m for m in METALS if m not in thresholds.index]
+        if missing:
+            raise ValueError(f"Risk thresholds are missing metals: {missing}")
+        thresholds = thresholds.loc[METALS]
+
+        from .schema import load_csv
+
+        sites = load_csv(baselines_path, cache=False).with_coordinates()
+        model = cls(sites.lat, sites.lon, sites.values,
+                    thresholds["Default_Baseline_ppm"].to_numpy(dtype=np.float64),
+                    thresholds["Moderate_Factor"].to_numpy(dtype=np.float64),
+                    thresholds["High_Factor"].to_numpy(dtype=np.float64))
+        model.version = digest.hexdigest()[:12]
+        model.stat_key = stat_key
+        return model
+
+    def baselines(self, lats, lons) -> np.ndarray:
+        """(n, len(METALS)) baseline at each point."""
+        n = len(np.atleast_1d(lats))
+        if self._sites is None:
+            return np.broadcast_to(self.default_baseline, (n, len(METALS)))
+        idx, _ = self._sites.nearest(lats, lons)
+        return self.site_baselines[idx]
+
+    def ratios(self, values: np.ndarray, lats, lons) -> np.ndarray:
+        return np.asarray(values, dtype=np.float64).reshape(-1, len(METALS)) / self.baselines(lats, lons)
+
+    def levels(self, values: np.ndarray, lats, lons) -> np.ndarray:
+        """(n, len(METALS)) labels: low / moderate / high."""
+        ratios = self.ratios(values, lats, lons)
+        return LEVELS[(ratios >= self.moderate_factor).astype(np.int8) + (ratios >= self.high_factor)]
+
+    def scores(self, values: np.ndarray, lats, lons) -> np.ndarray:
+        """(n, len(METALS)) scores in [0, 100]: BASELINE_SCORE at the baseline, linear in the value."""
+        ratios = np.nan_to_num(self.ratios(values, lats, lons), nan=0.0)
+        return np.clip(ratios * BASELINE_SCORE, 0.0, 100.0)
+
+
+_risk_model: Optional[RiskModel] = None
+_risk_lock = threading.Lock()
+_last_check = 0.0
+
+
+def get_risk_model() -> RiskModel:
+    """
+    The shared RiskModel, loaded from the data files on first use. The files
+    are re-checked at most once per RISK_CHECK_INTERVAL and the model reloaded
+    when they changed, so an edit reaches every worker without a restart; an
+    edit that fails to load keeps the current model.
+    """
+    global _risk_model, _last_check
+    model = _risk_model
+    stat_key = None
+    if model is not None:
+        now = time.monotonic()
+        if now - _last_check < RISK_CHECK_INTERVAL:
+            return model
+        _last_check = now
+        try:
+            stat_key = _stat_key(_sources())
+        except FileNotFoundError:
+            return model
+        if stat_key == model.stat_key:
+            return model
+    with _risk_lock:
+        if _risk_model is model:
+            try:
+                _risk_model = RiskModel.from_files()
+            except (OSError, ValueError, KeyError) as e:
+                if model is None:
+                    raise
+                print("Risk data changed but could not be loaded; keeping the current risk model:", e)
+                # don't retry until the files change again
+                model.stat_key = stat_key
+    return _risk_model
+
+
+def reload_risk_model() -> RiskModel:
+    global _risk_model
+    with _risk_lock:
+        _risk_model = RiskModel.from_files()
+    return _risk_model
+
+
+def risk_levels(values: np.ndarray, lats, lons) -> np.ndarray:
+    return get_risk_model().levels(values, lats, lons)
+
+
+def risk_scores(predictions: Dict[str, float], lat: float, lon: float) -> Dict[str, float]:
+    """Per-metal scores for one point; `predictions` keys may be Fe, Fe_ppm or SEM_Fe_ppm."""
+    values = np.array([[_lookup(predictions, metal) for metal in METALS]])
+    scores = get_risk_model().scores(values, [lat], [lon])[0]
+    return {metal: round(float(score), 1) for metal, score in zip(METALS, scores)}
+
+
+def _lookup(predictions: Dict[str, float], metal: str) -> float:
+    for key in (f"{metal}_ppm", f"SEM_{metal}_ppm", metal):
+        if key in predictions:
+            return float(predictions[key])
+    return 0.0
@@ -0,0 +1,207 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .model import METALS
+from .metrics import ROWS_SCANNED, span
+
+# Canonical sample schema, shared by the master store, training and user data
+METAL_COLUMNS = [f"{m.lower()}_ppm" for m in METALS]
+COLUMNS = ["lat", "lon"] + METAL_COLUMNS
+# Target column names of training frames (Fe_ppm, ...)
+TARGET_NAMES = [f"{m}_ppm" for m in METALS]
+
+COLUMN_ALIASES = {
+    'latitude': 'lat',
+    'longitude': 'lon', 'lng': 'lon',
+    'fe': 'fe_ppm', 'cr': 'cr_ppm', 'mn': 'mn_ppm',
+    'mo': 'mo_ppm', 'in': 'in_ppm', 'ta': 'ta_ppm',
+    'sem_fe_ppm': 'fe_ppm', 'sem_cr_ppm': 'cr_ppm', 'sem_mn_ppm': 'mn_ppm',
+    'sem_mo_ppm': 'mo_ppm', 'sem_in_ppm': 'in_ppm', 'sem_ta_ppm': 'ta_ppm'
+}
+
+CACHE_ENTRIES = int(os.environ.get("BLUVIA_SCHEMA_CACHE_ENTRIES", "16"))
+
+
+def normalize_column(name: Any) -> str:
+    """Canonical name for a source column: 'Latitude' -> 'lat', 'SEM_Fe_ppm' -> 'fe_ppm', ..."""
+    name = str(name).strip().lower()
+    return COLUMN_ALIASES.get(name, name)
+
+
+class Dataset:
+    """
+    Samples under the canonical schema: float64 `lat`, `lon` and `values`
+    of shape (n, len(METALS)), NaN where a value is missing. `present`
+    lists the metal columns the source actually had.
+
+    Datasets returned by load_csv/from_store are shared between callers, so
+    their arrays are read-only.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, values: np.ndarray,
+                 present: Optional[List[str]] = None, source: Optional[str] = None):
+        self.lat = lat
+        self.lon = lon
+        self.values = values
+        self.present = list(METAL_COLUMNS if present is None else present)
+        self.source = source
+        for array in (lat, lon, values):
+            array.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @property
+    def missing(self) -> List[str]:
+        return [col for col in METAL_COLUMNS if col not in self.present]
+
+    def require(self, message: str = "Missing required columns") -> "Dataset":
+        """Raise ValueError unless every metal column was present in the source."""
+        if self.missing:
+            raise ValueError(f"{message}: {self.missing}")
+        return self
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Canonical column name -> array, as ColumnStore.append expects."""
+        data = {"lat": self.lat, "lon": self.lon}
+        data.update({col: self.values[:, i] for i, col in enumerate(METAL_COLUMNS)})
+        return data
+
+    def with_coordinates(self) -> "Dataset":
+        """Rows with both coordinates (self if none are missing)."""
+        keep = ~(np.isnan(self.lat) | np.isnan(self.lon))
+        if keep.all():
+            return self
+        return Dataset(self.lat[keep], self.lon[keep], self.values[keep], self.present, self.source)
+
+    def frames(self, target_names: Optional[List[str]] = None):
+        """
+        (X, Y) training frames: X holds lat/lon, Y one column per metal with
+        missing values as 0. Both carry the source path in `attrs["source"]`.
+        """
+        import pandas as pd
+
+        X = pd.DataFrame({"lat": self.lat, "lon": self.lon})
+        Y = pd.DataFrame(np.nan_to_num(self.values, nan=0.0), columns=target_names or TARGET_NAMES)
+        X.attrs["source"] = Y.attrs["source"] = self.source
+        return X, Y
+
+
+def _numeric(series) -> np.ndarray:
+    if series.dtype.kind in "fiub":
+        return series.to_numpy(dtype=np.float64)
+    import pandas as pd
+
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _first_by_name(df) -> Dict[str, Any]:
+    columns: Dict[str, Any] = {}
+    for position, name in enumerate(df.columns):
+        columns.setdefault(normalize_column(name), position)
+    return columns
+
+
+def from_frame(df, targets=None, source: Optional[str] = None) -> Dataset:
+    """
+    Parse a DataFrame into a Dataset. Coordinates come from `df`, metal
+    values from `targets` if given, else from `df`. Column names may use any
+    of the aliases in COLUMN_ALIASES, in any case.
+    """
+    coords = _first_by_name(df)
+    if "lat" not in coords or "lon" not in coords:
+        raise ValueError("CSV must contain 'lat' and 'lon' columns.")
+    targets = df if targets is None else targets
+    names = _first_by_name(targets)
+    values = np.full((len(targets), len(METALS)), np.nan)
+    present = []
+    for i, col in enumerate(METAL_COLUMNS):
+        if col in names:
+            values[:, i] = _numeric(targets.iloc[:, names[col]])
+            present.append(col)
+    return Dataset(_numeric(df.iloc[:, coords["lat"]]), _numeric(df.iloc[:, coords["lon"]]),
+                   values, present, source)
+
+
+def from_records(rows: List[dict]) -> Dataset:
+    """Dataset from dict rows (e.g. csv.DictReader output)."""
+    import pandas as pd
+
+    return from_frame(pd.DataFrame(rows))
+
+
+_cache: "OrderedDict[str, Tuple[Any, Dataset]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cached(key: str, identity: Any, build) -> Dataset:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == identity:
+            _cache.move_to_end(key)
+            return entry[1]
+    dataset = build()
+    with _cache_lock:
+        _cache[key] = (identity, dataset)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return dataset
+
+
+def load_csv(path: Union[str, Path], cache: bool = True) -> Dataset:
+    """
+    Parse a CSV into a Dataset. Parsed files are cached by path and file
+    identity (device, inode, mtime, size), so repeated loads of an unchanged
+    file cost one stat().
+    """
+    path = str(Path(path).absolute())
+
+    def build():
+        import pandas as pd
+
+        with span("csv_parse"):
+            dataset = from_frame(pd.read_csv(path), source=path)
+        ROWS_SCANNED.inc(len(dataset), source="csv")
+        return dataset
+
+    if not cache:
+        return build()
+    st = os.stat(path)
+    return _cached(path, (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size), build)
+
+
+def from_store(store, start: int = 0) -> Dataset:
+    """
+    Dataset over a ColumnStore's current contents, cached per store version.
+    With `start`, only the rows from that position on (not cached).
+    """
+
+    def build():
+        data = store.read_since(start) if start else store.read()
+        values = np.column_stack([np.asarray(data[col], dtype=np.float64) for col in METAL_COLUMNS])
+        return Dataset(np.array(data["lat"], dtype=np.float64), np.array(data["lon"], dtype=np.float64), values)
+
+    if start:
+        return build()
+    return _cached(f"store:{store.root}", store.version, build)
+
+
+def load(source) -> Dataset:
+    """Dataset from a Dataset, DataFrame, ColumnStore or CSV path."""
+    if isinstance(source, Dataset):
+        return source
+    if hasattr(source, "manifest_path"):
+        return from_store(source)
+    if hasattr(source, "columns") and hasattr(source, "iloc"):
+        return from_frame(source)
+    return load_csv(source)
+
+
+def training_frames(source, target_names: Optional[List[str]] = None):
+    """(X, Y) training frames for `source`, skipping rows without coordinates."""
+    return load(source).with_coordinates().frames(target_names)
@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from .geo import NearestIndex
+from .model import METALS, UserDataIndex, get_registry, predict_metals_batch
+from .risk import get_risk_model
+from .schema import normalize_column
+
+# Bulk scoring of coordinate files: `python -m bluvia score in.csv out.csv`.
+# The input is read in chunks of SCORE_CHUNK_ROWS, scored and serialized by
+# a pool of SCORE_WORKERS processes, and written out in input order as each
+# chunk finishes. At most two chunks per worker are in flight, so memory
+# does not depend on the size of the input.
+SCORE_CHUNK_ROWS = int(os.environ.get("BLUVIA_SCORE_CHUNK_ROWS", "50000"))
+SCORE_WORKERS = int(os.environ.get("BLUVIA_SCORE_WORKERS", str(os.cpu_count() or 1)))
+USER_DATA_PATH = os.environ.get("BLUVIA_USER_DATA_PATH", "user_data.csv")
+INDUSTRY_RADIUS_KM = 3.0
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+PROGRESS_INTERVAL_S = 1.0
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+class PointScorer:
+    """
+    What /api/analyze computes for a point, vectorized over many points:
+    model predictions (with the user-data override), risk levels and scores,
+    SE and the industries within `industry_radius_km`.
+    """
+
+    def __init__(self, include_se: bool = True, industry_radius_km: float = INDUSTRY_RADIUS_KM,
+                 user_data_path: Union[str, Path, None] = USER_DATA_PATH):
+        from .Bluvia_src.Bluvia_Analysis import get_industry_index
+
+        get_registry().get()
+        self.risk = get_risk_model()
+        self.se = None
+        if include_se:
+            from .uncertainty import get_se_index
+
+            self.se = get_se_index()
+        industries = get_industry_index()
+        self.industry_labels = industries.labels
+        self.industries = NearestIndex(industries.lats, industries.lons) if len(industries) else None
+        self.industry_radius_km = industry_radius_km
+        self.user_data = UserDataIndex(user_data_path).load() if user_data_path else None
+
+    def score(self, lats: np.ndarray, lons: np.ndarray) -> Dict[str, np.ndarray]:
+        """Result columns for the points, in order. Invalid coordinates get empty results."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = len(lats)
+        with np.errstate(invalid="ignore"):
+            valid = (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+        rows = np.flatnonzero(valid)
+        lats, lons = lats[valid], lons[valid]
+
+        values = np.full((n, len(METALS)), np.nan)
+        levels = np.full((n, len(METALS)), "", dtype=object)
+        scores = np.full((n, len(METALS)), np.nan)
+        se = np.full((n, len(METALS)), np.nan)
+        industry_count = np.zeros(n, dtype=np.int64)
+        nearest_industry = np.full(n, "", dtype=object)
+        nearest_km = np.full(n, np.nan)
+        if len(rows):
+            predicted = predict_metals_batch(lats, lons)
+            if self.user_data is not None:
+                predicted = self.user_data.override_many(predicted, lats, lons)
+            values[rows] = predicted
+            levels[rows] = self.risk.levels(predicted, lats, lons)
+            scores[rows] = np.round(self.risk.scores(predicted, lats, lons), 1)
+            if self.se is not None:
+                se[rows] = self.se.query_many(lats, lons)
+            if self.industries is not None:
+                industry_count[rows] = self.industries.count_within(lats, lons, self.industry_radius_km)
+                idx, dist = self.industries.nearest(lats, lons)
+                near = dist <= self.industry_radius_km
+                nearest_industry[rows[near]] = self.industry_labels[idx[near]]
+                nearest_km[rows[near]] = np.round(dist[near], 3)
+
+        columns: Dict[str, np.ndarray] = {}
+        for i, metal in enumerate(METALS):
+            columns[f"{metal}_ppm"] = values[:, i]
+            columns[f"{metal}_risk"] = levels[:, i]
+            columns[f"{metal}_risk_score"] = scores[:, i]
+            if self.se is not None:
+                columns[f"{metal}_se"] = se[:, i]
+        columns["industry_count"] = industry_count
+        columns["nearest_industry"] = nearest_industry
+        columns["nearest_industry_km"] = nearest_km
+        return columns
+
+
+# One scorer per worker process, built by the pool initializer
+_scorer: Optional[PointScorer] = None
+
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    global _scorer
+    _scorer = PointScorer(**options)
+
+
+def _score_chunk(index: int, frame, columns: Tuple[str, str], output_path: Path) -> bytes:
+    """
+    Score one chunk and serialize it, in the worker: returns its CSV (with a
+    header line) or, for Parquet output, writes its part file.
+    """
+    import pandas as pd
+
+    lats = pd.to_numeric(frame[columns[0]], errors="coerce").to_numpy(dtype=np.float64)
+    lons = pd.to_numeric(frame[columns[1]], errors="coerce").to_numpy(dtype=np.float64)
+    results = pd.DataFrame(_scorer.score(lats, lons))
+    frame = pd.concat([frame.reset_index(drop=True), results], axis=1)
+    if _is_parquet(output_path):
+        pa, pq = _parquet()
+        part = output_path / f"part-{index:06d}.parquet"
+        tmp = part.with_suffix(".tmp")
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), str(tmp))
+        os.replace(tmp, part)
+        return b""
+    return frame.to_csv(index=False).encode("utf-8")
+
+
+def _is_parquet(path: Union[str, Path]) -> bool:
+    return Path(path).suffix.lower() in PARQUET_SUFFIXES
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Reading or writing Parquet needs pyarrow (pip install pyarrow)")
+    return pyarrow, pq
+
+
+def count_csv_rows(path: Union[str, Path], block_bytes: int = 1 << 20) -> int:
+    """Data rows in a CSV by its line breaks (quoted multi-line fields count extra)."""
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_bytes), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def read_chunks(path: Union[str, Path], chunk_rows: int = SCORE_CHUNK_ROWS) -> Iterator[Tuple[Any, float]]:
+    """
+    (DataFrame, fraction of the input's rows read) per chunk of up to
+    `chunk_rows` rows. CSV columns are read as text, so IDs and other
+    pass-through columns are written back unchanged. A CSV's rows are
+    counted up front (see count_csv_rows): the parser's file position runs
+    ahead of the rows it has returned, so it can't measure progress.
+    """
+    import pandas as pd
+
+    if _is_parquet(path):
+        _, pq = _parquet()
+        source = pq.ParquetFile(str(path))
+        total = max(source.metadata.num_rows, 1)
+        read = 0
+        for batch in source.iter_batches(batch_size=chunk_rows):
+            read += batch.num_rows
+            yield batch.to_pandas(), read / total
+        return
+    total = max(count_csv_rows(path), 1)
+    read = 0
+    for frame in pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False):
+        read += len(frame)
+        yield frame, min(read / total, 1.0)
+
+
+def coordinate_columns(columns, lat: Optional[str] = None, lon: Optional[str] = None) -> Tuple[str, str]:
+    """Names of the latitude and longitude columns (Lat, latitude, lng, ... per bluvia.schema)."""
+    found: Dict[str, Any] = {}
+    for name in columns:
+        found.setdefault(normalize_column(name), name)
+    lat = lat or found.get("lat")
+    lon = lon or found.get("lon")
+    if lat not in list(columns) or lon not in list(columns):
+        raise ValueError(f"Input has no latitude/longitude columns (columns: {list(columns)}); "
+                         f"name them with --lat and --lon")
+    return lat, lon
+
+
+class CsvOutput:
+    """Scored chunks appended to one CSV. Its position is the file's length."""
+
+    def __init__(self, path: Path, position: int = 0):
+        self.path = path
+        if position:
+            self._file = open(path, "r+b")
+            self._file.truncate(position)
+            self._file.seek(position)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(path, "wb")
+        self._header = not position
+
+    def write(self, index: int, data: bytes) -> int:
+        if not self._header:
+            data = data.split(b"\n", 1)[1]
+        self._file.write(data)
+        self._header = False
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetOutput:
+    """
+    Scored chunks as a Parquet dataset: one part file per chunk, written by
+    the workers. Its position is the number of parts committed.
+    """
+
+    def __init__(self, path: Path, position: int = 0):
+        _parquet()
+        self.path = path
+        path.mkdir(parents=True, exist_ok=True)
+        # parts past the checkpoint were written but never committed
+        for part in list(path.glob("part-*.parquet")) + list(path.glob("part-*.tmp")):
+            if int(part.stem.split("-")[1]) >= position:
+                part.unlink()
+
+    def write(self, index: int, data: bytes) -> int:
+        return index + 1
+
+    def close(self) -> None:
+        pass
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def checkpoint_path(output: Union[str, Path]) -> Path:
+    output = Path(output)
+    return output.with_name(output.name + CHECKPOINT_SUFFIX)
+
+
+def score_file(input_path: Union[str, Path], output_path: Union[str, Path], chunk_rows: int = SCORE_CHUNK_ROWS,
+               workers: int = SCORE_WORKERS, include_se: bool = True,
+               industry_radius_km: float = INDUSTRY_RADIUS_KM,
+               user_data_path: Union[str, Path, None] = USER_DATA_PATH, lat_column: Optional[str] = None,
+               lon_column: Optional[str] = None, restart: bool = False, progress: bool = True) -> Dict[str, Any]:
+    """
+    Score every row of a CSV/Parquet file of coordinates into `output_path`
+    (CSV, or a Parquet dataset directory for a .parquet name), keeping the
+    input's columns and appending the result columns (see PointScorer).
+
+    After each chunk is written, `<output>.checkpoint.json` records how far
+    the run got. Running the same command again resumes from there; it is
+    refused if the input, the model or the options changed since, unless
+    `restart` is set. workers=0 scores in this process.
+    """
+    if chunk_rows <= 0:
+        raise ValueError("chunk_rows must be positive")
+    input_path, output_path = Path(input_path), Path(output_path)
+    st = os.stat(input_path)
+    registry = get_registry()
+    registry.get()
+    scorer_options = {"include_se": include_se, "industry_radius_km": industry_radius_km,
+                      "user_data_path": str(user_data_path) if user_data_path else None}
+    job = {
+        "input": {"path": str(input_path.absolute()), "size": st.st_size, "mtime_ns": st.st_mtime_ns},
+        "model_version": registry.version,
+        "chunk_rows": chunk_rows,
+        "lat": lat_column,
+        "lon": lon_column,
+        "scorer": scorer_options,
+    }
+    ckpt_path = checkpoint_path(output_path)
+    state = {"job": job, "chunks": 0, "rows": 0, "position": 0, "complete": False}
+    if not restart:
+        if ckpt_path.exists():
+            with open(ckpt_path) as f:
+                saved = json.load(f)
+            if saved.get("job") != job:
+                raise ValueError(f"{ckpt_path} is for a different input, model or options; "
+                                 f"pass --restart to start over")
+            state = saved
+            if state["complete"]:
+                print(f"{output_path} is already complete ({state['rows']} rows)", file=sys.stderr)
+                return {"output": str(output_path), "rows": state["rows"], "chunks": state["chunks"],
+                        "resumed_at": state["rows"], "seconds": 0.0}
+        elif output_path.exists():
+            raise ValueError(f"{output_path} already exists; pass --restart to overwrite it")
+    # the coordinate columns are checked before anything is written
+    chunks = read_chunks(input_path, chunk_rows)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError(f"{input_path} has no rows")
+    columns = coordinate_columns(first[0].columns, lat_column, lon_column)
+    resumed_at, resumed_chunks = state["rows"], state["chunks"]
+    if resumed_chunks:
+        print(f"Resuming after chunk {resumed_chunks} ({resumed_at} rows)", file=sys.stderr)
+
+    output_cls = ParquetOutput if _is_parquet(output_path) else CsvOutput
+    output = output_cls(output_path, state["position"])
+    _write_json(ckpt_path, state)
+
+    executor = None
+    if workers > 0:
+        # spawn, as for retraining: each worker starts clean and loads (or
+        # memory-maps, for a compiled model) its own copy of the model
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_worker, initargs=(scorer_options,))
+    else:
+        _init_worker(scorer_options)
+    max_in_flight = 2 * workers
+    in_flight = deque()
+    started = last_report = time.time()
+
+    def commit() -> None:
+        nonlocal last_report
+        index, rows, future, fraction = in_flight.popleft()
+        state["position"] = output.write(index, future.result())
+        state["chunks"] = index + 1
+        state["rows"] += rows
+        _write_json(ckpt_path, state)
+        now = time.time()
+        if progress and (now - last_report >= PROGRESS_INTERVAL_S or not in_flight):
+            last_report = now
+            rate = (state["rows"] - resumed_at) / max(now - started, 1e-9)
+            print(f"Scored {state['rows']:,} rows, {state['chunks']} chunks ({fraction:.1%} of input, "
+                  f"{rate:,.0f} rows/s)", file=sys.stderr)
+
+    try:
+        for index, (frame, fraction) in enumerate(itertools.chain([first], chunks)):
+            if index < resumed_chunks:
+                continue
+            if executor is not None:
+                future = executor.submit(_score_chunk, index, frame, columns, output_path)
+            else:
+                future = Future()
+                future.set_result(_score_chunk(index, frame, columns, output_path))
+            in_flight.append((index, len(frame), future, fraction))
+            while len(in_flight) > max_in_flight:
+                commit()
+        while in_flight:
+            commit()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        output.close()
+    state["complete"] = True
+    _write_json(ckpt_path, state)
+    return {"output": str(output_path), "rows": state["rows"], "chunks": state["chunks"], "resumed_at": resumed_at,
+            "seconds": round(time.time() - started, 3)}
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m bluvia score",
+                                     description="Score a CSV or Parquet file of coordinates in parallel")
+    parser.add_argument("input", help="CSV or Parquet (.parquet) file with latitude and longitude columns")
+    parser.add_argument("output", help="CSV file, or a .parquet name for a Parquet dataset directory")
+    parser.add_argument("--chunk-rows", type=int, default=SCORE_CHUNK_ROWS,
+                        help=f"rows per chunk (default {SCORE_CHUNK_ROWS})")
+    parser.add_argument("--workers", type=int, default=SCORE_WORKERS,
+                        help=f"worker processes, 0 to score in this process (default {SCORE_WORKERS})")
+    parser.add_argument("--lat", help="latitude column (default: detected)")
+    parser.add_argument("--lon", help="longitude column (default: detected)")
+    parser.add_argument("--no-se", action="store_true", help="skip the standard error columns")
+    parser.add_argument("--industry-radius-km", type=float, default=INDUSTRY_RADIUS_KM,
+                        help=f"radius for nearby industries (default {INDUSTRY_RADIUS_KM})")
+    parser.add_argument("--user-data", default=USER_DATA_PATH,
+                        help=f"user samples overriding predictions nearby (default {USER_DATA_PATH})")
+    parser.add_argument("--no-user-data", action="store_true", help="don't apply user samples")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and overwrite the output")
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = score_file(args.input, args.output, chunk_rows=args.chunk_rows, workers=args.workers,
+                             include_se=not args.no_se, industry_radius_km=args.industry_radius_km,
+                             user_data_path=None if args.no_user_data else args.user_data,
+                             lat_column=args.lat, lon_column=args.lon, restart=args.restart,
+                             progress=not args.quiet)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
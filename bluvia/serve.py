@@ -0,0 +1,120 @@
+import gc
+import os
+import sys
+from typing import Any, Dict, Optional
+
+from gunicorn.app.base import BaseApplication
+
+# Production server: gunicorn managing uvicorn workers. The app is
+# imported and warmed up (bluvia.api.warmup: model, risk baselines, industry
+# and SE indexes, the memory-mapped tile grid) once in the master before it
+# forks, so the workers share those pages copy-on-write instead of each
+# loading its own copy.
+WORKERS = int(os.environ.get("BLUVIA_WORKERS", str(os.cpu_count() or 1)))
+BIND = os.environ.get("BLUVIA_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+KEEPALIVE_S = int(os.environ.get("BLUVIA_KEEPALIVE_S", "5"))
+BACKLOG = int(os.environ.get("BLUVIA_BACKLOG", "2048"))
+GRACEFUL_TIMEOUT_S = int(os.environ.get("BLUVIA_GRACEFUL_TIMEOUT_S", "30"))
+WORKER_TIMEOUT_S = int(os.environ.get("BLUVIA_WORKER_TIMEOUT_S", "120"))
+# Restart a worker after this many requests (0: never), with up to
+# MAX_REQUESTS_JITTER added so workers don't all restart together
+MAX_REQUESTS = int(os.environ.get("BLUVIA_MAX_REQUESTS", "0"))
+MAX_REQUESTS_JITTER = int(os.environ.get("BLUVIA_MAX_REQUESTS_JITTER", "0"))
+PRELOAD = os.environ.get("BLUVIA_PRELOAD", "1") == "1"
+
+
+def freeze() -> None:
+    """
+    Move everything allocated so far out of the garbage collector's reach.
+    Collections in a worker would otherwise write to the headers of these
+    objects and un-share their pages.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+class BluviaServer(BaseApplication):
+    """gunicorn application serving bluvia.api:app with uvicorn workers."""
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self.options = options or {}
+        self.application = None
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        if self.application is None:
+            from . import metrics
+            from .api import app, warmup
+
+            status = warmup.run()
+            if metrics.METRICS_DIR:
+                # the warmup spans and row counts, before workers fork off
+                metrics.write_snapshot()
+            freeze()
+            print("Preloaded app state:", ", ".join(f"{s['name']}={s['state']} ({s['seconds']:.2f}s)"
+                                                    for s in status["steps"]))
+            self.application = app
+        return self.application
+
+
+def options(**overrides) -> Dict[str, Any]:
+    """gunicorn settings from the BLUVIA_* environment, with `overrides` applied."""
+    opts = {
+        "bind": BIND,
+        "workers": WORKERS,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": PRELOAD,
+        "keepalive": KEEPALIVE_S,
+        "backlog": BACKLOG,
+        "graceful_timeout": GRACEFUL_TIMEOUT_S,
+        "timeout": WORKER_TIMEOUT_S,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+    }
+    opts.update(overrides)
+    return opts
+
+
+def prepare_metrics_dir() -> str:
+    """
+    Point BLUVIA_METRICS_DIR at an empty directory (a fresh temporary one if
+    unset), so /metrics on any worker reports totals over all of them.
+    Must run before bluvia.metrics is imported.
+    """
+    import tempfile
+
+    directory = os.environ.get("BLUVIA_METRICS_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(directory, name))
+    else:
+        directory = os.environ["BLUVIA_METRICS_DIR"] = tempfile.mkdtemp(prefix="bluvia-metrics-")
+    return directory
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m bluvia.serve", description="Run the Bluvia API with gunicorn")
+    parser.add_argument("--bind", help=f"host:port (default {BIND})")
+    parser.add_argument("--workers", type=int, help=f"worker processes (default {WORKERS})")
+    parser.add_argument("--keepalive", type=int, help=f"keep-alive seconds (default {KEEPALIVE_S})")
+    parser.add_argument("--backlog", type=int, help=f"listen backlog (default {BACKLOG})")
+    parser.add_argument("--graceful-timeout", type=int,
+                        help=f"seconds workers get to finish requests on shutdown (default {GRACEFUL_TIMEOUT_S})")
+    args = parser.parse_args(argv)
+
+    prepare_metrics_dir()
+    BluviaServer(options(**{k: v for k, v in vars(args).items() if v is not None})).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
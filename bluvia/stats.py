@@ -0,0 +1,501 @@
+import os
+import time
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from .model import METALS
+
+# Finest cell side in degrees; level l of the pyramid has cells 2**l times
+# as wide, up to STATS_LEVELS levels (0.05 * 2**11 covers the globe in 8 cells)
+STATS_CELL_DEG = float(os.environ.get("BLUVIA_STATS_CELL_DEG", "0.05"))
+STATS_LEVELS = int(os.environ.get("BLUVIA_STATS_LEVELS", "12"))
+# Percentile resolution: histogram bins per factor of 10 in concentration
+STATS_BINS_PER_DECADE = int(os.environ.get("BLUVIA_STATS_BINS_PER_DECADE", "8"))
+STATS_CHECK_INTERVAL = float(os.environ.get("BLUVIA_STATS_CHECK_INTERVAL", "1.0"))
+# Histograms span this many decades either side of each metal's default baseline
+HIST_DECADES = 5
+DEFAULT_PERCENTILES = (50.0, 90.0, 95.0, 99.0)
+
+OUTSIDE, INSIDE, PARTIAL = 0, 1, 2
+
+
+def _encode(iy, ix):
+    return (iy << 32) + (ix & 0xFFFFFFFF)
+
+
+def _decode(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    ix = keys & 0xFFFFFFFF
+    return keys >> 32, np.where(ix >= 1 << 31, ix - (1 << 32), ix)
+
+
+def _grow(a: np.ndarray, size: int, needed: int, fill=0) -> np.ndarray:
+    """`a` with room for `needed` rows along axis 0, keeping its first `size` rows."""
+    if needed <= len(a):
+        return a
+    out = np.full((max(needed, 2 * len(a), 64),) + a.shape[1:], fill, dtype=a.dtype)
+    out[:size] = a[:size]
+    return out
+
+
+def _groups(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(order sorting `keys`, start of each run of equal keys in that order, run index of every key)."""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    first = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    inverse = np.empty(len(keys), dtype=np.int64)
+    inverse[order] = np.cumsum(first) - 1
+    return order, np.flatnonzero(first), inverse
+
+
+class BoxRegion:
+    """Points with south <= lat <= north and west <= lon <= east."""
+
+    def __init__(self, south: float, west: float, north: float, east: float):
+        if north < south or east < west:
+            raise ValueError("Invalid bounding box")
+        self.bounds = (south, west, north, east)
+
+    def contains(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        south, west, north, east = self.bounds
+        return (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+
+    def relate(self, south: np.ndarray, west: np.ndarray, north: np.ndarray, east: np.ndarray) -> np.ndarray:
+        """OUTSIDE, INSIDE or PARTIAL for each cell [south, north) x [west, east)."""
+        s, w, n, e = self.bounds
+        outside = (north <= s) | (south > n) | (east <= w) | (west > e)
+        inside = (south >= s) & (north <= n) & (west >= w) & (east <= e)
+        return np.where(outside, OUTSIDE, np.where(inside, INSIDE, PARTIAL)).astype(np.int8)
+
+
+class PolygonRegion:
+    """Points inside a simple polygon (even-odd rule); vertices in order, not repeating the first."""
+
+    def __init__(self, lats: Sequence[float], lons: Sequence[float]):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if len(lats) > 1 and lats[0] == lats[-1] and lons[0] == lons[-1]:
+            lats, lons = lats[:-1], lons[:-1]
+        if len(lats) < 3:
+            raise ValueError("A polygon needs at least 3 vertices")
+        if not (np.isfinite(lats).all() and np.isfinite(lons).all()):
+            raise ValueError("Polygon vertices must be finite")
+        self.lats, self.lons = lats, lons
+        self._next_lats, self._next_lons = np.roll(lats, -1), np.roll(lons, -1)
+        self.bounds = (lats.min(), lons.min(), lats.max(), lons.max())
+
+    def contains(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        inside = np.zeros(lats.shape, dtype=bool)
+        for y1, x1, y2, x2 in zip(self.lats.tolist(), self.lons.tolist(),
+                                  self._next_lats.tolist(), self._next_lons.tolist()):
+            if y1 == y2:
+                continue
+            crosses = (y1 > lats) != (y2 > lats)
+            inside ^= crosses & (lons < x1 + (lats - y1) * (x2 - x1) / (y2 - y1))
+        return inside
+
+    def _touches(self, y1: np.ndarray, x1: np.ndarray, y2: np.ndarray, x2: np.ndarray) -> np.ndarray:
+        """Whether any polygon edge touches each segment (y1, x1)-(y2, x2); arguments are (n, 1)."""
+        ay, ax = self.lats[None, :], self.lons[None, :]
+        by, bx = self._next_lats[None, :], self._next_lons[None, :]
+
+        def orient(py, px, qy, qx, ry, rx):
+            return (qx - px) * (ry - py) - (qy - py) * (rx - px)
+
+        straddles = ((orient(ay, ax, by, bx, y1, x1) * orient(ay, ax, by, bx, y2, x2) <= 0)
+                     & (orient(y1, x1, y2, x2, ay, ax) * orient(y1, x1, y2, x2, by, bx) <= 0))
+        overlap = ((np.minimum(ay, by) <= np.maximum(y1, y2)) & (np.maximum(ay, by) >= np.minimum(y1, y2))
+                   & (np.minimum(ax, bx) <= np.maximum(x1, x2)) & (np.maximum(ax, bx) >= np.minimum(x1, x2)))
+        return (straddles & overlap).any(axis=1)
+
+    def _relate_near(self, south, west, north, east) -> np.ndarray:
+        s, w, n, e = (a[:, None] for a in (south, west, north, east))
+        # any doubt is PARTIAL: the cell is then split, and at the finest
+        # level its samples are tested one by one
+        boundary = ((self.lats >= s) & (self.lats <= n) & (self.lons >= w) & (self.lons <= e)).any(axis=1)
+        for side in ((s, w, n, w), (n, w, n, e), (s, e, n, e), (s, w, s, e)):
+            boundary |= self._touches(*side)
+        # no edge enters the cell: it is wholly inside or wholly outside
+        inside = self.contains(south, west)
+        return np.where(boundary, PARTIAL, np.where(inside, INSIDE, OUTSIDE))
+
+    def relate(self, south: np.ndarray, west: np.ndarray, north: np.ndarray, east: np.ndarray) -> np.ndarray:
+        """OUTSIDE, INSIDE or PARTIAL for each cell [south, north) x [west, east)."""
+        s, w, n, e = self.bounds
+        relation = np.full(np.shape(south), OUTSIDE, dtype=np.int8)
+        near = np.flatnonzero(~((north < s) | (south > n) | (east < w) | (west > e)))
+        # bound the (cells, vertices) temporaries
+        step = max(1, 500_000 // len(self.lats))
+        for i in range(0, len(near), step):
+            j = near[i:i + step]
+            relation[j] = self._relate_near(south[j], west[j], north[j], east[j])
+        return relation
+
+
+class _Level:
+    """Per-metal aggregates of one pyramid level: a row per occupied cell."""
+
+    def __init__(self, n_bins: int):
+        self.n_bins = n_bins
+        self.cells: Dict[int, int] = {}
+        self.size = 0
+        m = len(METALS)
+        self.samples = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros((0, m), dtype=np.int64)
+        self.total = np.zeros((0, m))
+        self.vmin = np.zeros((0, m))
+        self.vmax = np.zeros((0, m))
+        self.exceed = np.zeros((0, m, 2), dtype=np.int64)
+        self.hist = np.zeros((0, m, n_bins), dtype=np.int32)
+
+    def _rows(self, keys: np.ndarray) -> np.ndarray:
+        """Row of each (distinct) encoded cell key, adding rows for new cells."""
+        rows = np.empty(len(keys), dtype=np.int64)
+        cells = self.cells
+        size = self.size
+        for j, key in enumerate(keys.tolist()):
+            row = cells.get(key)
+            if row is None:
+                row = cells[key] = size
+                size += 1
+            rows[j] = row
+        self.samples = _grow(self.samples, self.size, size)
+        self.count = _grow(self.count, self.size, size)
+        self.total = _grow(self.total, self.size, size)
+        self.vmin = _grow(self.vmin, self.size, size, np.inf)
+        self.vmax = _grow(self.vmax, self.size, size, -np.inf)
+        self.exceed = _grow(self.exceed, self.size, size)
+        self.hist = _grow(self.hist, self.size, size)
+        self.size = size
+        return rows
+
+    def add(self, iy: np.ndarray, ix: np.ndarray, parts: Dict[str, Any]):
+        """
+        Fold in partial aggregates `parts` of items (samples, or cells of
+        the level below) at cells (iy, ix) of this level. Returns the cells'
+        coordinates and their merged partials for the level above, their
+        rows, and the item order and run starts grouping items by cell.
+        """
+        keys = _encode(iy, ix)
+        order, starts, inverse = _groups(keys)
+        first = order[starts]
+        rows = self._rows(keys[first])
+        merged = {
+            "samples": np.add.reduceat(parts["samples"][order], starts),
+            "count": np.add.reduceat(parts["count"][order], starts, axis=0),
+            "total": np.add.reduceat(parts["total"][order], starts, axis=0),
+            "vmin": np.minimum.reduceat(parts["vmin"][order], starts, axis=0),
+            "vmax": np.maximum.reduceat(parts["vmax"][order], starts, axis=0),
+            "exceed": np.add.reduceat(parts["exceed"][order], starts, axis=0),
+        }
+        # histograms travel as sparse (item, metal, bin, count) entries
+        item, metal, bin_, n = parts["hist"]
+        m, b = len(METALS), self.n_bins
+        hist_keys, index = np.unique((inverse[item] * m + metal) * b + bin_, return_inverse=True)
+        counts = np.bincount(index, weights=n).astype(np.int64)
+        group = hist_keys // (m * b)
+        merged["hist"] = (group, hist_keys // b % m, hist_keys % b, counts)
+
+        self.samples[rows] += merged["samples"]
+        self.count[rows] += merged["count"]
+        self.total[rows] += merged["total"]
+        self.vmin[rows] = np.minimum(self.vmin[rows], merged["vmin"])
+        self.vmax[rows] = np.maximum(self.vmax[rows], merged["vmax"])
+        self.exceed[rows] += merged["exceed"]
+        self.hist.reshape(-1)[rows[group] * (m * b) + hist_keys % (m * b)] += counts.astype(np.int32)
+        return iy[first], ix[first], merged, rows, order, starts
+
+
+class StatsPyramid:
+    """
+    Per-metal aggregates of the master samples and the user uploads, kept
+    for square cells at STATS_LEVELS resolutions: each level's cells are
+    twice as wide as the one below, and every level holds, per occupied
+    cell, the sample count, sum, min, max, the counts at or above the
+    moderate and high risk levels, and a histogram of log-spaced bins for
+    percentiles.
+
+    A region query walks down from the coarsest level: cells wholly inside
+    the region are taken as they are, partly covered ones are split, and
+    only the samples in partly covered cells of the finest level are read
+    and tested individually. The work follows the region's outline, not its
+    area or how many samples it holds. Everything but the percentiles is
+    exact; percentiles are the nearest-rank sample located to its histogram
+    bin (1/STATS_BINS_PER_DECADE of a decade), clamped to the exact min and max.
+
+    `refresh` adds only what was appended since the last one: new master
+    store rows and new user-data log rows, whichever process wrote them.
+    With `skip_complete_user_rows` (uploads with every metal are also
+    appended to the master store) uploaded rows with all metals present are
+    left to the master store, so they are not counted twice. Replaced or
+    truncated sources, or a reloaded risk model, trigger a rebuild.
+    """
+
+    def __init__(self, store: Any = None, user_data_path: Union[str, Path, None] = None,
+                 skip_complete_user_rows: bool = False, cell_deg: float = STATS_CELL_DEG,
+                 levels: int = STATS_LEVELS, bins_per_decade: int = STATS_BINS_PER_DECADE,
+                 check_interval: float = STATS_CHECK_INTERVAL):
+        from .userlog import LogTail
+
+        self.store = store
+        self.skip_complete_user_rows = skip_complete_user_rows
+        self.cell_deg = cell_deg
+        self.n_levels = max(1, levels)
+        self.bins_per_decade = bins_per_decade
+        self.check_interval = check_interval
+        self.loaded = False
+        self.version = 0
+        self._size = 0
+        self._tail = LogTail(user_data_path) if user_data_path else None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._risk = None
+        self._master_rows = 0
+
+    def _reset_locked(self, risk) -> None:
+        self._risk = risk
+        self._master_rows = 0
+        self._size = 0
+        m = len(METALS)
+        exponents = np.linspace(-HIST_DECADES, HIST_DECADES, 2 * HIST_DECADES * self.bins_per_decade + 1)
+        self._edges = risk.default_baseline[:, None] * 10.0 ** exponents[None, :]
+        # bin 0 is below the first edge (zero and negative values included), the last at or above the last
+        self._levels = [_Level(self._edges.shape[1] + 1) for _ in range(self.n_levels)]
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self._values = np.empty((0, m))
+        self._flags = np.empty((0, m), dtype=np.int8)
+        self._bins = np.empty((0, m), dtype=np.int16)
+        self._members: List[List[int]] = []
+        self.version += 1
+
+    def _bin(self, values: np.ndarray) -> np.ndarray:
+        return np.stack([np.searchsorted(self._edges[i], values[:, i], side="right")
+                         for i in range(len(METALS))], axis=1).astype(np.int16)
+
+    def _add_locked(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray) -> int:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(lats), len(METALS))
+        keep = (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+        lats, lons, values = lats[keep], lons[keep], values[keep]
+        n = len(lats)
+        if not n:
+            return 0
+        valid = ~np.isnan(values)
+        with np.errstate(invalid="ignore"):
+            ratios = self._risk.ratios(values, lats, lons)
+            flags = ((ratios >= self._risk.moderate_factor).astype(np.int8)
+                     + (ratios >= self._risk.high_factor)).astype(np.int8)
+        bins = self._bin(values)
+
+        start, end = self._size, self._size + n
+        self._lat = _grow(self._lat, start, end)
+        self._lon = _grow(self._lon, start, end)
+        self._values = _grow(self._values, start, end)
+        self._flags = _grow(self._flags, start, end)
+        self._bins = _grow(self._bins, start, end)
+        self._lat[start:end], self._lon[start:end], self._values[start:end] = lats, lons, values
+        self._flags[start:end], self._bins[start:end] = flags, bins
+        self._size = end
+
+        r, m = np.nonzero(valid)
+        parts = {
+            "samples": np.ones(n, dtype=np.int64),
+            "count": valid.astype(np.int64),
+            "total": np.where(valid, values, 0.0),
+            "vmin": np.where(valid, values, np.inf),
+            "vmax": np.where(valid, values, -np.inf),
+            "exceed": np.stack([flags >= 1, flags >= 2], axis=2).astype(np.int64),
+            "hist": (r, m, bins[r, m].astype(np.int64), np.ones(len(r), dtype=np.int64)),
+        }
+        iy = np.floor(lats / self.cell_deg).astype(np.int64)
+        ix = np.floor(lons / self.cell_deg).astype(np.int64)
+        iy, ix, parts, rows, order, starts = self._levels[0].add(iy, ix, parts)
+        # each level above merges the cells of the one below
+        for level in self._levels[1:]:
+            iy, ix, parts = level.add(iy >> 1, ix >> 1, parts)[:3]
+
+        # sample ids per finest cell, for the cells a region only partly covers
+        members = self._members
+        members.extend([] for _ in range(self._levels[0].size - len(members)))
+        ids = (order + start).tolist()
+        bounds = np.r_[starts, n].tolist()
+        for row, a, b in zip(rows.tolist(), bounds[:-1], bounds[1:]):
+            members[row].extend(ids[a:b])
+        return n
+
+    def _read_log_from_start(self) -> bytes:
+        self._tail.reset()
+        try:
+            return self._tail.read()[1]
+        except FileNotFoundError:
+            return b""
+
+    def refresh(self) -> int:
+        """Add the samples appended to either source since the last refresh. Returns samples added."""
+        from .risk import get_risk_model
+
+        with self._lock:
+            self._last_check = time.monotonic()
+            risk = get_risk_model()
+            store = self.store
+            if store is None:
+                from .storage import get_master_store
+
+                store = self.store = get_master_store()
+            master_rows = len(store) if store.exists() else 0
+
+            log_text, log_reset = b"", False
+            if self._tail is not None:
+                had_read = self._tail.identity is not None
+                try:
+                    restarted, log_text = self._tail.read()
+                    log_reset = restarted and had_read
+                except FileNotFoundError:
+                    log_reset = had_read
+                    self._tail.reset()
+            if not self.loaded or risk is not self._risk or master_rows < self._master_rows or log_reset:
+                # aggregates can't drop rows: start over from both sources
+                self._reset_locked(risk)
+                if self._tail is not None:
+                    log_text = self._read_log_from_start()
+
+            added = 0
+            if master_rows > self._master_rows:
+                from .schema import METAL_COLUMNS
+
+                data = store.read_since(self._master_rows)
+                self._master_rows += len(data["lat"])
+                values = np.column_stack([data[c] for c in METAL_COLUMNS])
+                added += self._add_locked(data["lat"], data["lon"], values)
+            if log_text:
+                from .userlog import parse_rows
+
+                lats, lons, values = parse_rows(log_text)
+                if self.skip_complete_user_rows:
+                    partial = np.isnan(values).any(axis=1)
+                    lats, lons, values = lats[partial], lons[partial], values[partial]
+                added += self._add_locked(lats, lons, values)
+            self.loaded = True
+            return added
+
+    def ensure_fresh(self) -> "StatsPyramid":
+        """Refresh if never loaded or not checked for `check_interval` seconds (other workers' uploads)."""
+        if not self.loaded or time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+        return self
+
+    def __len__(self) -> int:
+        return getattr(self, "_size", 0)
+
+    def _collect_locked(self, region) -> Tuple[List[np.ndarray], np.ndarray]:
+        """(rows per level of the cells wholly inside `region`, ids of samples in partly covered finest cells)."""
+        full = [np.empty(0, dtype=np.int64) for _ in self._levels]
+        partial = np.empty(0, dtype=np.int64)
+        keys = np.fromiter(self._levels[-1].cells, dtype=np.int64)
+        for depth in range(len(self._levels) - 1, -1, -1):
+            if not len(keys):
+                break
+            cells = self._levels[depth].cells
+            iy, ix = _decode(keys)
+            size = self.cell_deg * (1 << depth)
+            south, west = iy * size, ix * size
+            relation = region.relate(south, west, south + size, west + size)
+            rows = np.fromiter((cells[k] for k in keys.tolist()), dtype=np.int64, count=len(keys))
+            full[depth] = rows[relation == INSIDE]
+            split = relation == PARTIAL
+            if depth == 0:
+                partial = rows[split]
+                break
+            below = self._levels[depth - 1].cells
+            iy, ix = 2 * iy[split], 2 * ix[split]
+            children = np.concatenate([_encode(iy + dy, ix + dx) for dy in (0, 1) for dx in (0, 1)])
+            keys = np.fromiter((k for k in children.tolist() if k in below), dtype=np.int64)
+        members = self._members
+        ids = np.fromiter((i for row in partial.tolist() for i in members[row]), dtype=np.int64)
+        return full, ids
+
+    def query(self, region, percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+        """Aggregates of the samples inside `region` (a BoxRegion or PolygonRegion)."""
+        m = len(METALS)
+        with self._lock:
+            if not self.loaded:
+                raise RuntimeError("Statistics are not loaded yet")
+            full, ids = self._collect_locked(region)
+            samples = 0
+            cells = 0
+            count = np.zeros(m, dtype=np.int64)
+            total = np.zeros(m)
+            vmin = np.full(m, np.inf)
+            vmax = np.full(m, -np.inf)
+            exceed = np.zeros((m, 2), dtype=np.int64)
+            hist = np.zeros((m, self._edges.shape[1] + 1), dtype=np.int64)
+            for level, rows in zip(self._levels, full):
+                if not len(rows):
+                    continue
+                cells += len(rows)
+                samples += int(level.samples[rows].sum())
+                count += level.count[rows].sum(axis=0)
+                total += level.total[rows].sum(axis=0)
+                vmin = np.minimum(vmin, level.vmin[rows].min(axis=0))
+                vmax = np.maximum(vmax, level.vmax[rows].max(axis=0))
+                exceed += level.exceed[rows].sum(axis=0)
+                hist += level.hist[rows].sum(axis=0)
+            scanned = len(ids)
+            if scanned:
+                ids = ids[region.contains(self._lat[ids], self._lon[ids])]
+                values, flags, bins = self._values[ids], self._flags[ids], self._bins[ids]
+                valid = ~np.isnan(values)
+                samples += len(ids)
+                count += valid.sum(axis=0)
+                total += np.where(valid, values, 0.0).sum(axis=0)
+                vmin = np.minimum(vmin, np.where(valid, values, np.inf).min(axis=0, initial=np.inf))
+                vmax = np.maximum(vmax, np.where(valid, values, -np.inf).max(axis=0, initial=-np.inf))
+                exceed[:, 0] += ((flags >= 1) & valid).sum(axis=0)
+                exceed[:, 1] += ((flags >= 2) & valid).sum(axis=0)
+                r, c = np.nonzero(valid)
+                np.add.at(hist, (c, bins[r, c]), 1)
+            edges = self._edges
+            version = self.version
+
+        metals = {}
+        for i, metal in enumerate(METALS):
+            n = int(count[i])
+            metals[metal] = {
+                "count": n,
+                "mean": float(total[i] / n) if n else None,
+                "min": float(vmin[i]) if n else None,
+                "max": float(vmax[i]) if n else None,
+                "percentiles": {_label(q): _percentile(hist[i], edges[i], vmin[i], vmax[i], q) if n else None
+                                for q in percentiles},
+                "above_moderate": int(exceed[i, 0]),
+                "above_high": int(exceed[i, 1]),
+            }
+        return {"samples": samples, "metals": metals, "cells": cells, "scanned": scanned, "version": version}
+
+
+def _label(q: float) -> str:
+    return f"p{q:g}"
+
+
+def _percentile(hist: np.ndarray, edges: np.ndarray, vmin: float, vmax: float, q: float) -> float:
+    """The q-th percentile from a histogram: located to its bin, interpolated (geometrically) inside it."""
+    cumulative = np.cumsum(hist)
+    n = cumulative[-1]
+    target = min(max(q / 100.0 * n, 0.0), n)
+    if target <= 0:
+        return float(vmin)
+    b = int(np.searchsorted(cumulative, target, side="left"))
+    before = cumulative[b - 1] if b else 0
+    fraction = (target - before) / hist[b]
+    lo = max(edges[b - 1] if b else vmin, vmin)
+    hi = min(edges[b] if b < len(edges) else vmax, vmax)
+    if hi <= lo:
+        return float(lo)
+    if lo > 0:
+        return float(lo * (hi / lo) ** fraction)
+    return float(lo + (hi - lo) * fraction)
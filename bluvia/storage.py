@@ -0,0 +1,256 @@
+import os
+import json
+import uuid
+import shutil
+import threading
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+from .path_utils import get_data_path
+
+MASTER_COLUMNS = ["lat", "lon", "fe_ppm", "cr_ppm", "mn_ppm", "mo_ppm", "in_ppm", "ta_ppm"]
+
+COMPACT_SEGMENTS = int(os.environ.get("BLUVIA_STORE_COMPACT_SEGMENTS", "16"))
+
+
+def _fsync_dir(path: Path) -> None:
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_json_atomic(path: Path, payload: dict) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+
+class ColumnStore:
+    """
+    Append-only store of typed column chunks.
+
+    Each append becomes an immutable segment directory holding one float64
+    .npy file per column. `manifest.json` lists the live segments and is the
+    only file ever replaced, via an atomic rename, so a crash mid-write
+    leaves either the old or the new state. Readers memory-map the segments;
+    a background compaction merges small segments into one.
+    """
+
+    def __init__(self, root: Union[str, Path], columns: List[str] = MASTER_COLUMNS,
+                 compact_segments: int = COMPACT_SEGMENTS):
+        self.root = Path(root)
+        self.columns = list(columns)
+        self.compact_segments = compact_segments
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._cached_key = None
+        self._cached: Optional[Dict[str, np.ndarray]] = None
+        self._compactor: Optional[threading.Thread] = None
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / "manifest.json"
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and, where fcntl exists, processes."""
+        with self._lock:
+            if self._lock_depth or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    self.root.mkdir(parents=True, exist_ok=True)
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "next_id": 1, "rows": 0}
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    @property
+    def version(self) -> int:
+        """Changes whenever the set of segments changes (appends or compaction)."""
+        return self.manifest()["next_id"]
+
+    def __len__(self) -> int:
+        return self.manifest()["rows"]
+
+    def _write_segment(self, seg_id: int, data: Dict[str, np.ndarray], rows: int) -> str:
+        name = f"seg-{seg_id:010d}"
+        tmp = self.root / f".{name}.{uuid.uuid4().hex}.tmp"
+        tmp.mkdir(parents=True)
+        for col in self.columns:
+            with open(tmp / f"{col}.npy", "wb") as f:
+                np.save(f, np.ascontiguousarray(data[col], dtype=np.float64))
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self.root / name)
+        _fsync_dir(self.root)
+        return name
+
+    def append(self, data: Dict[str, np.ndarray]) -> int:
+        """Append equally sized columns as a new segment. Returns rows written."""
+        missing = [c for c in self.columns if c not in data]
+        if missing:
+            raise ValueError(f"Missing columns: {missing}")
+        rows = len(data[self.columns[0]])
+        if any(len(data[c]) != rows for c in self.columns):
+            raise ValueError("All columns must have the same length")
+        if rows == 0:
+            return 0
+        with self._locked():
+            manifest = self.manifest()
+            name = self._write_segment(manifest["next_id"], data, rows)
+            manifest["segments"].append({"name": name, "rows": rows})
+            manifest["next_id"] += 1
+            manifest["rows"] += rows
+            _write_json_atomic(self.manifest_path, manifest)
+            segment_count = len(manifest["segments"])
+        if segment_count > self.compact_segments:
+            self.compact_in_background()
+        return rows
+
+    def append_frame(self, df) -> int:
+        return self.append({c: df[c].to_numpy(dtype=np.float64) for c in self.columns})
+
+    def _load_segment(self, name: str) -> Dict[str, np.ndarray]:
+        return {c: np.load(self.root / name / f"{c}.npy", mmap_mode="r") for c in self.columns}
+
+    def read(self) -> Dict[str, np.ndarray]:
+        """All rows as read-only column arrays (memory-mapped when compacted)."""
+        for _ in range(3):
+            manifest = self.manifest()
+            key = (manifest["next_id"], tuple(s["name"] for s in manifest["segments"]))
+            if key == self._cached_key:
+                return self._cached
+            try:
+                segments = [self._load_segment(s["name"]) for s in manifest["segments"]]
+                break
+            except FileNotFoundError:
+                # A concurrent compaction removed a segment; re-read the manifest
+                continue
+        else:
+            raise RuntimeError(f"Could not read a consistent snapshot of {self.root}")
+        if not segments:
+            data = {c: np.empty(0, dtype=np.float64) for c in self.columns}
+        elif len(segments) == 1:
+            data = segments[0]
+        else:
+            data = {c: np.concatenate([seg[c] for seg in segments]) for c in self.columns}
+        self._cached_key, self._cached = key, data
+        return data
+
+    def read_since(self, start: int) -> Dict[str, np.ndarray]:
+        """
+        Rows from position `start` on, loading only the segments holding
+        them. Appends and compaction both keep rows in order, so a reader
+        that has seen `start` rows gets exactly the new ones.
+        """
+        for _ in range(3):
+            parts = []
+            offset = 0
+            try:
+                for seg in self.manifest()["segments"]:
+                    end = offset + seg["rows"]
+                    if end > start:
+                        data = self._load_segment(seg["name"])
+                        parts.append({c: data[c][max(start - offset, 0):] for c in self.columns})
+                    offset = end
+                break
+            except FileNotFoundError:
+                # A concurrent compaction removed a segment; re-read the manifest
+                continue
+        else:
+            raise RuntimeError(f"Could not read a consistent snapshot of {self.root}")
+        if not parts:
+            return {c: np.empty(0, dtype=np.float64) for c in self.columns}
+        return {c: np.concatenate([part[c] for part in parts]) for c in self.columns}
+
+    def read_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame({c: np.asarray(v) for c, v in self.read().items()}, columns=self.columns)
+
+    def compact(self) -> bool:
+        """Merge all live segments into one. Returns True if anything was merged."""
+        with self._locked():
+            manifest = self.manifest()
+            old = manifest["segments"]
+            if len(old) < 2:
+                return False
+            merged = {c: np.concatenate([self._load_segment(s["name"])[c] for s in old]) for c in self.columns}
+            name = self._write_segment(manifest["next_id"], merged, manifest["rows"])
+            manifest["segments"] = [{"name": name, "rows": manifest["rows"]}]
+            manifest["next_id"] += 1
+            _write_json_atomic(self.manifest_path, manifest)
+        # Old segments are unreferenced now; open memory maps stay valid on POSIX
+        for seg in old:
+            shutil.rmtree(self.root / seg["name"], ignore_errors=True)
+        return True
+
+    def compact_in_background(self) -> None:
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, name="bluvia-compact", daemon=True)
+            self._compactor.start()
+
+    def import_csv(self, csv_path: Union[str, Path]) -> int:
+        """Seed an empty store from a CSV with the master schema."""
+        from .schema import load_csv
+
+        return self.append(load_csv(csv_path, cache=False).require().columns())
+
+
+_master_store: Optional[ColumnStore] = None
+_master_lock = threading.Lock()
+
+
+def get_master_store() -> ColumnStore:
+    """
+    The master dataset store under get_data_path("master_store"). On first
+    use it is seeded from master_csv.csv when that file exists.
+    """
+    global _master_store
+    if _master_store is None:
+        with _master_lock:
+            if _master_store is None:
+                store = ColumnStore(get_data_path("master_store"))
+                legacy_csv = get_data_path("master_csv.csv")
+                if not store.exists() and legacy_csv.exists():
+                    with store._locked():
+                        if not store.exists():
+                            store.import_csv(legacy_csv)
+                _master_store = store
+    return _master_store
@@ -0,0 +1,296 @@
+import os
+import json
+import math
+import time
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from .model import METALS, get_registry, predict_with
+from .path_utils import get_data_path
+
+TILE_STEP_DEG = float(os.environ.get("BLUVIA_TILE_STEP_DEG", "0.002"))
+TILE_PADDING_DEG = float(os.environ.get("BLUVIA_TILE_PADDING_DEG", "0.05"))
+# Grid points per build; over it the extent is trimmed, then the step
+# coarsened up to TILE_MAX_STEP_DEG, and failing both tiling is skipped
+TILE_MAX_CELLS = int(os.environ.get("BLUVIA_TILE_MAX_CELLS", "4000000"))
+TILE_MAX_STEP_DEG = float(os.environ.get("BLUVIA_TILE_MAX_STEP_DEG", "0.01"))
+# Share of points left out at each edge when trimming the extent
+TILE_TRIM_QUANTILE = 0.001
+# How lookup reads the grid: "nearest" returns the closest grid point's value
+# (the model's own output, off only within half a step of a split), which suits
+# the piecewise-constant tree models; "bilinear" blends the four around it,
+# which smooths split boundaries into ramps
+TILE_LOOKUP = os.environ.get("BLUVIA_TILE_LOOKUP", "nearest")
+TILE_CHUNK_ROWS = 64
+TILE_CHECK_INTERVAL = 1.0
+
+
+def tiles_dir() -> Path:
+    return Path(os.environ.get("BLUVIA_TILES_DIR") or get_data_path("tiles"))
+
+
+def data_bounds(padding: float = TILE_PADDING_DEG, trim: float = 0.0) -> Tuple[float, float, float, float]:
+    """
+    (south, west, north, east) covering the master store and
+    soil_sem_data.csv; with `trim`, only the points between the `trim` and
+    1 - `trim` quantiles of each coordinate, so stray far-off rows don't
+    stretch the grid.
+    """
+    from .storage import get_master_store
+
+    lats, lons = [], []
+    data = get_master_store().read()
+    lats.append(np.asarray(data["lat"]))
+    lons.append(np.asarray(data["lon"]))
+    soil = get_data_path("soil_sem_data.csv")
+    if soil.exists():
+        from .schema import load_csv
+
+        soil_data = load_csv(soil)
+        lats.append(soil_data.lat)
+        lons.append(soil_data.lon)
+    lat = np.concatenate(lats)
+    lon = np.concatenate(lons)
+    if not np.isfinite(lat).any():
+        raise ValueError("No coordinates available to derive the tile region")
+    south, north = np.nanquantile(lat, [trim, 1 - trim])
+    west, east = np.nanquantile(lon, [trim, 1 - trim])
+    return float(south) - padding, float(west) - padding, float(north) + padding, float(east) + padding
+
+
+def grid_shape(bounds: Tuple[float, float, float, float], step: float) -> Tuple[int, int]:
+    south, west, north, east = bounds
+    return (int(math.floor((north - south) / step + 1e-9)) + 1,
+            int(math.floor((east - west) / step + 1e-9)) + 1)
+
+
+def plan_grid(bounds: Optional[Tuple[float, float, float, float]] = None, step: float = TILE_STEP_DEG,
+              max_cells: int = TILE_MAX_CELLS,
+              max_step: float = TILE_MAX_STEP_DEG) -> Optional[Tuple[Tuple[float, float, float, float], float]]:
+    """
+    (bounds, step) of a grid with at most `max_cells` points, or None if
+    none fits. Without explicit bounds an over-budget data extent is first
+    trimmed of outliers; then the step is coarsened, but not past
+    `max_step`. Points left outside the grid are predicted directly.
+    """
+    if bounds is None:
+        bounds = data_bounds()
+        rows, cols = grid_shape(bounds, step)
+        if rows * cols > max_cells:
+            bounds = data_bounds(trim=TILE_TRIM_QUANTILE)
+    rows, cols = grid_shape(bounds, step)
+    if rows * cols <= max_cells:
+        return bounds, step
+    coarse = step * math.sqrt(rows * cols / max_cells)
+    while True:
+        rows, cols = grid_shape(bounds, coarse)
+        if rows * cols <= max_cells:
+            break
+        coarse *= 1.01
+    if coarse > max(max_step, step):
+        return None
+    return bounds, coarse
+
+
+class TileGrid:
+    """
+    Precomputed prediction surface: a float32 array of shape
+    (len(METALS), rows, cols) over a regular lat/lon grid, memory-mapped
+    from disk so every process shares the same pages.
+    """
+
+    def __init__(self, meta: Dict[str, Any], values: np.ndarray):
+        self.meta = meta
+        self.values = values
+        self.south = meta["south"]
+        self.west = meta["west"]
+        self.step = meta["step"]
+        self.rows = meta["rows"]
+        self.cols = meta["cols"]
+
+    @property
+    def model_version(self) -> str:
+        return self.meta["model_version"]
+
+    @classmethod
+    def open(cls, meta_path: Union[str, Path]) -> "TileGrid":
+        meta_path = Path(meta_path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return cls(meta, np.load(meta_path.with_name(meta["file"]), mmap_mode="r"))
+
+    def sample(self, lats, lons, method: str = "nearest") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Grid values at each point, from the nearest grid point or by
+        "bilinear" interpolation. Returns ((n, len(METALS)) values,
+        inside-mask); rows outside the grid are NaN.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        fy = (lats - self.south) / self.step
+        fx = (lons - self.west) / self.step
+        inside = (fy >= 0) & (fy <= self.rows - 1) & (fx >= 0) & (fx <= self.cols - 1)
+        out = np.full((len(lats), len(METALS)), np.nan)
+        if not inside.any():
+            return out, inside
+        fy, fx = fy[inside], fx[inside]
+        if method == "nearest":
+            out[inside] = self.values[:, np.rint(fy).astype(np.int64), np.rint(fx).astype(np.int64)].T
+            return out, inside
+        if method != "bilinear":
+            raise ValueError(f"Unknown tile lookup {method!r}")
+        y0 = np.minimum(np.floor(fy).astype(np.int64), self.rows - 2) if self.rows > 1 else np.zeros(len(fy), np.int64)
+        x0 = np.minimum(np.floor(fx).astype(np.int64), self.cols - 2) if self.cols > 1 else np.zeros(len(fx), np.int64)
+        y1 = np.minimum(y0 + 1, self.rows - 1)
+        x1 = np.minimum(x0 + 1, self.cols - 1)
+        wy = (fy - y0)[None, :]
+        wx = (fx - x0)[None, :]
+        v = self.values
+        top = v[:, y0, x0] * (1 - wx) + v[:, y0, x1] * wx
+        bottom = v[:, y1, x0] * (1 - wx) + v[:, y1, x1] * wx
+        out[inside] = (top * (1 - wy) + bottom * wy).T
+        return out, inside
+
+
+def build_grid(model: Any, model_version: str, bounds: Optional[Tuple[float, float, float, float]] = None,
+               step: float = TILE_STEP_DEG, out_dir: Union[str, Path, None] = None,
+               chunk_rows: int = TILE_CHUNK_ROWS, max_cells: int = TILE_MAX_CELLS) -> Optional[Path]:
+    """
+    Evaluate `model` over the grid, `chunk_rows` grid rows at a time, into a
+    memory-mapped .npy file, then publish it by atomically replacing
+    current.json. Returns the metadata path, or None if no grid within
+    `max_cells` covers the data (see plan_grid); lookups then fall back to
+    the model. A grid already built for this model version, bounds and
+    step is reused as-is.
+    """
+    planned = plan_grid(bounds, step, max_cells)
+    if planned is None:
+        print(f"Tile grid skipped: data extent needs more than {max_cells} cells even at {TILE_MAX_STEP_DEG} deg")
+        return None
+    if planned[1] != step:
+        print(f"Tile grid step coarsened from {step} to {planned[1]:.5f} deg to stay within {max_cells} cells")
+    (south, west, north, east), step = planned
+    rows, cols = grid_shape((south, west, north, east), step)
+    out_dir = Path(out_dir) if out_dir else tiles_dir()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    meta = {"model_version": model_version, "south": south, "west": west, "step": step,
+            "rows": rows, "cols": cols, "metals": METALS, "file": f"grid-{model_version}.npy"}
+
+    meta_path = out_dir / f"grid-{model_version}.json"
+    if meta_path.exists():
+        with open(meta_path) as f:
+            previous = json.load(f)
+        if all(previous.get(k) == v for k, v in meta.items()):
+            _publish(out_dir, meta_path)
+            return meta_path
+
+    start = time.perf_counter()
+    tmp = out_dir / f".{meta['file']}.{os.getpid()}.tmp"
+    values = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(METALS), rows, cols))
+    col_lons = west + np.arange(cols) * step
+    for r0 in range(0, rows, chunk_rows):
+        r1 = min(rows, r0 + chunk_rows)
+        grid_lat, grid_lon = np.meshgrid(south + np.arange(r0, r1) * step, col_lons, indexing="ij")
+        pred = predict_with(model, grid_lat.ravel(), grid_lon.ravel())
+        values[:, r0:r1, :] = pred.T.reshape(len(METALS), r1 - r0, cols)
+    values.flush()
+    del values
+    os.replace(tmp, out_dir / meta["file"])
+    meta["build_seconds"] = time.perf_counter() - start
+    meta["built_at"] = time.time()
+    tmp_meta = meta_path.with_name(f".{meta_path.name}.tmp")
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_path)
+    _publish(out_dir, meta_path)
+    _prune(out_dir, keep=meta["file"])
+    return meta_path
+
+
+def _publish(out_dir: Path, meta_path: Path) -> None:
+    tmp = out_dir / ".current.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"meta": meta_path.name}, f)
+    os.replace(tmp, out_dir / "current.json")
+
+
+def _prune(out_dir: Path, keep: str, retain: int = 2) -> None:
+    """Drop all but the newest `retain` grids (open memory maps stay valid)."""
+    grids = sorted(out_dir.glob("grid-*.npy"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in grids[retain:]:
+        if path.name != keep:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+
+
+def build_for_model(model_path: Union[str, Path, None] = None, **kwargs) -> Optional[Path]:
+    """Build (or reuse) the grid for the model currently at `model_path`."""
+    registry = get_registry(model_path)
+    model = registry.get()
+    return build_grid(model, registry.version, **kwargs)
+
+
+class TileService:
+    """
+    Serves the published grid. current.json is re-checked at most once per
+    TILE_CHECK_INTERVAL, so a grid rebuilt by another process after a
+    retrain is picked up without a restart.
+    """
+
+    def __init__(self, directory: Union[str, Path, None] = None):
+        self.directory = Path(directory) if directory else None
+        self._grid: Optional[TileGrid] = None
+        self._pointer_key = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self.directory or tiles_dir()
+
+    def grid(self) -> Optional[TileGrid]:
+        now = time.monotonic()
+        if now - self._last_check < TILE_CHECK_INTERVAL:
+            return self._grid
+        self._last_check = now
+        pointer = self.path / "current.json"
+        try:
+            st = pointer.stat()
+        except FileNotFoundError:
+            return self._grid
+        key = (st.st_mtime_ns, st.st_size)
+        if key != self._pointer_key:
+            with self._lock:
+                try:
+                    with open(pointer) as f:
+                        self._grid = TileGrid.open(self.path / json.load(f)["meta"])
+                    self._pointer_key = key
+                except (FileNotFoundError, ValueError, KeyError):
+                    pass
+        return self._grid
+
+    def lookup(self, lats, lons, model_version: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Grid values (see TILE_LOOKUP) and inside-mask, only if the grid matches `model_version`."""
+        grid = self.grid()
+        if grid is None or model_version is None or grid.model_version != model_version:
+            n = len(np.atleast_1d(lats))
+            return np.full((n, len(METALS)), np.nan), np.zeros(n, dtype=bool)
+        return grid.sample(lats, lons, TILE_LOOKUP)
+
+    def render(self, z: int, x: int, y: int, size: int = 256) -> Optional[np.ndarray]:
+        """Web-mercator tile z/x/y as a float32 (len(METALS), size, size) array."""
+        grid = self.grid()
+        if grid is None:
+            return None
+        n = 2 ** z
+        frac = (np.arange(size) + 0.5) / size
+        lons = (x + frac) / n * 360.0 - 180.0
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + frac) / n))))
+        grid_lat, grid_lon = np.meshgrid(lats, lons, indexing="ij")
+        values, _ = grid.sample(grid_lat.ravel(), grid_lon.ravel(), "bilinear")
+        return values.T.reshape(len(METALS), size, size).astype(np.float32)
+
+
+tile_service = TileService()
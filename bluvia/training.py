@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from .model import METALS
+
+TRAIN_JOBS = int(os.environ.get("BLUVIA_TRAIN_JOBS", "-1"))
+# Fraction of rows held out to score each fit; 0 (the default) skips it, since
+# scoring costs an extra fit on the remaining rows
+VALIDATION_FRACTION = float(os.environ.get("BLUVIA_TRAIN_VALIDATION", "0"))
+# Warm starts stop once a target would pass this many boosting stages; the
+# model is then refit from scratch instead
+MAX_ESTIMATORS = int(os.environ.get("BLUVIA_MAX_TREES", "1000"))
+# Below this many rows a fit is dominated by Python overhead, so worker
+# threads beat process start-up; above it each target gets its own process.
+PROCESS_BACKEND_ROWS = 10000
+
+
+def make_estimator(params: Dict[str, Any], hist: bool = False):
+    """A per-target boosting estimator; `hist` selects HistGradientBoostingRegressor."""
+    if not hist:
+        from sklearn.ensemble import GradientBoostingRegressor
+
+        return GradientBoostingRegressor(**params)
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    hist_params = {
+        "max_iter": params.get("n_estimators", 100),
+        "learning_rate": params.get("learning_rate", 0.1),
+        "max_depth": params.get("max_depth"),
+        "min_samples_leaf": params.get("min_samples_leaf", 20),
+        "random_state": params.get("random_state"),
+    }
+    if params.get("n_iter_no_change"):
+        hist_params.update(early_stopping=True, n_iter_no_change=params["n_iter_no_change"],
+                           validation_fraction=params.get("validation_fraction", 0.1))
+    return HistGradientBoostingRegressor(**hist_params)
+
+
+def _stages(estimator) -> int:
+    return int(getattr(estimator, "n_estimators_", getattr(estimator, "n_iter_", 0)))
+
+
+def can_grow(previous, add_estimators: int, targets: int, max_estimators: int = MAX_ESTIMATORS) -> bool:
+    """Whether `previous` can be warm started with `add_estimators` more stages per target."""
+    estimators = getattr(previous, "estimators_", None)
+    return (add_estimators > 0 and estimators is not None and len(estimators) == targets and
+            all(_stages(est) + add_estimators <= max_estimators for est in estimators))
+
+
+def _grow(estimator, extra: int):
+    """Switch a fitted estimator to warm start with `extra` more boosting stages."""
+    if "max_iter" in estimator.get_params():
+        estimator.set_params(warm_start=True, max_iter=estimator.n_iter_ + extra)
+    else:
+        estimator.set_params(warm_start=True, n_estimators=estimator.n_estimators_ + extra)
+    return estimator
+
+
+def _fit_target(estimator, X, y, val_idx: Optional[np.ndarray], warm: bool,
+                feature_names=None) -> Tuple[Any, Dict[str, Any]]:
+    from copy import deepcopy
+    from sklearn.base import clone
+    from sklearn.metrics import mean_absolute_error, r2_score
+
+    if feature_names is not None:
+        # Keep the column names on every estimator, as MultiOutputRegressor.fit would
+        import pandas as pd
+
+        X = pd.DataFrame(X, columns=feature_names)
+    stats: Dict[str, Any] = {}
+    if val_idx is not None and len(val_idx):
+        train_mask = np.ones(len(y), dtype=bool)
+        train_mask[val_idx] = False
+        start = time.perf_counter()
+        rows = X.iloc if feature_names is not None else X
+        # A warm start is scored by growing a copy of the existing trees on
+        # the training rows, not by refitting from scratch
+        probe = deepcopy(estimator) if warm else clone(estimator)
+        probe.fit(rows[train_mask], y[train_mask])
+        pred = probe.predict(rows[val_idx])
+        stats["validation_seconds"] = time.perf_counter() - start
+        stats["val_mae"] = float(mean_absolute_error(y[val_idx], pred))
+        stats["val_r2"] = float(r2_score(y[val_idx], pred)) if len(val_idx) > 1 else None
+    start = time.perf_counter()
+    fitted = estimator.fit(X, y) if warm else clone(estimator).fit(X, y)
+    stats["fit_seconds"] = time.perf_counter() - start
+    stats["n_estimators"] = _stages(fitted)
+    stats["warm_start"] = warm
+    return fitted, stats
+
+
+def fit_multi_output(X, Y, estimator=None, n_jobs: int = TRAIN_JOBS, previous=None, add_estimators: int = 0,
+                     validation_fraction: float = VALIDATION_FRACTION, random_state: int = 42):
+    """
+    Fit one booster per target column in parallel and assemble them into a
+    fitted MultiOutputRegressor.
+
+    With `previous` (a fitted MultiOutputRegressor) and `add_estimators` > 0
+    each target keeps its existing trees and only boosts `add_estimators`
+    more on X/Y (warm start), unless that would pass MAX_ESTIMATORS stages
+    (see can_grow); then all targets are refit from scratch on X/Y. With `validation_fraction` > 0 a
+    random share of rows is held out for a per-target score (timed
+    separately as validation_seconds) before the final fit on all rows.
+
+    Returns (model, report).
+    """
+    from joblib import Parallel, delayed
+    from sklearn.multioutput import MultiOutputRegressor
+
+    feature_names = list(X.columns) if hasattr(X, "columns") else None
+    target_names = list(Y.columns) if hasattr(Y, "columns") else [f"{m}_ppm" for m in METALS]
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64).reshape(len(X), -1)
+
+    val_idx = None
+    if validation_fraction and len(X) >= 10:
+        rng = np.random.RandomState(random_state)
+        val_idx = rng.choice(len(X), size=max(1, int(len(X) * validation_fraction)), replace=False)
+
+    warm = can_grow(previous, add_estimators, Y.shape[1])
+    if warm:
+        estimators = [_grow(est, add_estimators) for est in previous.estimators_]
+    else:
+        estimators = [estimator] * Y.shape[1]
+
+    start = time.perf_counter()
+    backend = "loky" if len(X) >= PROCESS_BACKEND_ROWS else "threading"
+    results = Parallel(n_jobs=n_jobs, backend=backend)(
+        delayed(_fit_target)(est, X, Y[:, i], val_idx, warm, feature_names) for i, est in enumerate(estimators))
+    wall = time.perf_counter() - start
+
+    model = MultiOutputRegressor(estimator if estimator is not None else previous.estimator, n_jobs=None)
+    model.estimators_ = [fitted for fitted, _ in results]
+    model.n_features_in_ = X.shape[1]
+    if feature_names is not None:
+        model.feature_names_in_ = np.asarray(feature_names, dtype=object)
+
+    report = {
+        "created_at": time.time(),
+        "rows": int(len(X)),
+        "validation_rows": int(len(val_idx)) if val_idx is not None else 0,
+        "estimator": type(model.estimators_[0]).__name__,
+        "warm_start": warm,
+        "n_jobs": n_jobs,
+        "backend": backend,
+        "wall_seconds": wall,
+        "targets": {name: stats for name, (_, stats) in zip(target_names, results)},
+    }
+    return model, report
+
+
+def report_path(model_path: Union[str, Path]) -> Path:
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.name + ".report.json")
+
+
+def write_report(report: Dict[str, Any], model_path: Union[str, Path]) -> Path:
+    """Write the training report next to the model artifact (atomically)."""
+    path = report_path(model_path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def read_report(model_path: Union[str, Path]) -> Optional[Dict[str, Any]]:
+    try:
+        with open(report_path(model_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,81 @@
+import os
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Union
+
+from .geo import NearestIndex
+from .model import METALS, get_registry, predict_with
+from .schema import from_frame, from_store, load_csv
+from .storage import get_master_store
+
+
+def training_arrays(x, y=None):
+    """
+    Pull (lat, lon, values) arrays out of a training frame.
+
+    `x` holds the coordinates; targets are read from `y` if given, else from
+    `x`. Column names follow bluvia.schema (Fe, Fe_ppm, SEM_Fe_ppm, ...).
+    """
+    data = from_frame(x, y)
+    return data.lat, data.lon, np.nan_to_num(data.values, nan=0.0)
+
+
+class StandardErrorIndex:
+    """
+    Absolute prediction residuals of every training point, behind a
+    nearest-neighbour index. The model is evaluated once, in a single batch,
+    when the index is built; a query is then one nearest-neighbour lookup.
+    """
+
+    def __init__(self, model: Any, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        keep = ~(np.isnan(lats) | np.isnan(lons))
+        lats, lons, values = lats[keep], lons[keep], values[keep]
+        if not len(lats):
+            raise ValueError("No training points with valid coordinates")
+        self.residuals = np.abs(predict_with(model, lats, lons) - values)
+        self._nearest = NearestIndex(lats, lons)
+
+    def __len__(self) -> int:
+        return len(self._nearest)
+
+    def query_many(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """(n, len(METALS)) residuals at the training point nearest to each query."""
+        idx, _ = self._nearest.nearest(lats, lons)
+        return self.residuals[idx]
+
+    def query(self, lat: float, lon: float) -> Dict[str, float]:
+        return {metal: float(v) for metal, v in zip(METALS, self.query_many([lat], [lon])[0])}
+
+
+_cache: Dict[str, Any] = {}
+_cache_lock = threading.Lock()
+
+
+def get_se_index(model_path: Union[str, Path, None] = None,
+                 data_path: Union[str, Path, None] = None) -> StandardErrorIndex:
+    """
+    Shared SE index for a model and its training data: a CSV if `data_path`
+    is given, else the master store. Rebuilt only when the model version or
+    the data (CSV mtime/size, store version) changes.
+    """
+    registry = get_registry(model_path)
+    model = registry.get()
+    if data_path:
+        source = str(Path(data_path).absolute())
+        st = os.stat(source)
+        key = (registry.version, st.st_mtime_ns, st.st_size)
+    else:
+        store = get_master_store()
+        source = str(store.root)
+        key = (registry.version, store.version)
+    entry = _cache.get(source)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    with _cache_lock:
+        entry = _cache.get(source)
+        if entry is None or entry[0] != key:
+            data = load_csv(source) if data_path else from_store(store)
+            entry = (key, StandardErrorIndex(model, data.lat, data.lon, np.nan_to_num(data.values, nan=0.0)))
+            _cache[source] = entry
+    return entry[1]
@@ -0,0 +1,214 @@
+import io
+import os
+import csv
+import time
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+from .ingest import RowBatch, USER_DATA_FIELDS, batch_rows
+from .metrics import LOG_COMMIT_SECONDS, LOG_GROUP_BATCHES
+from .schema import normalize_column
+
+FSYNC = os.environ.get("BLUVIA_USER_LOG_FSYNC", "1") == "1"
+HEADER_MAX_BYTES = 1 << 16
+
+
+def _read_header(fd: int) -> List[str]:
+    head = os.pread(fd, HEADER_MAX_BYTES, 0)
+    line = head.split(b"\n", 1)[0].decode("utf-8-sig")
+    return next(csv.reader([line]), [])
+
+
+class UserDataLog:
+    """
+    Append-only log of uploaded samples: the user-data CSV, written by
+    every server process through one writer each.
+
+    `append` queues a batch for this process's committer thread, which
+    takes whatever has queued up while it was busy and commits it as one
+    group under an exclusive flock on the file: a single append write, then
+    fsync. Several uploads, from any worker, therefore never interleave
+    rows or headers, and share one fsync under load.
+
+    A commit's sequence number is the file's length after it. It only ever
+    grows, so readers tail the file from the last sequence they saw (see
+    read_since) instead of re-reading it.
+    """
+
+    def __init__(self, path: Union[str, Path], fieldnames: Optional[List[str]] = None, fsync: bool = FSYNC):
+        self.path = Path(path)
+        self.fieldnames = list(fieldnames or USER_DATA_FIELDS)
+        self.fsync = fsync
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[RowBatch, Future]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closing = False
+        self._local_lock = threading.Lock()
+
+    def append(self, batch: RowBatch) -> int:
+        """Write `batch` durably. Blocks until committed; returns the commit's sequence number."""
+        if not batch.size:
+            return self.sequence()
+        future: Future = Future()
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("User data log is closed")
+            self._start_locked()
+            self._queue.append((batch, future))
+            self._cond.notify()
+        return future.result()
+
+    def _start_locked(self) -> None:
+        # per process: a thread inherited across fork is not running in the child
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="bluvia-user-log", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                group, self._queue = self._queue, []
+            try:
+                sequence = self._commit([batch for batch, _ in group])
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+            else:
+                for _, future in group:
+                    future.set_result(sequence)
+
+    def _commit(self, batches: List[RowBatch]) -> int:
+        start = time.perf_counter()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            with self._local_lock:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                size = os.fstat(fd).st_size
+                out = io.StringIO()
+                writer = csv.writer(out)
+                if size:
+                    header = _read_header(fd)
+                    if not {"lat", "lon"} <= {normalize_column(name) for name in header}:
+                        # rows written under this header would be blank
+                        raise ValueError(f"{self.path} has no lat/lon columns in its header: {header}")
+                    if os.pread(fd, 1, size - 1) != b"\n":
+                        # the file doesn't end in a newline (edited by hand, or a torn write)
+                        out.write("\r\n")
+                else:
+                    header = self.fieldnames
+                    writer.writerow(header)
+                for batch in batches:
+                    writer.writerows(batch_rows(batch, header))
+                data = out.getvalue().encode("utf-8")
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if self.fsync:
+                    os.fsync(fd)
+                # flock is released when fd is closed
+                sequence = size + len(data)
+        finally:
+            os.close(fd)
+        LOG_COMMIT_SECONDS.observe(time.perf_counter() - start, log="user_data")
+        LOG_GROUP_BATCHES.observe(len(batches), log="user_data")
+        return sequence
+
+    def sequence(self) -> int:
+        """Sequence number of the last commit (the file's length)."""
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def close(self) -> None:
+        """Commit what is queued and stop the committer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join()
+
+
+def read_since(path: Union[str, Path], sequence: int, identity=None) -> Tuple[Optional[bytes], bytes, int, tuple]:
+    """
+    Read the log from `sequence` (0: from the start) up to its last
+    complete line. Returns (header line, new data, new sequence, file
+    identity). Pass the identity returned by the previous call: if the file
+    was replaced or truncated since, reading starts over from 0 and the
+    header line is returned again (callers should then drop what they read
+    before). The header line is None when reading from a later sequence.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        current = (st.st_dev, st.st_ino)
+        if current != identity or st.st_size < sequence:
+            sequence = 0
+        f.seek(sequence)
+        data = f.read(st.st_size - sequence)
+    end = data.rfind(b"\n") + 1
+    data = data[:end]
+    header = None
+    if sequence == 0:
+        header, _, data = data.partition(b"\n")
+        header += b"\n"
+        if not end:
+            header = None
+    return header, data, sequence + end, current
+
+
+class LogTail:
+    """Follows the log for one reader, remembering where it stopped (see read_since)."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.reset()
+
+    def reset(self) -> None:
+        self.sequence = 0
+        self.identity = None
+        self.header: Optional[bytes] = None
+
+    def read(self) -> Tuple[bool, bytes]:
+        """
+        The complete rows appended since the last call, as CSV text led by
+        the header line (b"" if there are none), and whether the log was
+        read from its start: on the first call, or because the file was
+        replaced or truncated, which voids the rows read before. Raises
+        FileNotFoundError while there is no file.
+        """
+        header, data, self.sequence, self.identity = read_since(self.path, self.sequence, self.identity)
+        if header is not None:
+            self.header = header
+        if not data or self.header is None:
+            return header is not None, b""
+        return header is not None, self.header + data
+
+
+def parse_rows(data: bytes) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """(lat, lon, values) of the rows with coordinates in CSV text read from the log."""
+    import numpy as np
+    import pandas as pd
+    from .model import METALS
+    from .schema import from_frame
+
+    try:
+        parsed = from_frame(pd.read_csv(io.BytesIO(data))).with_coordinates()
+    except ValueError:
+        return np.empty(0), np.empty(0), np.empty((0, len(METALS)))
+    return parsed.lat, parsed.lon, parsed.values
@@ -0,0 +1,95 @@
+import time
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class WarmUp:
+    """
+    Named start-up steps (loading the model, building indexes, ...) run once,
+    in the order added, with per-step progress for the /healthz endpoint.
+
+    Everything a step loads is also loaded lazily on first use, so a failed
+    step is recorded and the remaining steps still run. The service is ready
+    once every step has finished and no `required` step failed.
+    """
+
+    def __init__(self):
+        self._steps: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    def add(self, name: str, fn: Callable[[], Any], required: bool = True) -> None:
+        self._steps.append({"name": name, "fn": fn, "required": required, "state": "pending",
+                            "seconds": None, "error": None})
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self._started_at is not None:
+                return False
+            self._started_at = time.time()
+            return True
+
+    def _run_steps(self) -> None:
+        try:
+            for step in self._steps:
+                step["state"] = "running"
+                start = time.perf_counter()
+                try:
+                    step["fn"]()
+                    step["state"] = "done"
+                except Exception as e:
+                    step["state"] = "failed"
+                    step["error"] = str(e)
+                    print(f"Warm-up step {step['name']} failed:", e)
+                step["seconds"] = round(time.perf_counter() - start, 4)
+        finally:
+            self._finished_at = time.time()
+            self._done.set()
+
+    def run(self) -> Dict[str, Any]:
+        """Run the steps in this thread (or wait for a run already under way)."""
+        if self._claim():
+            self._run_steps()
+        self._done.wait()
+        return self.status()
+
+    def start(self) -> None:
+        """Run the steps in a background thread, unless they have already run."""
+        if self._claim():
+            threading.Thread(target=self._run_steps, name="bluvia-warmup", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and not any(s["required"] and s["state"] == "failed" for s in self._steps)
+
+    def status(self) -> Dict[str, Any]:
+        if self._started_at is None:
+            status = "pending"
+        elif not self._done.is_set():
+            status = "warming"
+        elif not self.ready:
+            status = "failed"
+        elif any(s["state"] == "failed" for s in self._steps):
+            status = "degraded"
+        else:
+            status = "ready"
+        end = self._finished_at or time.time()
+        return {
+            "status": status,
+            "ready": self.ready,
+            "elapsed_s": round(end - self._started_at, 4) if self._started_at else None,
+            "steps": [{k: s[k] for k in ("name", "state", "required", "seconds", "error")} for s in self._steps],
+        }
+
+
+def import_modules(*names: str) -> Callable[[], None]:
+    """A step importing `names`, so the first request doesn't pay for it."""
+
+    def step():
+        for name in names:
+            importlib.import_module(name)
+
+    return step
@@ -1,5 +1,28 @@
-import uvicorn
+import os
+import sys
+import importlib.util
+
+
+def gunicorn_available() -> bool:
+    # gunicorn only runs on POSIX systems (not on Windows)
+    return os.name == "posix" and importlib.util.find_spec("gunicorn") is not None
+
 
 if __name__ == "__main__":
-    # Run the FastAPI app using Uvicorn
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
+    port = int(os.environ.get("PORT", "8000"))
+    if os.environ.get("BLUVIA_DEV") == "1":
+        # Development: single process with auto-reload
+        import uvicorn
+
+        uvicorn.run("bluvia.api:app", host="0.0.0.0", port=port, reload=True)
+    elif not gunicorn_available():
+        # Without gunicorn: a single uvicorn process, no preloaded workers
+        import uvicorn
+
+        print("gunicorn is not available here; serving with a single uvicorn process")
+        uvicorn.run("bluvia.api:app", host="0.0.0.0", port=port)
+    else:
+        # Production: preloaded gunicorn workers, see bluvia/serve.py
+        from bluvia.serve import main
+
+        sys.exit(main())
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.multioutput import MultiOutputRegressor
+
+from bluvia.compiled import compile_model, export, load_compiled
+
+
+def make_data(n=400, seed=0):
+    rng = np.random.RandomState(seed)
+    X = np.column_stack([rng.uniform(33.2, 33.8, n), rng.uniform(-112.4, -111.8, n)])
+    Y = np.column_stack([np.sin(9 * X[:, 0]) + X[:, 1], np.cos(7 * X[:, 1]), X[:, 0] * X[:, 1]])
+    return X, Y
+
+
+def probe_points(model, X):
+    """Random points plus every split threshold and its neighbours, per feature."""
+    compiled = compile_model(model)
+    split = np.isfinite(compiled.nodes["threshold"])
+    points = [X]
+    for f in range(X.shape[1]):
+        thresholds = compiled.nodes["threshold"][split & (compiled.nodes["feature"] == f)]
+        for t in (thresholds, np.nextafter(thresholds, -np.inf), np.nextafter(thresholds, np.inf)):
+            at = X[np.arange(len(t)) % len(X)].copy()
+            at[:, f] = t
+            points.append(at)
+    return np.concatenate(points)
+
+
+@pytest.mark.parametrize("tabulated", [True, False])
+def test_gbr_matches_sklearn(tabulated):
+    X, Y = make_data()
+    model = MultiOutputRegressor(GradientBoostingRegressor(n_estimators=30, max_depth=3, random_state=0)).fit(X, Y)
+    compiled = compile_model(model)
+    if not tabulated:
+        compiled.table = compiled.edges = None
+    points = probe_points(model, X)
+    np.testing.assert_allclose(compiled.predict(points), model.predict(points), rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("tabulated", [True, False])
+def test_hist_matches_sklearn_with_missing_values(tabulated):
+    X, Y = make_data()
+    X[::7, 0] = np.nan
+    X[::11, 1] = np.nan
+    model = MultiOutputRegressor(HistGradientBoostingRegressor(max_iter=30, random_state=0)).fit(X, Y)
+    compiled = compile_model(model)
+    if not tabulated:
+        compiled.table = compiled.edges = None
+    points = probe_points(model, X)
+    points[::5, 1] = np.nan
+    points[::9] = np.nan
+    np.testing.assert_allclose(compiled.predict(points), model.predict(points), rtol=0, atol=1e-9)
+
+
+def test_load_compiled_rejects_other_version(tmp_path):
+    X, Y = make_data(100)
+    model = MultiOutputRegressor(GradientBoostingRegressor(n_estimators=5)).fit(X, Y)
+    model_path = tmp_path / "model.joblib"
+    export(model, model_path, "v1")
+
+    assert load_compiled(model_path, "v2") is None
+    loaded = load_compiled(model_path, "v1")
+    np.testing.assert_allclose(loaded.predict(X), model.predict(X), rtol=0, atol=1e-9)
@@ -0,0 +1,22 @@
+import numpy as np
+
+from bluvia.evaluation import error_metrics
+from bluvia.model import METALS
+
+
+def test_error_metrics_skip_unmeasured_values():
+    Y = np.full((4, len(METALS)), 10.0)
+    Y[:, 0] = [1.0, 2.0, np.nan, np.nan]
+    Y[:, 1] = np.nan
+    pred = np.full_like(Y, 10.0)
+    pred[:, 0] = [2.0, 2.0, 50.0, 50.0]
+    baseline = np.full_like(Y, 12.0)
+
+    metrics = error_metrics(Y, pred, baseline)
+    first = metrics["metals"][METALS[0]]
+    assert first["rows"] == 2
+    assert first["mae"] == 0.5
+    assert first["baseline_mae"] == 10.5
+    assert metrics["metals"][METALS[1]]["rows"] == 0
+    assert metrics["metals"][METALS[1]]["mae"] is None
+    assert metrics["rel_mae"] == np.mean([0.5 / 10.5] + [0.0] * (len(METALS) - 2))
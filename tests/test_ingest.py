@@ -0,0 +1,34 @@
+import csv
+
+import numpy as np
+
+from bluvia.ingest import RowBatch, batch_rows
+from bluvia.model import METALS, UserDataIndex
+
+LEGACY_HEADER = ["Latitude", "Longitude"] + METALS + ["Notes"]
+
+
+def make_batch():
+    values = np.arange(len(METALS), dtype=np.float64)[None, :] + 10.0
+    values[0, 1] = np.nan
+    return RowBatch(np.array([33.45]), np.array([-112.05]), values, [])
+
+
+def test_batch_rows_fills_legacy_header_columns():
+    (row,) = batch_rows(make_batch(), LEGACY_HEADER)
+    assert row[:2] == ["33.45", "-112.05"]
+    assert row[2] == "10.0" and row[3] == ""
+    assert row[4:8] == ["12.0", "13.0", "14.0", "15.0"]
+    assert row[-1] == ""
+
+
+def test_rows_appended_under_legacy_header_are_indexed(tmp_path):
+    path = tmp_path / "user_data.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(LEGACY_HEADER)
+        writer.writerows(batch_rows(make_batch(), LEGACY_HEADER))
+
+    found = UserDataIndex(path).ensure_loaded().query(33.45, -112.05)
+    assert found is not None
+    assert found[0] == 10.0 and np.isnan(found[1]) and found[-1] == 15.0
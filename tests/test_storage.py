@@ -0,0 +1,84 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from bluvia import storage
+from bluvia.storage import ColumnStore
+
+COLUMNS = ["lat", "lon", "fe_ppm"]
+
+
+def chunk(start, rows):
+    ids = np.arange(start, start + rows, dtype=np.float64)
+    return {"lat": ids, "lon": -ids, "fe_ppm": ids * 10}
+
+
+def make_store(path, chunks=((0, 3), (3, 4), (7, 5))):
+    store = ColumnStore(path, COLUMNS, compact_segments=1000)
+    for start, rows in chunks:
+        store.append(chunk(start, rows))
+    return store
+
+
+def test_append_read_round_trip(tmp_path):
+    store = make_store(tmp_path / "store")
+    data = ColumnStore(tmp_path / "store", COLUMNS).read()
+    assert len(store) == 12
+    np.testing.assert_array_equal(data["lat"], np.arange(12))
+    np.testing.assert_array_equal(data["lon"], -np.arange(12))
+    np.testing.assert_array_equal(data["fe_ppm"], np.arange(12) * 10)
+    assert store.append(chunk(12, 0)) == 0
+    with pytest.raises(ValueError):
+        store.append({"lat": np.zeros(2), "lon": np.zeros(2)})
+
+
+@pytest.mark.parametrize("start", [0, 2, 3, 5, 7, 11, 12, 20])
+def test_read_since_returns_rows_from_offset(tmp_path, start):
+    store = make_store(tmp_path / "store")
+    np.testing.assert_array_equal(store.read_since(start)["lat"], np.arange(start, 12))
+
+
+def test_compaction_preserves_row_order(tmp_path):
+    store = make_store(tmp_path / "store")
+    version = store.version
+    assert store.compact()
+    assert len(store.manifest()["segments"]) == 1
+    assert store.version != version
+    assert [p.name for p in (tmp_path / "store").glob("seg-*")] == [store.manifest()["segments"][0]["name"]]
+    data = store.read()
+    np.testing.assert_array_equal(data["lat"], np.arange(12))
+    np.testing.assert_array_equal(data["fe_ppm"], np.arange(12) * 10)
+    np.testing.assert_array_equal(store.read_since(5)["lon"], -np.arange(5, 12))
+    store.append(chunk(12, 2))
+    np.testing.assert_array_equal(store.read_since(10)["lat"], np.arange(10, 14))
+
+
+def _append_many(root, first, count, rows):
+    store = ColumnStore(root, COLUMNS, compact_segments=1000)
+    for i in range(count):
+        store.append(chunk(first + i * rows, rows))
+
+
+@pytest.mark.skipif(storage.fcntl is None, reason="cross-process locking needs fcntl")
+def test_concurrent_appenders(tmp_path):
+    root = tmp_path / "store"
+    count, rows = 25, 4
+    workers = [multiprocessing.Process(target=_append_many, args=(root, base, count, rows))
+               for base in (0, 10000)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    store = ColumnStore(root, COLUMNS)
+    manifest = store.manifest()
+    assert manifest["rows"] == len(manifest["segments"]) * rows == 2 * count * rows
+    lat = store.read()["lat"]
+    assert sorted(lat) == sorted(list(range(count * rows)) + list(range(10000, 10000 + count * rows)))
+    # every append lands as one contiguous segment, each writer's in order
+    segments = lat.reshape(-1, rows)
+    np.testing.assert_array_equal(np.diff(segments, axis=1), 1)
+    for low in (lat[lat < 10000], lat[lat >= 10000]):
+        np.testing.assert_array_equal(np.diff(low), 1)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from bluvia.ingest import RowBatch
+from bluvia.model import METALS, UserDataIndex
+from bluvia.userlog import UserDataLog
+
+
+def make_batch(lat, value):
+    return RowBatch(np.array([lat]), np.array([-112.05]), np.full((1, len(METALS)), value), [])
+
+
+def test_commit_under_legacy_header(tmp_path):
+    path = tmp_path / "user_data.csv"
+    path.write_text("Latitude,Longitude," + ",".join(METALS) + "\n33.40,-112.05,1,1,1,1,1,1\n")
+    log = UserDataLog(path, fsync=False)
+    log._commit([make_batch(33.45, 7.0), make_batch(33.50, 9.0)])
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 4
+    assert lines[2].startswith("33.45,-112.05,7.0")
+    index = UserDataIndex(path).ensure_loaded()
+    assert index.query(33.45, -112.05)[0] == 7.0
+    assert index.query(33.50, -112.05)[-1] == 9.0
+
+
+def test_commit_refuses_header_without_coordinates(tmp_path):
+    path = tmp_path / "user_data.csv"
+    path.write_text("id,comment\n1,x\n")
+    with pytest.raises(ValueError):
+        UserDataLog(path, fsync=False)._commit([make_batch(33.45, 7.0)])
+    assert path.read_text() == "id,comment\n1,x\n"